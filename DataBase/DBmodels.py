@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, LargeBinary, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -6,7 +6,7 @@ from database import Base
 
 class User(Base):
     __tablename__ = "users"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = {"extend_existing": True, "sqlite_autoincrement": True}
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False)
     fullname = Column(String(100), nullable=False)
@@ -20,27 +20,126 @@ class User(Base):
     budgets = relationship(
         "MonthlyBudget", back_populates="user", cascade="all, delete, delete-orphan"
     )
+    monthly_totals = relationship(
+        "ExpenseMonthlyTotal", back_populates="user", cascade="all, delete, delete-orphan"
+    )
+    category_sketches = relationship(
+        "ExpenseCategorySketch", back_populates="user", cascade="all, delete, delete-orphan"
+    )
+    categories = relationship(
+        "Category", back_populates="user", cascade="all, delete, delete-orphan"
+    )
+
+
+#expense categories - the global defaults (user_id NULL) and each user's own ones.
+#names are stored normalized ("Food " -> "food"), see app/categories.py. Ids of users and
+#categories are never reused on SQLite either - the category cache relies on it
+class Category(Base):
+    __tablename__ = "categories"
+    __table_args__ = (
+        UniqueConstraint("user_id", "name", name="uq_categories_user_name"),
+        {"extend_existing": True, "sqlite_autoincrement": True},
+    )
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    user = relationship("User", back_populates="categories")
 
 
 class Expense(Base):
     __tablename__ = "expenses"
-    __table_args__ = {"extend_existing": True}
+    #every per-user query filters on user_id and then date or category. The date index
+    #also carries category_id and amount, so analytics reads a user's expenses from the
+    #index alone (app/analytics.py)
+    __table_args__ = (
+        Index("ix_expenses_user_date_amount", "user_id", "date", "category_id", "amount"),
+        Index("ix_expenses_user_category_date", "user_id", "category_id", "date"),
+        {"extend_existing": True},
+    )
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, nullable=False)
-    category = Column(String(50), nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
     description = Column(String(255))
     amount = Column(Float, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", back_populates="expenses")
+    #lets a cascading user delete remove the expenses before the categories they point to
+    category = relationship("Category")
 
 
+#one budget per user and month - saving a month again updates it (app/budgets.py)
 class MonthlyBudget(Base):
     __tablename__ = "monthly_budgets"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("uq_monthly_budgets_user_month", "user_id", "year", "month", unique=True),
+        {"extend_existing": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     year = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
     budget = Column(Float, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    user = relationship("User", back_populates="budgets")
\ No newline at end of file
+    user = relationship("User", back_populates="budgets")
+
+
+#rollup of expenses per (user, year, month, category) - kept up to date by the expense routes
+class ExpenseMonthlyTotal(Base):
+    __tablename__ = "expense_monthly_totals"
+    __table_args__ = {"extend_existing": True}
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    #no foreign key - derived data, rebuilt from the expenses (app/rollup.py)
+    category_id = Column(Integer, primary_key=True)
+    total = Column(Float, nullable=False, default=0)
+    expense_count = Column(Integer, nullable=False, default=0)
+    user = relationship("User", back_populates="monthly_totals")
+
+
+#quantile sketch of the expense amounts per (user, category) - kept up to date by the
+#expense routes, serialized by app/sketches.py
+class ExpenseCategorySketch(Base):
+    __tablename__ = "expense_category_sketches"
+    __table_args__ = {"extend_existing": True}
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    #no foreign key - derived data, rebuilt from the expenses
+    category_id = Column(Integer, primary_key=True)
+    expense_count = Column(Integer, nullable=False, default=0)
+    sketch = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    user = relationship("User", back_populates="category_sketches")
+
+
+#pending password recovery codes, shared by every worker (see app/recovery_store.py)
+class RecoveryCode(Base):
+    __tablename__ = "recovery_codes"
+    __table_args__ = {"extend_existing": True}
+
+    email = Column(String(255), primary_key=True)
+    code_hash = Column(String(64), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+
+
+#outgoing mail - requests only insert here, app/mailer.py sends it in the background
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    #the sender polls for due messages by (status, next_attempt_at)
+    __table_args__ = (
+        Index("ix_email_outbox_status_next", "status", "next_attempt_at"),
+        {"extend_existing": True},
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending / sending / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+    last_error = Column(String(500))
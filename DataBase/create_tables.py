@@ -1,8 +1,7 @@
 # create_tables.py
-from database import Base, engine
-from DBmodels import User, Expense, MonthlyBudget
+# Creates the tables through the versioned migrations (see migrations.py)
+from migrations import migrate
 
-# Create all tables in the database
-Base.metadata.create_all(bind=engine)
+migrate()
 
 print("Tables created successfully!")
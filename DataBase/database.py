@@ -1,16 +1,210 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 import os
+import threading
+import time
 
 
 DATABASE_URL = os.getenv("DATABASE_URL", "mysql+pymysql://root:password@db/expenses_db")
-engine = create_engine(DATABASE_URL, echo=True)
+
+
+def env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+class PoolStats:
+    #counters fed by the pool below and the engine events, read by /internal/pool
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.checkout_timeouts = 0
+        self.connection_errors = 0
+        self.invalidated = 0
+
+    def record_checkout(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+                return
+            self.checkouts += 1
+            self.checkout_wait_total += waited
+            self.checkout_wait_max = max(self.checkout_wait_max, waited)
+
+    def record_connection_error(self):
+        with self._lock:
+            self.connection_errors += 1
+
+    def record_invalidated(self):
+        with self._lock:
+            self.invalidated += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_wait_avg_ms": round(self.checkout_wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(self.checkout_wait_max * 1000, 3),
+                "checkout_timeouts": self.checkout_timeouts,
+                "connection_errors": self.connection_errors,
+                "invalidated": self.invalidated,
+            }
+
+
+class _TimedCheckout:
+    #times how long a request waits for a connection (including opening a new one)
+    stats = None
+
+    def _do_get(self):
+        if self.stats is None:
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_checkout(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record_checkout(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool - keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(url: str, pool_class=InstrumentedQueuePool) -> dict:
+    #pool settings from the environment - size the pool for the number of workers
+    options = {
+        "echo": env_flag("DB_ECHO", False),
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", True),
+        # below MySQL's wait_timeout (8 hours by default) so the server never closes an idle connection first
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    if make_url(url).database in (None, "", ":memory:"):
+        # in-memory SQLite keeps its single-connection pool
+        return options
+    options.update({
+        "poolclass": pool_class,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    })
+    return options
+
+
+def instrument_engine(bind, stats: PoolStats):
+    if isinstance(bind.pool, _TimedCheckout):
+        bind.pool.stats = stats
+
+    @event.listens_for(bind, "handle_error")
+    def count_connection_errors(context):
+        # no connection yet means connecting failed; is_disconnect is a dropped connection
+        if context.is_disconnect or context.connection is None:
+            stats.record_connection_error()
+
+    @event.listens_for(bind.pool, "invalidate")
+    def count_invalidated(dbapi_connection, connection_record, exception):
+        stats.record_invalidated()
+
+
+pool_stats = PoolStats()
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+instrument_engine(engine, pool_stats)
 
 
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+# DB_MODE=async serves the database routes from the event loop through an async driver
+DB_MODE = os.getenv("DB_MODE", "sync")
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+async_engine = None
+AsyncSessionLocal = None
+async_pool_stats = None
+if DB_MODE == "async":
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_pool_stats = PoolStats()
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, InstrumentedAsyncQueuePool)
+    )
+    instrument_engine(async_engine.sync_engine, async_pool_stats)
+    # no expiry on commit - an expired attribute would need a lazy load outside the session
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def pool_status(bind, stats: PoolStats) -> dict:
+    pool = bind.pool
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "pool_size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "timeout_s": pool.timeout(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # SQLAlchemy counts unopened pool slots as negative overflow
+            "overflow": max(pool.overflow(), 0),
+        })
+    status.update(stats.snapshot())
+    return status
+
+
+# how long the migration step waits for the database to accept connections
+DB_WAIT_TIMEOUT = float(os.getenv("DB_WAIT_TIMEOUT", "60"))
+
+
+def ping(bind=None):
+    with (bind or engine).connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def wait_for_database(bind=None, timeout: float = DB_WAIT_TIMEOUT, first_delay: float = 0.1, max_delay: float = 2.0) -> float:
+    #retry SELECT 1, doubling the pause up to max_delay; returns the seconds waited
+    started = time.monotonic()
+    delay = first_delay
+    while True:
+        try:
+            ping(bind)
+            return time.monotonic() - started
+        except OperationalError:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                raise
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+
+
 Base = declarative_base()
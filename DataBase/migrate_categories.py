@@ -0,0 +1,110 @@
+# migrate_categories.py
+# Moves an existing database from free-text expenses.category to the categories
+# table: seeds the global defaults, creates a per-user category for every other
+# name in use (normalized - "Food " becomes food), backfills expenses.category_id,
+# drops the old column and rebuilds the monthly rollup by category id. The old column
+# was never validated: a blank name becomes "uncategorized" and a long one is cut.
+# Safe to run again: it does nothing once expenses.category is gone.
+import os
+import sys
+
+from sqlalchemy import inspect, select, text
+
+# shares the app's normalization and defaults, which import the DataBase package
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (os.path.join(ROOT, "app"), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from DataBase.database import engine  # noqa: E402
+from DataBase.DBmodels import Category, Expense, ExpenseMonthlyTotal  # noqa: E402
+from categories import DEFAULT_CATEGORIES, MAX_NAME_LENGTH, seed_default_categories  # noqa: E402
+
+FALLBACK_CATEGORY = "uncategorized"
+
+
+def _legacy_name(raw) -> str:
+    #normalize_category without its API errors - a migration cannot reject stored rows
+    name = " ".join((raw or "").split()).lower()[:MAX_NAME_LENGTH].rstrip()
+    return name or FALLBACK_CATEGORY
+
+
+def _columns(bind, table):
+    return {column["name"] for column in inspect(bind).get_columns(table)}
+
+
+def migrate_categories(bind=engine):
+    if "category" not in _columns(bind, Expense.__tablename__):
+        return {"migrated": False}
+
+    Category.__table__.create(bind=bind, checkfirst=True)
+    seed_default_categories(bind)
+    defaults = {name: category_id for category_id, name in DEFAULT_CATEGORIES.items()}
+
+    with bind.begin() as conn:
+        if "category_id" not in _columns(bind, Expense.__tablename__):
+            conn.execute(text("ALTER TABLE expenses ADD COLUMN category_id INTEGER"))
+
+        # one id per (user, raw text) pair; the raw text may differ only in case or spaces
+        pairs = conn.execute(text("SELECT DISTINCT user_id, category FROM expenses")).all()
+        created = 0
+        for user_id, raw in pairs:
+            name = _legacy_name(raw)
+            category_id = defaults.get(name) or conn.execute(
+                select(Category.id).where(Category.user_id == user_id, Category.name == name)
+            ).scalar()
+            if category_id is None:
+                category_id = conn.execute(
+                    Category.__table__.insert().values(name=name, user_id=user_id)
+                ).inserted_primary_key[0]
+                created += 1
+            conn.execute(
+                text("UPDATE expenses SET category_id = :category_id WHERE user_id = :user_id AND category = :raw"),
+                {"category_id": category_id, "user_id": user_id, "raw": raw},
+            )
+
+    # the old (user_id, category, date) index goes with the column
+    indexes = {index["name"] for index in inspect(bind).get_indexes(Expense.__tablename__)}
+    with bind.begin() as conn:
+        if "ix_expenses_user_category_date" in indexes:
+            if bind.dialect.name == "sqlite":
+                conn.execute(text("DROP INDEX ix_expenses_user_category_date"))
+            else:
+                conn.execute(text("DROP INDEX ix_expenses_user_category_date ON expenses"))
+        # SQLite 3.35+ drops columns in place but cannot add NOT NULL or a foreign key
+        # to an existing column (the app always sets it); MySQL gets both
+        conn.execute(text("ALTER TABLE expenses DROP COLUMN category"))
+        if bind.dialect.name == "mysql":
+            conn.execute(text("ALTER TABLE expenses MODIFY category_id INT NOT NULL"))
+            conn.execute(text(
+                "ALTER TABLE expenses ADD CONSTRAINT fk_expenses_category_id "
+                "FOREIGN KEY (category_id) REFERENCES categories (id)"
+            ))
+        for index in Expense.__table__.indexes:
+            if index.name == "ix_expenses_user_category_date":
+                index.create(bind=conn)
+
+    # the rollup is keyed by category id now - rebuild it from the expenses
+    ExpenseMonthlyTotal.__table__.drop(bind=bind, checkfirst=True)
+    ExpenseMonthlyTotal.__table__.create(bind=bind)
+    with bind.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO expense_monthly_totals (user_id, year, month, category_id, total, expense_count) "
+            "SELECT user_id, year, month, category_id, SUM(amount), COUNT(*) FROM ("
+            " SELECT user_id, CAST(strftime('%Y', date) AS INTEGER) AS year,"
+            " CAST(strftime('%m', date) AS INTEGER) AS month, category_id, amount FROM expenses"
+            ") AS bucketed GROUP BY user_id, year, month, category_id"
+            if bind.dialect.name == "sqlite" else
+            "INSERT INTO expense_monthly_totals (user_id, year, month, category_id, total, expense_count) "
+            "SELECT user_id, YEAR(date), MONTH(date), category_id, SUM(amount), COUNT(*) "
+            "FROM expenses GROUP BY user_id, YEAR(date), MONTH(date), category_id"
+        ))
+    return {"migrated": True, "user_categories": created}
+
+
+if __name__ == "__main__":
+    result = migrate_categories()
+    if result["migrated"]:
+        print(f"Expenses moved to category ids ({result['user_categories']} user categories created)")
+    else:
+        print("Expenses already use category ids")
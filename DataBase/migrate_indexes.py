@@ -0,0 +1,60 @@
+# migrate_indexes.py
+# create_all() does not touch tables that already exist, so databases created
+# before the composite expense indexes or the unique budget key get them from here
+import os
+import sys
+
+from sqlalchemy import inspect, text
+
+# the same module names as the app and the other migration steps (DataBase.*)
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from DataBase.database import engine  # noqa: E402
+from DataBase.DBmodels import Expense, MonthlyBudget  # noqa: E402
+
+# indexes that a wider one in DBmodels.py took the place of
+REPLACED_INDEXES = {
+    "expenses": ("ix_expenses_user_date",),
+}
+
+
+def remove_duplicate_budgets(bind=engine):
+    #before the unique key, saving a month again added a row - keep the newest one
+    with bind.begin() as conn:
+        return conn.execute(text(
+            "DELETE FROM monthly_budgets WHERE id NOT IN ("
+            " SELECT id FROM (SELECT MAX(id) AS id FROM monthly_budgets GROUP BY user_id, year, month) AS newest"
+            ")"
+        )).rowcount
+
+
+def add_missing_indexes(bind=engine):
+    created = []
+    for table in (Expense.__table__, MonthlyBudget.__table__):
+        existing = {index["name"] for index in inspect(bind).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique and table is MonthlyBudget.__table__:
+                remove_duplicate_budgets(bind)
+            # MySQL 8 builds secondary indexes in place, without locking the table
+            index.create(bind=bind)
+            created.append(index.name)
+        # dropped only after their replacement exists, so the queries always have one
+        for name in REPLACED_INDEXES.get(table.name, ()):
+            if name not in existing:
+                continue
+            on_table = f" ON {table.name}" if bind.dialect.name == "mysql" else ""
+            with bind.begin() as conn:
+                conn.execute(text(f"DROP INDEX {name}{on_table}"))
+    return created
+
+
+if __name__ == "__main__":
+    created = add_missing_indexes()
+    if created:
+        print("Created indexes: " + ", ".join(created))
+    else:
+        print("All indexes already exist")
@@ -0,0 +1,97 @@
+# migrations.py
+# Versioned schema changes, each applied once and recorded in schema_migrations.
+# This is the only place that runs DDL: docker-compose runs it once before the app
+# starts (python DataBase/migrations.py), so the workers start without creating or
+# reflecting tables. It waits for the database with backoff instead of a fixed sleep.
+# Every step also works on a database set up before the steps were numbered.
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, inspect, select, text
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (os.path.join(ROOT, "app"), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from DataBase.database import engine, wait_for_database  # noqa: E402
+from DataBase.DBmodels import Base  # noqa: E402
+from DataBase.migrate_categories import migrate_categories  # noqa: E402
+from DataBase.migrate_indexes import add_missing_indexes  # noqa: E402
+from categories import seed_default_categories  # noqa: E402
+from search import create_search_index  # noqa: E402
+from sketches import build_sketches  # noqa: E402
+
+# kept out of Base.metadata, so create_all/drop_all of the models never touch it
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def create_tables(bind):
+    Base.metadata.create_all(bind=bind)
+
+
+MIGRATIONS = [
+    (1, "create_tables", create_tables),
+    (2, "expense_category_ids", migrate_categories),
+    (3, "indexes", add_missing_indexes),
+    (4, "default_categories", seed_default_categories),
+    (5, "expense_search_index", create_search_index),
+    (6, "expense_covering_index", add_missing_indexes),
+    (7, "expense_category_sketches", build_sketches),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(bind=engine) -> int:
+    #0 when no step has run yet
+    if not inspect(bind).has_table(schema_migrations.name):
+        return 0
+    with bind.connect() as conn:
+        return max(conn.execute(select(schema_migrations.c.version)).scalars(), default=0)
+
+
+@contextmanager
+def _migration_lock(bind):
+    #MySQL: one migrating process at a time, e.g. when several containers start together
+    if bind.dialect.name != "mysql":
+        yield
+        return
+    with bind.connect() as conn:
+        conn.execute(text("SELECT GET_LOCK('schema_migrations', 300)"))
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK('schema_migrations')"))
+
+
+def migrate(bind=engine) -> list:
+    #apply the pending steps in order; returns their names
+    applied = []
+    with _migration_lock(bind):
+        schema_migrations.create(bind=bind, checkfirst=True)
+        with bind.connect() as conn:
+            done = set(conn.execute(select(schema_migrations.c.version)).scalars())
+        for version, name, step in MIGRATIONS:
+            if version in done:
+                continue
+            step(bind)
+            with bind.begin() as conn:
+                conn.execute(insert(schema_migrations).values(version=version, name=name, applied_at=datetime.utcnow()))
+            applied.append(name)
+    return applied
+
+
+if __name__ == "__main__":
+    waited = wait_for_database(engine)
+    applied = migrate(engine)
+    if applied:
+        print(f"Database ready after {waited:.1f}s, applied: " + ", ".join(applied))
+    else:
+        print(f"Database ready after {waited:.1f}s, schema is up to date (version {LATEST_VERSION})")
@@ -0,0 +1,349 @@
+# analytics.py
+# Server-side analytics for the Analysis page. A user's expenses are read once as
+# columns - day number, category id, amount, id - by a single query and turned into
+# NumPy arrays; rolling sums, month-end forecasts and outliers are then computed on
+# whole arrays (bincount, cumsum, lexsort) instead of looping over rows in Python.
+# The arrays are kept per user and tagged with the user's data version (every write
+# bumps it, see response_cache.py), so the three endpoints share one read and the
+# responses themselves are cached like the dashboard's. New expenses are inserted into
+# the cached arrays by the routes that add them; an edit or delete (or a write on
+# another worker) leaves the arrays stale and the next request reads them again.
+import itertools
+import os
+import threading
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import cast, func, Integer, literal_column, select
+from sqlalchemy.orm import Session
+
+from DataBase.database import SessionLocal
+from DataBase.DBmodels import Expense
+from async_db import db_route
+from categories import category_cache
+from response_cache import response_cache
+from user_cache import resolve_user_id
+
+ANALYTICS_CACHE_USERS = int(os.getenv("ANALYTICS_CACHE_USERS", "64"))
+ROLLING_WINDOWS = (7, 30)
+MAX_ROLLING_DAYS = 3660
+# categories with fewer expenses than this are not checked for outliers
+OUTLIER_MIN_SAMPLES = 5
+OUTLIER_METHODS = {"zscore": 3.0, "iqr": 1.5}
+
+
+def _day_number(dialect: str):
+    #the date as date.toordinal() in SQL - no date objects are built per row
+    if dialect == "mysql":
+        return func.to_days(Expense.date) - 365
+    return cast(func.julianday(Expense.date) - literal_column("1721424.5"), Integer)
+
+
+class ExpenseColumns:
+    #one user's expenses sorted by day; parallel arrays
+    __slots__ = ("days", "category_ids", "amounts", "ids", "_by_category")
+
+    def __init__(self, days, category_ids, amounts, ids):
+        self.days = days
+        self.category_ids = category_ids
+        self.amounts = amounts
+        self.ids = ids
+        self._by_category = None
+
+    def __len__(self):
+        return len(self.days)
+
+    def with_rows(self, rows: list) -> "ExpenseColumns":
+        #a copy with (date, category id, amount, id) rows inserted, each after the
+        # expenses already on its day
+        rows = sorted((day.toordinal(), category_id, amount, expense_id) for day, category_id, amount, expense_id in rows)
+        days, category_ids, amounts, ids = (np.array(values) for values in zip(*rows))
+        at = np.searchsorted(self.days, days, side="right")
+        return ExpenseColumns(
+            np.insert(self.days, at, days), np.insert(self.category_ids, at, category_ids),
+            np.insert(self.amounts, at, amounts), np.insert(self.ids, at, ids),
+        )
+
+    def by_category(self):
+        #(order, starts, counts): the expenses ordered by (category, amount) and where each
+        # category's run starts. Sorted once per cached read; two threads may both sort
+        if self._by_category is None:
+            order = np.lexsort((self.amounts, self.category_ids))
+            categories = self.category_ids[order]
+            starts = np.flatnonzero(np.r_[True, categories[1:] != categories[:-1]])
+            counts = np.diff(np.r_[starts, len(order)])
+            self._by_category = (order, starts, counts)
+        return self._by_category
+
+
+def read_columns(db: Session, user_id: int) -> ExpenseColumns:
+    #served by ix_expenses_user_date_amount alone; the rows are plain numbers, so they
+    # are taken from the driver's cursor without building a Row for each
+    day = _day_number(db.get_bind().dialect.name)
+    result = db.connection().execute(
+        select(day, Expense.category_id, Expense.amount, Expense.id)
+        .where(Expense.user_id == user_id)
+        .order_by(Expense.date, Expense.id)
+    )
+    try:
+        rows = result.cursor.fetchall()
+    finally:
+        result.close()
+    flat = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=4 * len(rows))
+    table = flat.reshape(len(rows), 4)
+    return ExpenseColumns(
+        table[:, 0].astype(np.int64), table[:, 1].astype(np.int64), table[:, 2].copy(), table[:, 3].astype(np.int64)
+    )
+
+
+class ColumnCache:
+    def __init__(self, max_users: int = ANALYTICS_CACHE_USERS):
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user id -> (data version, ExpenseColumns)
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user_id: int) -> ExpenseColumns:
+        # the version is read before the query - a write in between makes the entry stale, never wrong
+        version = response_cache.versions.get(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+        columns = read_columns(db, user_id)
+        with self._lock:
+            self._entries[user_id] = (version, columns)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return columns
+
+    def holds(self, user_ids) -> bool:
+        with self._lock:
+            return any(user_id in self._entries for user_id in user_ids)
+
+    def append(self, user_id: int, versions: tuple, rows: list):
+        #after an insert was committed and bumped the user from versions[0] to versions[1]:
+        # an entry at versions[0] saw every write but this one, so taking the new rows
+        # keeps it current. A read that ran between the commit and the bump may hold
+        # some of the rows already - they are not added twice
+        previous, current = versions
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != previous:
+                return
+            columns = entry[1]
+        seen = np.isin(np.fromiter((row[3] for row in rows), dtype=np.int64, count=len(rows)), columns.ids)
+        rows = [row for row, known in zip(rows, seen) if not known]
+        if rows:
+            columns = columns.with_rows(rows)
+        with self._lock:
+            if self._entries.get(user_id) is entry:
+                self._entries[user_id] = (current, columns)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+column_cache = ColumnCache()
+
+
+def rolling_spend(columns: ExpenseColumns, end: date, days: int, windows=ROLLING_WINDOWS) -> list:
+    #spent per day and the trailing sums over each window, for the `days` days up to end
+    last = end.toordinal()
+    first = last - days + 1
+    start = first - max(windows) + 1  # the earliest day a window reaches back to
+    lo, hi = np.searchsorted(columns.days, [start, last + 1])
+    daily = np.bincount(columns.days[lo:hi] - start, weights=columns.amounts[lo:hi], minlength=last - start + 1)
+    cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+    offset = first - start
+    series = {"spent": daily[offset:]}
+    for window in windows:
+        # sum of daily[i - window + 1 .. i] for every i in the range
+        index = np.arange(offset, len(daily)) + 1
+        series[f"spent_{window}d"] = cumulative[index] - cumulative[index - window]
+    values = {key: np.round(value, 2).tolist() for key, value in series.items()}
+    return [
+        dict({"date": date.fromordinal(first + i).isoformat()}, **{key: values[key][i] for key in values})
+        for i in range(days)
+    ]
+
+
+def month_end_forecast(columns: ExpenseColumns, today: date) -> dict:
+    #each category's spending so far this month, extended at the same daily pace to the month's end
+    month_start = today.replace(day=1)
+    days_in_month = monthrange(today.year, today.month)[1]
+    elapsed = today.day
+    lo, hi = np.searchsorted(columns.days, [month_start.toordinal(), today.toordinal() + 1])
+    category_ids, index = np.unique(columns.category_ids[lo:hi], return_inverse=True)
+    spent = np.bincount(index, weights=columns.amounts[lo:hi], minlength=len(category_ids))
+    forecast = spent / elapsed * days_in_month
+    return {
+        "category_ids": category_ids.tolist(),
+        "spent": np.round(spent, 2).tolist(),
+        "daily_pace": np.round(spent / elapsed, 2).tolist(),
+        "forecast": np.round(forecast, 2).tolist(),
+        "total_spent": round(float(spent.sum()), 2),
+        "total_forecast": round(float(forecast.sum()), 2),
+        "days_elapsed": elapsed,
+        "days_in_month": days_in_month,
+    }
+
+
+def _quantile(sorted_amounts, starts, counts, q: float):
+    #per-run quantile with linear interpolation, like np.quantile's default
+    position = starts + q * (counts - 1)
+    below = np.floor(position).astype(np.int64)
+    above = np.minimum(below + 1, starts + counts - 1)
+    return sorted_amounts[below] + (sorted_amounts[above] - sorted_amounts[below]) * (position - below)
+
+
+def find_outliers(columns: ExpenseColumns, method: str, threshold: float) -> tuple:
+    #(positions into columns, score) of the outliers, most extreme first; each expense
+    # is compared with the other expenses of its category
+    if len(columns) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    order, starts, counts = columns.by_category()
+    amounts = columns.amounts[order]
+    group = np.repeat(np.arange(len(starts)), counts)
+    enough = (counts >= OUTLIER_MIN_SAMPLES)[group]
+    if method == "zscore":
+        sums = np.add.reduceat(amounts, starts)
+        squares = np.add.reduceat(amounts * amounts, starts)
+        mean = sums / counts
+        std = np.sqrt(np.maximum(squares / counts - mean * mean, 0.0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            score = np.abs(amounts - mean[group]) / std[group]
+        flagged = enough & (std[group] > 0) & (score > threshold)
+    else:
+        q1 = _quantile(amounts, starts, counts, 0.25)
+        q3 = _quantile(amounts, starts, counts, 0.75)
+        iqr = q3 - q1
+        low = (q1 - threshold * iqr)[group]
+        high = (q3 + threshold * iqr)[group]
+        # how many IQRs beyond the fence
+        with np.errstate(divide="ignore", invalid="ignore"):
+            score = np.maximum(low - amounts, amounts - high) / iqr[group]
+        flagged = enough & (iqr[group] > 0) & ((amounts < low) | (amounts > high))
+    positions = order[flagged]
+    scores = score[flagged]
+    most_extreme = np.argsort(-scores, kind="stable")
+    return positions[most_extreme], scores[most_extreme]
+
+
+analytics_router = APIRouter(prefix="/analytics")
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _user_id(db: Session, username: str) -> int:
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_id
+
+
+# GET: spending per day with trailing 7 and 30 day sums
+@analytics_router.get("/rolling")
+@db_route
+def get_rolling_spend(
+    request: Request,
+    username: str = Query(...),
+    days: int = Query(90, ge=1, le=MAX_ROLLING_DAYS),
+    end_date: Optional[date] = Query(None),
+    db: Session = Depends(get_db),
+):
+    user_id = _user_id(db, username)
+    end_date = end_date or date.today()
+
+    def rolling():
+        columns = column_cache.get(db, user_id)
+        return {"end_date": end_date.isoformat(), "series": rolling_spend(columns, end_date, days)}
+
+    return response_cache.respond(request, user_id, "analytics_rolling", (days, end_date), rolling)
+
+
+# GET: where each category's spending will end this month at the current pace
+@analytics_router.get("/forecast")
+@db_route
+def get_month_end_forecast(
+    request: Request,
+    username: str = Query(...),
+    today: Optional[date] = Query(None),
+    db: Session = Depends(get_db),
+):
+    user_id = _user_id(db, username)
+    today = today or date.today()
+
+    def forecast():
+        result = month_end_forecast(column_cache.get(db, user_id), today)
+        names = category_cache.names(db, result["category_ids"])
+        categories = [
+            {"category": names[category_id], "spent": spent, "daily_pace": pace, "forecast": value}
+            for category_id, spent, pace, value in zip(
+                result["category_ids"], result["spent"], result["daily_pace"], result["forecast"]
+            )
+        ]
+        return {
+            "month": today.strftime("%Y-%m"),
+            "days_elapsed": result["days_elapsed"],
+            "days_in_month": result["days_in_month"],
+            "spent": result["total_spent"],
+            "forecast": result["total_forecast"],
+            "categories": sorted(categories, key=lambda c: -c["forecast"]),
+        }
+
+    return response_cache.respond(request, user_id, "analytics_forecast", (today,), forecast)
+
+
+# GET: unusually large (or small) expenses for their category
+@analytics_router.get("/outliers")
+@db_route
+def get_outliers(
+    request: Request,
+    username: str = Query(...),
+    method: str = Query("zscore"),
+    threshold: Optional[float] = Query(None, gt=0),
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    if method not in OUTLIER_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of: {', '.join(OUTLIER_METHODS)}")
+    user_id = _user_id(db, username)
+    threshold = threshold or OUTLIER_METHODS[method]
+
+    def outliers():
+        columns = column_cache.get(db, user_id)
+        positions, scores = find_outliers(columns, method, threshold)
+        positions, scores = positions[:limit], scores[:limit]
+        names = category_cache.names(db, columns.category_ids[positions].tolist())
+        return {
+            "method": method,
+            "threshold": threshold,
+            "outliers": [
+                {
+                    "id": expense_id,
+                    "date": date.fromordinal(day).isoformat(),
+                    "category": names[category_id],
+                    "amount": amount,
+                    "score": round(score, 2),
+                }
+                for expense_id, day, category_id, amount, score in zip(
+                    columns.ids[positions].tolist(), columns.days[positions].tolist(),
+                    columns.category_ids[positions].tolist(), columns.amounts[positions].tolist(), scores.tolist(),
+                )
+            ],
+        }
+
+    return response_cache.respond(request, user_id, "analytics_outliers", (method, threshold, limit), outliers)
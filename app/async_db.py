@@ -0,0 +1,42 @@
+# async_db.py
+# DB_MODE=async: database routes become async def and run on the event loop.
+# The route body stays the same sync code, executed through AsyncSession.run_sync -
+# every statement it sends is awaited on the async driver (aiosqlite / aiomysql)
+# instead of holding one of the threadpool workers for the whole round trip.
+import functools
+import inspect
+
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from DataBase.database import DB_MODE, AsyncSessionLocal
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def make_async_route(func, get_session=get_async_db):
+    #same parameters as func, but db comes from the async session dependency
+    func = inspect.unwrap(func)
+    signature = inspect.signature(func)
+    parameters = [
+        param.replace(annotation=AsyncSession, default=Depends(get_session)) if param.name == "db" else param
+        for param in signature.parameters.values()
+    ]
+
+    @functools.wraps(func)
+    async def route(**kwargs):
+        db = kwargs.pop("db")
+        return await db.run_sync(lambda session: func(db=session, **kwargs))
+
+    route.__signature__ = signature.replace(parameters=parameters)
+    return route
+
+
+def db_route(func):
+    #only for routes whose blocking work is database I/O - bcrypt or SMTP would stall the loop
+    if DB_MODE == "async":
+        return make_async_route(func)
+    return func
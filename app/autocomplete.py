@@ -0,0 +1,163 @@
+# autocomplete.py
+# Prefix suggestions for the expense form, answered from memory. Each user gets two
+# tries - descriptions and category names - where every entry counts how many of
+# the user's expenses use it, so the most used completions come first. A user's
+# tries are built from one grouped query on the first request and then kept in step
+# by the expense routes; the least recently used users are dropped beyond
+# AUTOCOMPLETE_MAX_USERS. The best completions of a prefix are kept on its node
+# until an entry below it changes, so a repeated prefix is a dictionary walk.
+import heapq
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from DataBase.DBmodels import Expense
+from categories import category_cache
+
+AUTOCOMPLETE_MAX_USERS = int(os.getenv("AUTOCOMPLETE_MAX_USERS", "1000"))
+MAX_SUGGESTIONS = 10
+
+
+def normalize_text(value: Optional[str]) -> str:
+    return " ".join((value or "").split()).lower()
+
+
+class _Node:
+    __slots__ = ("children", "count", "best")
+
+    def __init__(self):
+        self.children = {}
+        self.count = 0
+        # top MAX_SUGGESTIONS (text, count) below this node; None until asked, reset on change
+        self.best = None
+
+
+class FrequencyTrie:
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, text: str, delta: int = 1):
+        if not text:
+            return
+        node = self.root
+        node.best = None
+        for char in text:
+            node = node.children.setdefault(char, _Node())
+            node.best = None
+        node.count = max(node.count + delta, 0)
+
+    def complete(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> list:
+        #[(text, count)], most used first, ties alphabetically
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if node.best is None:
+            node.best = heapq.nsmallest(MAX_SUGGESTIONS, self._entries(node, prefix), key=lambda e: (-e[1], e[0]))
+        return node.best[:limit]
+
+    @staticmethod
+    def _entries(node: _Node, prefix: str):
+        stack = [(node, prefix)]
+        while stack:
+            node, text = stack.pop()
+            if node.count > 0:
+                yield text, node.count
+            for char, child in node.children.items():
+                stack.append((child, text + char))
+
+
+class AutocompleteIndex:
+    def __init__(self, max_users: int = AUTOCOMPLETE_MAX_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()  # user id -> {"descriptions": trie, "categories": trie}
+        # user id -> [builds running, writes since the first began]: a build that
+        # overlapped a write may have missed it and is not kept
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def _build(self, db: Session, user_id: int) -> dict:
+        descriptions = FrequencyTrie()
+        categories = FrequencyTrie()
+        rows = (
+            db.query(Expense.description, func.count(Expense.id).label("uses"))
+            .filter(Expense.user_id == user_id)
+            .group_by(Expense.description)
+            .all()
+        )
+        for row in rows:
+            descriptions.add(normalize_text(row.description), row.uses)
+        rows = (
+            db.query(Expense.category_id, func.count(Expense.id).label("uses"))
+            .filter(Expense.user_id == user_id)
+            .group_by(Expense.category_id)
+            .all()
+        )
+        names = category_cache.names(db, (row.category_id for row in rows))
+        for row in rows:
+            categories.add(names[row.category_id], row.uses)
+        return {"descriptions": descriptions, "categories": categories}
+
+    def _tries(self, db: Session, user_id: int) -> dict:
+        with self._lock:
+            tries = self._users.get(user_id)
+            if tries is not None:
+                self._users.move_to_end(user_id)
+                return tries
+            building = self._building.setdefault(user_id, [0, 0])
+            building[0] += 1
+        tries = None
+        try:
+            tries = self._build(db, user_id)
+        finally:
+            with self._lock:
+                building[0] -= 1
+                if building[0] == 0:
+                    del self._building[user_id]
+                if tries is not None and building[1] == 0:
+                    self._users[user_id] = tries
+                    while len(self._users) > self.max_users:
+                        self._users.popitem(last=False)
+        return tries
+
+    def suggest(self, db: Session, user_id: int, prefix: str, limit: int = MAX_SUGGESTIONS) -> dict:
+        prefix = normalize_text(prefix)
+        tries = self._tries(db, user_id)
+        with self._lock:
+            return {
+                kind: [{"text": text, "count": count} for text, count in trie.complete(prefix, limit)]
+                for kind, trie in tries.items()
+            }
+
+    def record(self, user_id: int, entries: Iterable[tuple], delta: int = 1):
+        #entries: (description, category name) of expenses added (delta 1) or removed (-1)
+        with self._lock:
+            if user_id in self._building:
+                self._building[user_id][1] += 1
+            tries = self._users.get(user_id)
+            if tries is None:
+                return  # built from the database on the next request
+            for description, category in entries:
+                tries["descriptions"].add(normalize_text(description), delta)
+                tries["categories"].add(category, delta)
+
+    def forget(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+            if user_id in self._building:
+                self._building[user_id][1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self) -> dict:
+        return {"users": len(self._users), "max_users": self.max_users}
+
+
+autocomplete_index = AutocompleteIndex()
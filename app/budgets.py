@@ -0,0 +1,65 @@
+# budgets.py
+# One budget per (user, year, month), enforced by a unique index: saving a month
+# again replaces its amount with a single INSERT ... ON CONFLICT / ON DUPLICATE KEY
+# statement, and a whole year is saved as one multi-row statement. The yearly status
+# reads budgets and the spending rollup for all twelve months in one joined query.
+from typing import Dict, Optional
+
+from sqlalchemy import func, literal, select, union_all
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from DataBase.DBmodels import ExpenseMonthlyTotal, MonthlyBudget
+
+MONTHS = range(1, 13)
+
+
+def upsert_budgets(db: Session, user_id: int, year: int, budgets: Dict[int, float]):
+    #month -> amount; existing months are overwritten, the others inserted - one statement
+    table = MonthlyBudget.__table__
+    rows = [
+        {"year": year, "month": month, "budget": amount, "user_id": user_id}
+        for month, amount in sorted(budgets.items())
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(budget=stmt.inserted.budget)
+    else:
+        stmt = sqlite_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "year", "month"],
+            set_={"budget": stmt.excluded.budget},
+        )
+    db.execute(stmt)
+
+
+def yearly_status(db: Session, user_id: int, year: int) -> list:
+    #budget vs spent for each month of the year; budget is None where none was set
+    months = union_all(*(select(literal(month).label("month")) for month in MONTHS)).subquery("months")
+    spent = (
+        select(ExpenseMonthlyTotal.month, func.sum(ExpenseMonthlyTotal.total).label("spent"))
+        .where(ExpenseMonthlyTotal.user_id == user_id, ExpenseMonthlyTotal.year == year)
+        .group_by(ExpenseMonthlyTotal.month)
+        .subquery("spent")
+    )
+    rows = db.execute(
+        select(months.c.month, MonthlyBudget.budget, func.coalesce(spent.c.spent, 0).label("spent"))
+        .select_from(months)
+        .outerjoin(MonthlyBudget, (MonthlyBudget.user_id == user_id)
+                   & (MonthlyBudget.year == year) & (MonthlyBudget.month == months.c.month))
+        .outerjoin(spent, spent.c.month == months.c.month)
+        .order_by(months.c.month)
+    ).all()
+    return [_status(year, row.month, row.budget, float(row.spent)) for row in rows]
+
+
+def _status(year: int, month: int, budget: Optional[float], spent: float) -> dict:
+    return {
+        "year": year,
+        "month": month,
+        "monthly_budget": budget,
+        "total_expenses": spent,
+        "remaining_budget": None if budget is None else budget - spent,
+    }
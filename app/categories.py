@@ -0,0 +1,147 @@
+# categories.py
+# Expenses point at the categories table by integer id; the API keeps speaking names.
+# A name is normalized before lookup ("Food " and "food" are the same category), found
+# among the global defaults first and then among the user's own categories, and an
+# unknown name becomes a new category of that user. Categories are never renamed, so
+# id <-> name pairs are cached in-process. A user's own categories go away with the user:
+# delete_user drops them from this process's cache (forget_user), and ids are never
+# reused (AUTOINCREMENT on SQLite), so another process's stale entries can never point
+# at somebody else's category.
+import threading
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from DataBase.DBmodels import Category
+
+# global defaults with fixed ids, so every process (and a concurrent first start)
+# agrees on them without coordination
+DEFAULT_CATEGORIES = {1: "food", 2: "transport", 3: "entertainment", 4: "health"}
+MAX_NAME_LENGTH = 50
+
+
+def normalize_category(name: str) -> str:
+    normalized = " ".join((name or "").split()).lower()
+    if not normalized:
+        raise HTTPException(status_code=400, detail="Category is required")
+    if len(normalized) > MAX_NAME_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Category must be at most {MAX_NAME_LENGTH} characters")
+    return normalized
+
+
+def seed_default_categories(bind) -> int:
+    #insert the missing defaults; safe to run any number of times, from any number of workers
+    created = 0
+    with bind.connect() as conn:
+        existing = set(conn.execute(select(Category.id).where(Category.user_id.is_(None))).scalars())
+    for category_id, name in DEFAULT_CATEGORIES.items():
+        if category_id in existing:
+            continue
+        try:
+            with bind.begin() as conn:
+                conn.execute(insert(Category.__table__).values(id=category_id, name=name, user_id=None))
+            created += 1
+        except IntegrityError:
+            pass  # another worker inserted it first
+    return created
+
+
+class CategoryCache:
+    def __init__(self):
+        self._names: Dict[int, str] = {}
+        # (user id or None for the defaults, name) -> id
+        self._ids: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+        self._defaults_ready = False
+
+    def _remember(self, category_id: int, user_id: Optional[int], name: str):
+        with self._lock:
+            self._names[category_id] = name
+            self._ids[(user_id, name)] = category_id
+
+    def _ensure_defaults(self, db: Session):
+        if self._defaults_ready:
+            return
+        rows = db.query(Category.id, Category.name).filter(Category.user_id.is_(None)).all()
+        if len(rows) < len(DEFAULT_CATEGORIES):
+            seed_default_categories(db.get_bind())
+            rows = db.query(Category.id, Category.name).filter(Category.user_id.is_(None)).all()
+        for row in rows:
+            self._remember(row.id, None, row.name)
+        self._defaults_ready = True
+
+    def resolve(self, db: Session, user_id: Optional[int], name: str, create: bool = False) -> Optional[int]:
+        #name -> id; with create=True an unknown name becomes a category of user_id
+        name = normalize_category(name)
+        self._ensure_defaults(db)
+        category_id = self._ids.get((None, name)) or self._ids.get((user_id, name))
+        if category_id is not None:
+            return category_id
+        row = db.query(Category.id).filter(Category.user_id == user_id, Category.name == name).first()
+        if row is None:
+            if not create:
+                return None
+            return self._create(db, user_id, name)
+        self._remember(row.id, user_id, name)
+        return row.id
+
+    def _create(self, db: Session, user_id: int, name: str) -> int:
+        # committed on its own connection: if the request fails later the category
+        # stays (unused), but the cache never holds an id that was rolled back
+        bind = db.get_bind()
+        try:
+            with bind.begin() as conn:
+                category_id = conn.execute(
+                    insert(Category.__table__).values(name=name, user_id=user_id)
+                ).inserted_primary_key[0]
+        except IntegrityError:
+            # created by a concurrent request - or user_id does not exist
+            with bind.connect() as conn:
+                category_id = conn.execute(
+                    select(Category.id).where(Category.user_id == user_id, Category.name == name)
+                ).scalar()
+            if category_id is None:
+                raise HTTPException(status_code=400, detail="User not found")
+        self._remember(category_id, user_id, name)
+        return category_id
+
+    def resolve_many(self, db: Session, user_id: Optional[int], names: Iterable[str]) -> list:
+        #ids of the names that exist (for filters - unknown names match nothing)
+        ids = (self.resolve(db, user_id, name) for name in names)
+        return [category_id for category_id in ids if category_id is not None]
+
+    def names(self, db: Session, category_ids: Iterable[int]) -> Dict[int, str]:
+        #id -> name, one query for whatever is not cached yet
+        category_ids = set(category_ids)
+        missing = [category_id for category_id in category_ids if category_id not in self._names]
+        if missing:
+            self._ensure_defaults(db)
+            missing = [category_id for category_id in missing if category_id not in self._names]
+        if missing:
+            for row in db.query(Category.id, Category.name, Category.user_id).filter(Category.id.in_(missing)):
+                self._remember(row.id, row.user_id, row.name)
+        return {category_id: self._names.get(category_id) for category_id in category_ids}
+
+    def name(self, db: Session, category_id: int) -> Optional[str]:
+        return self.names(db, [category_id])[category_id]
+
+    def forget_user(self, user_id: int):
+        #after the user and their categories were deleted
+        with self._lock:
+            for key in [key for key in self._ids if key[0] == user_id]:
+                self._names.pop(self._ids.pop(key), None)
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self._ids.clear()
+            self._defaults_ready = False
+
+    def stats(self) -> dict:
+        return {"cached": len(self._names)}
+
+
+category_cache = CategoryCache()
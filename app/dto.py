@@ -0,0 +1,118 @@
+# dto.py
+# Read-path row objects and the JSON renderer for list endpoints. Routes select
+# only the columns they return (plain tuples - no entity, no identity map) and wrap
+# them in these __slots__ classes. FastJSONResponse writes them out directly, skipping
+# FastAPI's reflective jsonable_encoder pass. It uses orjson when it is installed
+# (pip install orjson) and the stdlib json module otherwise.
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi.responses import JSONResponse
+
+from DataBase.DBmodels import Expense, MonthlyBudget, User
+
+try:
+    import orjson
+except ImportError:  # optional - the stdlib encoder gives the same output
+    orjson = None
+
+
+class ExpenseRow:
+    __slots__ = ("id", "date", "category", "description", "amount", "user_id")
+
+    # the columns to select; the row's category_id is replaced by the category name
+    COLUMNS = (Expense.id, Expense.date, Expense.category_id, Expense.description, Expense.amount, Expense.user_id)
+
+    def __init__(self, id, date, category, description, amount, user_id):
+        self.id = id
+        self.date = date
+        self.category = category
+        self.description = description
+        self.amount = amount
+        self.user_id = user_id
+
+    @classmethod
+    def from_entity(cls, expense: Expense, category: str) -> "ExpenseRow":
+        return cls(expense.id, expense.date, category, expense.description, expense.amount, expense.user_id)
+
+    @classmethod
+    def from_rows(cls, rows, names: dict) -> list:
+        #rows selected with COLUMNS, names: category id -> name
+        return [cls(row.id, row.date, names[row.category_id], row.description, row.amount, row.user_id) for row in rows]
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "date": self.date.isoformat(),
+            "category": self.category,
+            "description": self.description,
+            "amount": self.amount,
+            "user_id": self.user_id,
+        }
+
+
+class UserRow:
+    #never carries the password hash
+    __slots__ = ("id", "username", "fullname", "email")
+
+    COLUMNS = (User.id, User.username, User.fullname, User.email)
+
+    def __init__(self, id, username, fullname, email):
+        self.id = id
+        self.username = username
+        self.fullname = fullname
+        self.email = email
+
+    @classmethod
+    def from_entity(cls, user: User) -> "UserRow":
+        return cls(user.id, user.username, user.fullname, user.email)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "username": self.username, "fullname": self.fullname, "email": self.email}
+
+
+class BudgetRow:
+    __slots__ = ("id", "year", "month", "budget", "user_id")
+
+    COLUMNS = (MonthlyBudget.id, MonthlyBudget.year, MonthlyBudget.month, MonthlyBudget.budget, MonthlyBudget.user_id)
+
+    def __init__(self, id, year, month, budget, user_id):
+        self.id = id
+        self.year = year
+        self.month = month
+        self.budget = budget
+        self.user_id = user_id
+
+    @classmethod
+    def from_entity(cls, budget: MonthlyBudget) -> "BudgetRow":
+        return cls(budget.id, budget.year, budget.month, budget.budget, budget.user_id)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "year": self.year, "month": self.month, "budget": self.budget, "user_id": self.user_id}
+
+
+def _encode_default(value):
+    #the few types the route payloads hold besides JSON natives
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # SUM() over a MySQL column can come back as Decimal
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def render_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_encode_default)
+    # the same bytes FastAPI's JSONResponse would send
+    return json.dumps(
+        content, default=_encode_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return render_json(content)
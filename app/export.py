@@ -0,0 +1,89 @@
+# export.py
+# streams a user's expenses as CSV / NDJSON straight from a server side cursor,
+# so memory stays flat no matter how long the history is
+import csv
+import io
+import json
+import os
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import or_
+
+from DataBase.database import SessionLocal
+from DataBase.DBmodels import Category, Expense
+from dto import ExpenseRow
+
+# rows fetched from the cursor (and written to the response) per batch
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_COLUMNS = ["id", "date", "category", "description", "amount"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _expense_batches(user_id: int, start_date: Optional[date], end_date: Optional[date]):
+    #own session - the request session is closed while the response is still streaming
+    db = SessionLocal()
+    try:
+        # every name this user can have, read before the stream - a MySQL server side
+        # cursor does not allow other queries on its connection while it is open
+        names = dict(
+            db.query(Category.id, Category.name)
+            .filter(or_(Category.user_id.is_(None), Category.user_id == user_id))
+            .all()
+        )
+        query = db.query(*ExpenseRow.COLUMNS).filter(Expense.user_id == user_id)
+        if start_date:
+            query = query.filter(Expense.date >= start_date)
+        if end_date:
+            query = query.filter(Expense.date <= end_date)
+        # yield_per streams the result (server side cursor on MySQL) instead of buffering it
+        rows = query.order_by(Expense.date, Expense.id).yield_per(EXPORT_BATCH_SIZE)
+        batch = []
+        for row in rows:
+            batch.append(ExpenseRow(row.id, row.date, names.get(row.category_id), row.description, row.amount, row.user_id))
+            if len(batch) == EXPORT_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        db.close()
+
+
+def stream_csv(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for batch in _expense_batches(user_id, start_date, end_date):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            (row.id, row.date.isoformat(), row.category, row.description, row.amount) for row in batch
+        )
+        yield buffer.getvalue()
+
+
+def stream_ndjson(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    for batch in _expense_batches(user_id, start_date, end_date):
+        yield "".join(
+            json.dumps({
+                "id": row.id,
+                "date": row.date.isoformat(),
+                "category": row.category,
+                "description": row.description,
+                "amount": row.amount,
+            }) + "\n"
+            for row in batch
+        )
+
+
+STREAMERS = {
+    "csv": stream_csv,
+    "ndjson": stream_ndjson,
+}
@@ -0,0 +1,48 @@
+# health.py
+# Probes for the orchestrator. /healthz only says the process serves requests (no
+# database access), so a slow database never gets the container restarted.
+# /readyz says whether to send it traffic: the database answers and the schema is at
+# the latest migration (DataBase/migrations.py). Once the schema was seen at the
+# latest version it is not read again - migrations only move forward.
+import logging
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import SQLAlchemyError
+
+from DataBase.database import engine, env_flag, ping
+from DataBase.migrations import LATEST_VERSION, current_version
+
+logger = logging.getLogger(__name__)
+
+# off for databases built with create_all instead of the migrations (tests, scripts)
+READY_REQUIRES_SCHEMA = env_flag("READY_REQUIRES_SCHEMA", True)
+
+health_router = APIRouter()
+
+_schema_ready = False
+
+
+@health_router.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+
+@health_router.get("/readyz")
+def readyz():
+    global _schema_ready
+    status = {"database": "ok"}
+    try:
+        ping(engine)
+        if READY_REQUIRES_SCHEMA and not _schema_ready:
+            version = current_version(engine)
+            status["schema_version"] = version
+            _schema_ready = version >= LATEST_VERSION
+            if not _schema_ready:
+                status["schema"] = f"migrations pending (at {version}, latest {LATEST_VERSION})"
+    except SQLAlchemyError as e:
+        logger.warning("Readiness check failed: %s", e)
+        status["database"] = "unavailable"
+    ready = status["database"] == "ok" and (_schema_ready or not READY_REQUIRES_SCHEMA)
+    status["status"] = "ready" if ready else "not ready"
+    return JSONResponse(status, status_code=200 if ready else 503)
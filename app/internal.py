@@ -0,0 +1,45 @@
+# internal.py
+# operational endpoints (pool sizing, diagnostics) - not used by the frontend
+from fastapi import APIRouter
+
+from DataBase.database import engine, pool_stats, async_engine, async_pool_stats, pool_status
+from user_cache import user_id_cache
+from response_cache import response_cache
+from slow_queries import slow_query_log
+from logs import queue_handler
+from autocomplete import autocomplete_index
+
+internal_router = APIRouter(prefix="/internal")
+
+
+@internal_router.get("/pool")
+def get_pool_status():
+    status = {"sync": pool_status(engine, pool_stats)}
+    if async_engine is not None:
+        status["async"] = pool_status(async_engine.sync_engine, async_pool_stats)
+    return status
+
+
+@internal_router.get("/user-cache")
+def get_user_cache_stats():
+    return user_id_cache.stats()
+
+
+@internal_router.get("/response-cache")
+def get_response_cache_stats():
+    return response_cache.stats()
+
+
+@internal_router.get("/slow-queries")
+def get_slow_queries(limit: int = 50):
+    return {"stats": slow_query_log.stats(), "queries": slow_query_log.entries(limit)}
+
+
+@internal_router.get("/logging")
+def get_logging_stats():
+    return queue_handler.stats()
+
+
+@internal_router.get("/autocomplete")
+def get_autocomplete_stats():
+    return autocomplete_index.stats()
@@ -0,0 +1,208 @@
+# logs.py
+# Structured logging off the request path. Loggers hand records to a QueueHandler;
+# one QueueListener thread formats them as JSON lines and writes them to stdout, so
+# a slow terminal or log collector never holds up a request. Each record carries the
+# request id (X-Request-ID, generated when missing), the route template and the user
+# id once a route resolved it. The queue is bounded: when it is full, DEBUG/INFO
+# records are dropped at once and WARNING+ wait up to LOG_QUEUE_BLOCK seconds.
+# DEBUG records are sampled (LOG_SAMPLE_RATES, e.g. "DEBUG=0.1,INFO=1").
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_QUEUE_BLOCK = float(os.getenv("LOG_QUEUE_BLOCK", "0.05"))
+
+
+def parse_sample_rates(value: str) -> dict:
+    #"DEBUG=0.1,INFO=0.5" -> {10: 0.1, 20: 0.5}; levels not listed are always kept
+    rates = {}
+    for part in value.split(","):
+        if "=" not in part:
+            continue
+        level, rate = part.split("=", 1)
+        rates[logging.getLevelName(level.strip().upper())] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "DEBUG=0.1"))
+
+# request id, route and user of the request running in this context; a dict, so a
+# route body in the threadpool can add the user id to the same request
+_log_context = ContextVar("log_context", default=None)
+
+CONTEXT_FIELDS = ("request_id", "route", "user_id")
+_RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"} | set(CONTEXT_FIELDS)
+
+request_logger = logging.getLogger("request")
+
+
+def bind_log_context(**fields):
+    context = _log_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        # anything passed with extra={...}
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    #runs in the logging thread: sample, attach the context, enqueue without blocking
+    def __init__(self, log_queue: queue.Queue, sample_rates: dict = None, block_timeout: float = LOG_QUEUE_BLOCK):
+        super().__init__(log_queue)
+        self.sample_rates = LOG_SAMPLE_RATES if sample_rates is None else sample_rates
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def filter(self, record):
+        rate = self.sample_rates.get(record.levelno)
+        if rate is not None and rate < 1.0 and random.random() >= rate:
+            self.sampled_out += 1
+            return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        # other handlers may still see the original record, so work on a copy
+        record = copy.copy(record)
+        context = _log_context.get()
+        if context is not None:
+            record.request_id = context["request_id"]
+            record.user_id = context.get("user_id")
+            record.route = getattr(context["scope"].get("route"), "path", None)
+        # args and tracebacks are turned into text here; the listener thread only formats
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if record.levelno >= logging.WARNING and self.block_timeout > 0:
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+                return
+            except queue.Full:
+                pass
+        self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "max_size": self.queue.maxsize,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = StructuredQueueHandler(log_queue)
+_listener = None
+
+
+def _quiet_default_handlers():
+    #echo=True gives the sqlalchemy loggers their own stdout handler - send them through the queue instead
+    for name, logger in list(logging.root.manager.loggerDict.items()):
+        if not name.startswith("sqlalchemy") or not isinstance(logger, logging.Logger):
+            continue
+        for handler in list(logger.handlers):
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+                logger.removeHandler(handler)
+
+
+def configure_logging(level: str = LOG_LEVEL, stream=None):
+    global _listener
+    if _listener is not None:
+        return
+    sink = logging.StreamHandler(stream or sys.stdout)
+    sink.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    _quiet_default_handlers()
+    _listener = QueueListener(log_queue, sink, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    #writes out what is still queued
+    global _listener
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(queue_handler)
+    _listener.stop()
+    _listener = None
+
+
+class RequestContextMiddleware:
+    #gives every request an id (echoed in X-Request-ID) and logs a sampled DEBUG line per request
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = _log_context.set({"request_id": request_id, "scope": scope})
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if request_logger.isEnabledFor(logging.DEBUG):
+                request_logger.debug("request", extra={
+                    "method": scope["method"], "path": scope["path"], "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                })
+            _log_context.reset(token)
@@ -0,0 +1,255 @@
+# mailer.py
+# Outgoing mail goes through the email_outbox table. A request only inserts a row
+# (enqueue_email, committed with the request's own transaction); a background
+# thread claims due rows, sends them over one SMTP session that stays open between
+# messages, and retries failures with exponential backoff. A claim is a lease: rows
+# held by a worker that died become due again when it runs out, so any number of
+# workers can drain the same outbox (delivery is at-least-once). A body can hold a
+# secret (a live recovery code), so it is blanked as soon as the row is sent or failed.
+import logging
+import os
+import smtplib
+import threading
+import time
+from datetime import timedelta
+from email.mime.text import MIMEText
+
+from sqlalchemy import and_, delete, or_, update
+from sqlalchemy.orm import Session
+
+from DataBase.database import SessionLocal, env_flag
+from DataBase.DBmodels import EmailOutbox
+from utiles import utcnow
+
+logger = logging.getLogger(__name__)
+
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", "easssmt@gmail.com")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "oeag bals vjhg punw")
+SMTP_STARTTLS = env_flag("SMTP_STARTTLS", True)
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# close the SMTP session after this many seconds without mail
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USERNAME)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+# retry after 30s, 1m, 2m, 4m ... capped at OUTBOX_RETRY_MAX
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "30"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+# how long a claimed message belongs to one worker before another may take it over
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "120"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def enqueue_email(db: Session, recipient: str, subject: str, body: str) -> EmailOutbox:
+    #the caller commits - the mail is only sent if the request's transaction succeeds
+    now = utcnow()
+    message = EmailOutbox(
+        recipient=recipient, subject=subject, body=body,
+        status=PENDING, attempts=0, next_attempt_at=now, created_at=now,
+    )
+    db.add(message)
+    return message
+
+
+class SmtpSession:
+    #one connection (with STARTTLS and login done once) reused for every message
+    def __init__(self, host: str = SMTP_SERVER, port: int = SMTP_PORT, username: str = SMTP_USERNAME,
+                 password: str = SMTP_PASSWORD, starttls: bool = SMTP_STARTTLS, from_email: str = FROM_EMAIL,
+                 timeout: float = SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.from_email = from_email
+        self.timeout = timeout
+        self.connections = 0
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self.connections += 1
+
+    def send(self, recipient: str, subject: str, body: str):
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = self.from_email
+        msg["To"] = recipient
+        if self._smtp is None:
+            self._connect()
+        self._smtp.sendmail(self.from_email, [recipient], msg.as_string())
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    def close_if_idle(self, idle_timeout: float = SMTP_IDLE_TIMEOUT):
+        if self._smtp is not None and time.monotonic() - self._last_used > idle_timeout:
+            self.close()
+
+
+class OutboxSender:
+    def __init__(self, session_factory=SessionLocal, smtp: SmtpSession = None,
+                 batch_size: int = OUTBOX_BATCH_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 retry_base: float = OUTBOX_RETRY_BASE, retry_max: float = OUTBOX_RETRY_MAX,
+                 lease: float = OUTBOX_LEASE):
+        self.session_factory = session_factory
+        self.smtp = smtp or SmtpSession()
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+
+    def _claim(self, db: Session) -> list:
+        now = utcnow()
+        due = (EmailOutbox.status.in_((PENDING, SENDING)), EmailOutbox.next_attempt_at <= now)
+        candidates = (
+            db.query(EmailOutbox.id)
+            .filter(*due)
+            .order_by(EmailOutbox.next_attempt_at)
+            .limit(self.batch_size)
+            .all()
+        )
+        claimed = []
+        for row in candidates:
+            # conditional update - when two workers race for a row only one changes it
+            won = db.execute(
+                update(EmailOutbox.__table__)
+                .where(EmailOutbox.__table__.c.id == row.id, *due)
+                .values(status=SENDING, next_attempt_at=now + timedelta(seconds=self.lease))
+            ).rowcount
+            if won:
+                claimed.append(row.id)
+        db.commit()
+        if not claimed:
+            return []
+        return db.query(EmailOutbox).filter(EmailOutbox.id.in_(claimed)).order_by(EmailOutbox.id).all()
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+
+    def _failed(self, message: EmailOutbox, error: Exception):
+        message.attempts += 1
+        message.last_error = f"{type(error).__name__}: {error}"[:500]
+        # 5xx is a permanent rejection (bad address, policy) - retrying will not help
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            permanent = all(code >= 500 for code, _ in error.recipients.values())
+        else:
+            permanent = isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+        if permanent or message.attempts >= self.max_attempts:
+            message.status = FAILED
+            message.body = ""
+        else:
+            message.status = PENDING
+            message.next_attempt_at = utcnow() + timedelta(seconds=self.backoff(message.attempts))
+
+    def drain_once(self) -> int:
+        #send one batch of due messages, returns how many were claimed
+        with self.session_factory() as db:
+            messages = self._claim(db)
+            for message in messages:
+                try:
+                    self.smtp.send(message.recipient, message.subject, message.body)
+                except (smtplib.SMTPException, OSError) as e:
+                    if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                        # connection trouble - the next message reconnects
+                        self.smtp.close()
+                    self._failed(message, e)
+                else:
+                    message.attempts += 1
+                    message.status = SENT
+                    message.sent_at = utcnow()
+                    message.body = ""
+                # one commit per message, so a crash mid-batch only resends the unsent ones
+                db.commit()
+            return len(messages)
+
+    def purge_sent(self, older_than_days: int = OUTBOX_RETENTION_DAYS) -> int:
+        #sent and failed rows are kept for a while for troubleshooting, then deleted
+        table = EmailOutbox.__table__
+        cutoff = utcnow() - timedelta(days=older_than_days)
+        with self.session_factory() as db:
+            removed = db.execute(
+                delete(table).where(or_(
+                    and_(table.c.status == SENT, table.c.sent_at < cutoff),
+                    and_(table.c.status == FAILED, table.c.created_at < cutoff),
+                ))
+            ).rowcount
+            db.commit()
+        return removed
+
+
+outbox_sender = OutboxSender()
+
+_sender_thread = None
+_sender_stop = threading.Event()
+_sender_wake = threading.Event()
+
+
+def _send_loop(poll_interval: float):
+    last_purge = 0.0
+    while not _sender_stop.is_set():
+        claimed = 0
+        try:
+            claimed = outbox_sender.drain_once()
+            if time.monotonic() - last_purge > 3600:
+                outbox_sender.purge_sent()
+                last_purge = time.monotonic()
+        except Exception:
+            # a database hiccup must not kill the thread - try again next round
+            logger.exception("Email outbox drain failed")
+        if claimed >= outbox_sender.batch_size:
+            continue  # more mail is due
+        outbox_sender.smtp.close_if_idle()
+        _sender_wake.wait(poll_interval)
+        _sender_wake.clear()
+    outbox_sender.smtp.close()
+
+
+def start_mail_sender(poll_interval: float = OUTBOX_POLL_INTERVAL):
+    global _sender_thread
+    if _sender_thread is not None and _sender_thread.is_alive():
+        return
+    _sender_stop.clear()
+    _sender_thread = threading.Thread(target=_send_loop, args=(poll_interval,), name="email-outbox-sender", daemon=True)
+    _sender_thread.start()
+
+
+def wake_mail_sender():
+    #mail enqueued by this process goes out now instead of at the next poll
+    _sender_wake.set()
+
+
+def stop_mail_sender():
+    global _sender_thread
+    _sender_stop.set()
+    _sender_wake.set()
+    if _sender_thread is not None:
+        _sender_thread.join(timeout=10)
+        _sender_thread = None
@@ -1,28 +1,39 @@
+import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from recovery import recovery_router
 from routes import app_routes
-from DataBase.DBmodels import Expense, User, MonthlyBudget
-from DataBase.database import Base, engine
+from internal import internal_router
+from security import shutdown_password_pool
+from recovery_store import start_recovery_sweeper, stop_recovery_sweeper
+from mailer import start_mail_sender, stop_mail_sender
+from logs import RequestContextMiddleware, configure_logging, shutdown_logging
+from metrics import MetricsMiddleware, instrument_queries, metrics_router
+from slow_queries import instrument_slow_queries, start_slow_query_log, stop_slow_query_log
+from health import health_router
+from analytics import analytics_router
+from DataBase.database import engine, async_engine
 from fastapi.middleware.cors import CORSMiddleware
 
-Base.metadata.create_all(bind=engine)
+# after the imports: the engines exist, so echo output can be routed through the queue
+configure_logging()
+logger = logging.getLogger("main")
 
+# no DDL and no database round trip here: the schema comes from DataBase/migrations.py,
+# run once before the workers start, and /readyz reports when the database is usable
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    retries = 5
-    while retries:
-        try:
-            Base.metadata.create_all(bind=engine)
-            print("Tables created successfully!")
-            yield  # פעולה אחרי שהשרת עולה
-            break
-        except sqlalchemy.exc.OperationalError:
-            print("Database not ready, waiting 5 seconds...")
-            time.sleep(5)
-            retries -= 1
-    else:
-        print("Could not connect to the database after several attempts.")
+    configure_logging()  # again after a previous shutdown, e.g. several test clients
+    start_recovery_sweeper()
+    start_mail_sender()
+    start_slow_query_log()
+    logger.info("Application started")
+    yield  # פעולה אחרי שהשרת עולה
+    stop_slow_query_log()
+    stop_mail_sender()
+    stop_recovery_sweeper()
+    shutdown_password_pool()
+    shutdown_logging()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -33,5 +44,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# added last so they wrap everything, CORS preflights included
+app.add_middleware(RequestContextMiddleware)
+app.add_middleware(MetricsMiddleware)
+instrument_queries(engine)
+instrument_slow_queries(engine)
+if async_engine is not None:
+    instrument_queries(async_engine.sync_engine)
+    # EXPLAIN runs on the sync engine - same database, no event loop needed
+    instrument_slow_queries(async_engine.sync_engine, explain_bind=engine)
 app.include_router(app_routes)
 app.include_router(recovery_router)
+app.include_router(internal_router)
+app.include_router(metrics_router)
+app.include_router(health_router)
+app.include_router(analytics_router)
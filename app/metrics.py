@@ -0,0 +1,246 @@
+# metrics.py
+# Request and database metrics in Prometheus text format on GET /metrics.
+# Every thread writes to its own shard of each metric, so recording takes no lock;
+# a scrape adds the shards up. Requests are labelled with the route template
+# (/expenses/recent/{username}), never the raw path, to keep the series bounded.
+# The middleware puts a per-request counter in a contextvar; the engine event hooks
+# below add every statement to it, also when the route body runs in the threadpool
+# or through AsyncSession.run_sync (both copy the context).
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class _Sharded:
+    #one dict per thread: label values -> value, merged only when scraped
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            # only the first write from a new thread takes the lock
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _snapshots(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        # list(dict.items()) copies in one step under the GIL, no lock needed against writers
+        return [list(shard.items()) for shard in shards]
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self) -> dict:
+        totals = {}
+        for items in self._snapshots():
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # per bucket counts (the last one is +Inf), then sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self) -> dict:
+        totals = {}
+        for items in self._snapshots():
+            for labels, series in items:
+                merged = totals.setdefault(labels, [0] * len(series))
+                for i, value in enumerate(list(series)):
+                    merged[i] += value
+        return totals
+
+
+requests_total = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route"), LATENCY_BUCKETS
+)
+requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests being served", ())
+queries_per_request = Histogram(
+    "db_queries_per_request", "SQL statements sent while serving one request", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+query_time_per_request = Histogram(
+    "db_query_seconds_per_request", "Time spent in SQL while serving one request", ("method", "route"), LATENCY_BUCKETS
+)
+queries_total = Counter("db_queries_total", "SQL statements, by the route that sent them", ("route",))
+query_duration = Histogram("db_query_duration_seconds", "SQL statement latency", (), QUERY_LATENCY_BUCKETS)
+
+METRICS = (
+    requests_total, request_duration, requests_in_flight,
+    queries_per_request, query_time_per_request, queries_total, query_duration,
+)
+
+
+class RequestQueries:
+    __slots__ = ("scope", "count", "seconds")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+
+
+_current_request = ContextVar("metrics_current_request", default=None)
+
+
+def current_route():
+    #route template of the request running in this context, None outside requests
+    current = _current_request.get()
+    if current is None:
+        return None
+    return getattr(current.scope.get("route"), "path", "unmatched")
+
+
+def instrument_queries(bind):
+    #time every statement on this (sync) engine
+    @event.listens_for(bind, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(bind, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        query_duration.observe(elapsed)
+        current = _current_request.get()
+        if current is None:
+            # background threads (outbox sender, sweeper) and scripts
+            queries_total.inc("background")
+            return
+        current.count += 1
+        current.seconds += elapsed
+
+
+class MetricsMiddleware:
+    #plain ASGI middleware - sees the status code and the end of streamed bodies
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        current = RequestQueries(scope)
+        token = _current_request.set(current)
+        requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.dec()
+            _current_request.reset(token)
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            requests_total.inc(method, path, str(status))
+            request_duration.observe(elapsed, method, path)
+            queries_per_request.observe(current.count, method, path)
+            query_time_per_request.observe(current.seconds, method, path)
+            if current.count:
+                queries_total.inc(path, amount=current.count)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        collected = metric.collect()
+        if metric.kind != "histogram":
+            if not collected and not metric.label_names:
+                collected = {(): 0}
+            for labels, value in sorted(collected.items()):
+                lines.append(f"{metric.name}{_labels(metric.label_names, labels)} {_number(value)}")
+            continue
+        for labels, series in sorted(collected.items()):
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (None,), series[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound is None else f'le="{_number(float(bound))}"'
+                lines.append(f"{metric.name}_bucket{_labels(metric.label_names, labels, le)} {cumulative}")
+            lines.append(f"{metric.name}_sum{_labels(metric.label_names, labels)} {_number(series[-1])}")
+            lines.append(f"{metric.name}_count{_labels(metric.label_names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,24 +1,15 @@
-import random
-import time
-import smtplib
-from email.mime.text import MIMEText
+import logging
+import secrets
 from fastapi import APIRouter, HTTPException, Depends, Body
 from sqlalchemy.orm import Session
 from DataBase.database import SessionLocal
 from DataBase.DBmodels import User
 from utiles import validate_password_strength
 from security import hash_password, verify_password
+from recovery_store import recovery_codes, RecoveryNotConfigured, RECOVERY_CODE_TTL, MISSING, EXPIRED, INVALID, LOCKED
+from mailer import enqueue_email, wake_mail_sender
 recovery_router = APIRouter()
-
-
-recovery_codes = {}  # key: email, value: (code, expiration timestamp)
-
-
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-SMTP_USERNAME = "easssmt@gmail.com"
-SMTP_PASSWORD = "oeag bals vjhg punw"
-FROM_EMAIL = SMTP_USERNAME
+logger = logging.getLogger(__name__)
 
 
 def get_db():
@@ -37,26 +28,19 @@ def forgot_password(email: str = Body(...), db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
 
     # Create recovery code
-    code = str(random.randint(100000, 999999))
-    expiration = time.time() + 15 * 60  # valid for 15 minutes
-    recovery_codes[email] = (code, expiration)
+    code = str(100000 + secrets.randbelow(900000))
+    try:
+        recovery_codes.issue(email, code)  # valid for RECOVERY_CODE_TTL (15 minutes)
+    except RecoveryNotConfigured:
+        logger.error("Password recovery is disabled: RECOVERY_CODE_SECRET is not set")
+        raise HTTPException(status_code=503, detail="Password recovery is not available")
 
-    # Send email by SMTP
+    # Queue the email - the outbox sender delivers it by SMTP in the background
     subject = "Password Recovery Code"
-    body = f"Your password recovery code is: {code}. This code is valid for 15 minutes."
-    msg = MIMEText(body)
-    msg["Subject"] = subject
-    msg["From"] = FROM_EMAIL
-    msg["To"] = email
-
-    try:
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.sendmail(FROM_EMAIL, [email], msg.as_string())
-        server.quit()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Error sending recovery email: " + str(e))
+    body = f"Your password recovery code is: {code}. This code is valid for {RECOVERY_CODE_TTL // 60} minutes."
+    enqueue_email(db, email, subject, body)
+    db.commit()
+    wake_mail_sender()
 
     return {"message": "Recovery code sent to your email"}
 
@@ -81,15 +65,14 @@ def reset_password(
         )
 
 
-    if email not in recovery_codes:
+    status = recovery_codes.redeem(email, recovery_code)
+    if status == MISSING:
         raise HTTPException(status_code=400, detail="Recovery code not requested or expired")
-
-    code, expiration = recovery_codes[email]
-    if time.time() > expiration:
-        del recovery_codes[email]
+    if status == EXPIRED:
         raise HTTPException(status_code=400, detail="Recovery code expired")
-
-    if recovery_code != code:
+    if status == LOCKED:
+        raise HTTPException(status_code=400, detail="Too many attempts, request a new recovery code")
+    if status == INVALID:
         raise HTTPException(status_code=400, detail="Invalid recovery code")
 
 
@@ -101,5 +84,4 @@ def reset_password(
     db.commit()
     db.refresh(user)
 
-    del recovery_codes[email]
     return {"message": "Password updated successfully"}
@@ -0,0 +1,233 @@
+# recovery_store.py
+# Pending password recovery codes with an expiry time and a wrong-guess limit.
+# RECOVERY_STORE=database (default) keeps them in the recovery_codes table, so a code
+# issued by one worker or replica can be redeemed on any other; RECOVERY_STORE=memory
+# is for a single process. A background thread deletes expired codes. Codes are kept
+# as HMACs keyed with RECOVERY_CODE_SECRET; the database store refuses to issue any
+# without it.
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from DataBase.database import SessionLocal
+from DataBase.DBmodels import RecoveryCode
+from utiles import utcnow
+
+logger = logging.getLogger(__name__)
+
+RECOVERY_STORE = os.getenv("RECOVERY_STORE", "database")
+RECOVERY_CODE_TTL = int(os.getenv("RECOVERY_CODE_TTL", str(15 * 60)))
+# wrong guesses allowed per code - a 6 digit code cannot be brute forced in 5 tries
+RECOVERY_MAX_ATTEMPTS = int(os.getenv("RECOVERY_MAX_ATTEMPTS", "5"))
+RECOVERY_SWEEP_INTERVAL = float(os.getenv("RECOVERY_SWEEP_INTERVAL", "60"))
+# key of the code hashes, the same on every worker and replica (required by RECOVERY_STORE=database)
+RECOVERY_CODE_SECRET = os.getenv("RECOVERY_CODE_SECRET", "")
+
+# redeem() results
+OK = "ok"
+MISSING = "missing"
+EXPIRED = "expired"
+INVALID = "invalid"
+LOCKED = "locked"
+
+
+class RecoveryNotConfigured(RuntimeError):
+    pass
+
+
+def _hash_code(key: bytes, code: str) -> str:
+    #keyed: there are only 10**6 codes, so a plain hash of one is reversed by hashing them
+    # all. Without the key, a leaked table or memory dump does not give away live codes
+    return hmac.new(key, code.encode(), hashlib.sha256).hexdigest()
+
+
+class MemoryRecoveryCodeStore:
+    def __init__(self, ttl: int = RECOVERY_CODE_TTL, max_attempts: int = RECOVERY_MAX_ATTEMPTS,
+                 secret: str = RECOVERY_CODE_SECRET):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._codes = {}  # email -> [code_hash, expires_at, attempts]
+        # one process holds every code, so a random key does when none is configured
+        self.key = (secret or secrets.token_hex(32)).encode()
+        self._lock = threading.Lock()
+
+    def issue(self, email: str, code: str):
+        with self._lock:
+            self._codes[email] = [_hash_code(self.key, code), time.time() + self.ttl, 0]
+
+    def redeem(self, email: str, code: str) -> str:
+        with self._lock:
+            entry = self._codes.get(email)
+            if entry is None:
+                return MISSING
+            if entry[1] < time.time():
+                del self._codes[email]
+                return EXPIRED
+            if entry[2] >= self.max_attempts:
+                return LOCKED
+            entry[2] += 1
+            if not hmac.compare_digest(entry[0], _hash_code(self.key, code)):
+                return INVALID
+            del self._codes[email]
+            return OK
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [email for email, entry in self._codes.items() if entry[1] < now]
+            for email in expired:
+                del self._codes[email]
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+
+
+class DatabaseRecoveryCodeStore:
+    def __init__(self, session_factory=SessionLocal, ttl: int = RECOVERY_CODE_TTL,
+                 max_attempts: int = RECOVERY_MAX_ATTEMPTS, secret: str = RECOVERY_CODE_SECRET):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        # every worker must hash with the same key, so none can be made up here
+        self.key = secret.encode()
+
+    def issue(self, email: str, code: str):
+        #a new code replaces the pending one and resets its attempts
+        if not self.key:
+            # an unkeyed hash of a 6 digit code is as good as the code itself
+            raise RecoveryNotConfigured("RECOVERY_CODE_SECRET is not set")
+        table = RecoveryCode.__table__
+        values = dict(email=email, code_hash=_hash_code(self.key, code),
+                      expires_at=utcnow() + timedelta(seconds=self.ttl), attempts=0)
+        with self.session_factory() as db:
+            if db.get_bind().dialect.name == "mysql":
+                stmt = mysql_insert(table).values(**values)
+                stmt = stmt.on_duplicate_key_update(
+                    code_hash=stmt.inserted.code_hash, expires_at=stmt.inserted.expires_at, attempts=0
+                )
+            else:
+                stmt = sqlite_insert(table).values(**values)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["email"],
+                    set_={"code_hash": stmt.excluded.code_hash, "expires_at": stmt.excluded.expires_at, "attempts": 0},
+                )
+            db.execute(stmt)
+            db.commit()
+
+    def redeem(self, email: str, code: str) -> str:
+        table = RecoveryCode.__table__
+        now = utcnow()
+        with self.session_factory() as db:
+            entry = db.query(RecoveryCode).filter(RecoveryCode.email == email).first()
+            if entry is None:
+                return MISSING
+            if entry.expires_at < now:
+                db.execute(delete(table).where(table.c.email == email))
+                db.commit()
+                return EXPIRED
+
+            # count the attempt in the database before comparing - parallel guesses
+            # on other workers cannot all see the same counter and slip past the limit
+            counted = db.execute(
+                update(table)
+                .where(table.c.email == email, table.c.attempts < self.max_attempts, table.c.expires_at >= now)
+                .values(attempts=table.c.attempts + 1)
+            ).rowcount
+            db.commit()
+            if not counted:
+                return LOCKED
+            if not hmac.compare_digest(entry.code_hash, _hash_code(self.key, code)):
+                return INVALID
+
+            # only one request can delete the row - a code is used once
+            used = db.execute(
+                delete(table).where(table.c.email == email, table.c.code_hash == entry.code_hash)
+            ).rowcount
+            db.commit()
+            return OK if used else MISSING
+
+    def sweep(self) -> int:
+        table = RecoveryCode.__table__
+        with self.session_factory() as db:
+            removed = db.execute(delete(table).where(table.c.expires_at < utcnow())).rowcount
+            db.commit()
+        return removed
+
+    def clear(self):
+        with self.session_factory() as db:
+            db.execute(delete(RecoveryCode.__table__))
+            db.commit()
+
+
+def make_recovery_store(kind: str = RECOVERY_STORE):
+    if kind == "memory":
+        return MemoryRecoveryCodeStore()
+    if kind == "database":
+        return DatabaseRecoveryCodeStore()
+    raise ValueError(f"Unknown RECOVERY_STORE {kind!r} (use 'memory' or 'database')")
+
+
+class RecoveryCodes:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def issue(self, email: str, code: str):
+        self.backend.issue(email, code)
+
+    def redeem(self, email: str, code: str) -> str:
+        return self.backend.redeem(email, code)
+
+    def sweep(self) -> int:
+        return self.backend.sweep()
+
+    def clear(self):
+        self.backend.clear()
+
+
+recovery_codes = RecoveryCodes(make_recovery_store())
+
+
+def set_recovery_store(backend):
+    #plug in any object with issue/redeem/sweep/clear
+    recovery_codes.backend = backend
+
+
+_sweeper = None
+_sweeper_stop = threading.Event()
+
+
+def _sweep_loop(interval: float):
+    while not _sweeper_stop.wait(interval):
+        try:
+            recovery_codes.sweep()
+        except Exception:
+            # a database hiccup must not kill the thread - try again next round
+            logger.exception("Recovery code sweep failed")
+
+
+def start_recovery_sweeper(interval: float = RECOVERY_SWEEP_INTERVAL):
+    global _sweeper
+    if _sweeper is not None and _sweeper.is_alive():
+        return
+    _sweeper_stop.clear()
+    _sweeper = threading.Thread(target=_sweep_loop, args=(interval,), name="recovery-code-sweeper", daemon=True)
+    _sweeper.start()
+
+
+def stop_recovery_sweeper():
+    global _sweeper
+    _sweeper_stop.set()
+    if _sweeper is not None:
+        _sweeper.join(timeout=5)
+        _sweeper = None
@@ -0,0 +1,144 @@
+# response_cache.py
+# Per-user data versions and a bounded cache of rendered dashboard responses.
+# Every expense/budget write bumps the user's version after its commit. The cached
+# reads derive a strong ETag from (user, version, endpoint, params): a matching
+# If-None-Match is answered 304 and a repeat request for the same version is served
+# from memory, so an unchanged dashboard sends no queries (the username lookup is
+# cached by user_cache.py). A bump makes every older entry unreachable - they age
+# out of the LRU instead of being deleted one by one.
+import hashlib
+import os
+import random
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+
+from dto import render_json
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+# versions must be shared when uvicorn runs several workers, otherwise a write on one
+# worker would leave the others serving their cached copy
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL") or os.getenv("USER_CACHE_URL")
+
+
+class LocalVersionStore:
+    def __init__(self):
+        # versions restart at 0 with the process - the epoch keeps an ETag handed out
+        # before a restart from matching the new counter
+        self.epoch = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> str:
+        return f"{self.epoch}.{self._versions.get(user_id, 0)}"
+
+    def bump(self, user_id: int) -> tuple:
+        #(version before, version after) - atomically, so the caller knows whether
+        # anyone else wrote in between
+        with self._lock:
+            version = self._versions.get(user_id, 0) + 1
+            self._versions[user_id] = version
+        return f"{self.epoch}.{version - 1}", f"{self.epoch}.{version}"
+
+
+class RedisVersionStore:
+    #redis is an optional dependency, only needed for this backend
+    def __init__(self, url: str, prefix: str = "user_version:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, user_id: int) -> str:
+        key = self.prefix + str(user_id)
+        # a random start, so a flushed redis cannot hand out an old version again
+        self.client.set(key, random.randrange(1 << 40), nx=True)
+        return self.client.get(key).decode()
+
+    def bump(self, user_id: int) -> tuple:
+        version = self.client.incr(self.prefix + str(user_id))
+        return str(version - 1), str(version)
+
+
+class ResponseCache:
+    def __init__(self, versions, max_size: int = RESPONSE_CACHE_SIZE):
+        self.versions = versions
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (user_id, version, endpoint, params) -> JSON bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _get(self, key) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def _set(self, key, body: bytes):
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def bump(self, *user_ids: int) -> dict:
+        #user id -> (version before, version after)
+        return {user_id: self.versions.bump(user_id) for user_id in set(user_ids)}
+
+    def respond(self, request: Optional[Request], user_id: int, endpoint: str, params: tuple,
+                compute: Callable[[], object]) -> Response:
+        #read the version before compute() runs - a write that commits in between
+        # bumps it, so its data can never be cached under the newer version
+        key = (user_id, self.versions.get(user_id), endpoint, params)
+        etag = '"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+        if request is not None and etag_matches(request.headers.get("if-none-match"), etag):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        body = self._get(key)
+        if body is None:
+            # rendered once, then served from the cache as bytes
+            body = render_json(compute())
+            self._set(key, body)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "versions": type(self.versions).__name__,
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+response_cache = ResponseCache(RedisVersionStore(RESPONSE_CACHE_URL) if RESPONSE_CACHE_URL else LocalVersionStore())
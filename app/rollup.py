@@ -0,0 +1,197 @@
+# rollup.py
+# keeps expense_monthly_totals in step with the expenses table, so the dashboard
+# sums read one row per (month, category) instead of every expense. Buckets are keyed
+# by category id; the read helpers return category names
+import argparse
+from datetime import date
+
+from sqlalchemy import func, and_, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import extract
+
+from DataBase.DBmodels import Expense, ExpenseMonthlyTotal
+from categories import category_cache
+
+# amounts are floats, so allow some rounding difference before calling it drift
+DRIFT_TOLERANCE = 0.01
+
+
+def _upsert_delta(db: Session, user_id: int, year: int, month: int, category_id: int, amount: float, count: int):
+    #one atomic statement - no read-modify-write race between concurrent requests
+    table = ExpenseMonthlyTotal.__table__
+    values = dict(
+        user_id=user_id, year=year, month=month, category_id=category_id,
+        total=amount, expense_count=count
+    )
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update(
+            total=table.c.total + stmt.inserted.total,
+            expense_count=table.c.expense_count + stmt.inserted.expense_count,
+        )
+    else:
+        stmt = sqlite_insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "year", "month", "category_id"],
+            set_={
+                "total": table.c.total + stmt.excluded.total,
+                "expense_count": table.c.expense_count + stmt.excluded.expense_count,
+            },
+        )
+    db.execute(stmt)
+
+
+def add_to_rollup(db: Session, user_id: int, expense_date: date, category_id: int, amount: float):
+    _upsert_delta(db, user_id, expense_date.year, expense_date.month, category_id, amount, 1)
+
+
+def add_many_to_rollup(db: Session, rows: list):
+    #rows are expense dicts (user_id, date, category_id, amount) - one upsert per touched bucket
+    buckets = {}
+    for row in rows:
+        key = (row["user_id"], row["date"].year, row["date"].month, row["category_id"])
+        total, count = buckets.get(key, (0.0, 0))
+        buckets[key] = (total + row["amount"], count + 1)
+    for (user_id, year, month, category_id), (total, count) in buckets.items():
+        _upsert_delta(db, user_id, year, month, category_id, total, count)
+
+
+def remove_from_rollup(db: Session, user_id: int, expense_date: date, category_id: int, amount: float):
+    _upsert_delta(db, user_id, expense_date.year, expense_date.month, category_id, -amount, -1)
+    # drop the bucket once its last expense is gone
+    db.query(ExpenseMonthlyTotal).filter(
+        ExpenseMonthlyTotal.user_id == user_id,
+        ExpenseMonthlyTotal.year == expense_date.year,
+        ExpenseMonthlyTotal.month == expense_date.month,
+        ExpenseMonthlyTotal.category_id == category_id,
+        ExpenseMonthlyTotal.expense_count <= 0,
+    ).delete(synchronize_session=False)
+
+
+def monthly_breakdown(db: Session, user_id: int, year: int, month: int) -> dict:
+    rows = (
+        db.query(ExpenseMonthlyTotal.category_id, ExpenseMonthlyTotal.total)
+        .filter(
+            ExpenseMonthlyTotal.user_id == user_id,
+            ExpenseMonthlyTotal.year == year,
+            ExpenseMonthlyTotal.month == month,
+        )
+        .all()
+    )
+    names = category_cache.names(db, (row.category_id for row in rows))
+    return {names[row.category_id]: row.total for row in rows}
+
+
+def category_totals_since(db: Session, user_id: int, start_year: int, start_month: int) -> dict:
+    #key "YYYY-MM" -> {category: total} - the dashboard derives both its month breakdown and its series from one read
+    rows = (
+        db.query(
+            ExpenseMonthlyTotal.year,
+            ExpenseMonthlyTotal.month,
+            ExpenseMonthlyTotal.category_id,
+            ExpenseMonthlyTotal.total,
+        )
+        .filter(
+            ExpenseMonthlyTotal.user_id == user_id,
+            or_(
+                ExpenseMonthlyTotal.year > start_year,
+                and_(ExpenseMonthlyTotal.year == start_year, ExpenseMonthlyTotal.month >= start_month),
+            ),
+        )
+        .all()
+    )
+    names = category_cache.names(db, (row.category_id for row in rows))
+    totals = {}
+    for row in rows:
+        totals.setdefault(f"{row.year}-{row.month:02d}", {})[names[row.category_id]] = row.total
+    return totals
+
+
+def _totals_from_expenses(db: Session, user_id=None):
+    year = extract("year", Expense.date)
+    month = extract("month", Expense.date)
+    query = db.query(
+        Expense.user_id,
+        year.label("year"),
+        month.label("month"),
+        Expense.category_id,
+        func.sum(Expense.amount).label("total"),
+        func.count(Expense.id).label("expense_count"),
+    )
+    if user_id is not None:
+        query = query.filter(Expense.user_id == user_id)
+    rows = query.group_by(Expense.user_id, year, month, Expense.category_id).all()
+    return {
+        (row.user_id, int(row.year), int(row.month), row.category_id): (row.total, row.expense_count)
+        for row in rows
+    }
+
+
+def _totals_from_rollup(db: Session, user_id=None):
+    query = db.query(ExpenseMonthlyTotal)
+    if user_id is not None:
+        query = query.filter(ExpenseMonthlyTotal.user_id == user_id)
+    return {
+        (row.user_id, row.year, row.month, row.category_id): (row.total, row.expense_count)
+        for row in query.all()
+    }
+
+
+def verify_rollup(db: Session, user_id=None) -> list:
+    #returns the buckets where the rollup and the raw expenses disagree
+    expected = _totals_from_expenses(db, user_id)
+    actual = _totals_from_rollup(db, user_id)
+    drift = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        exp_total, exp_count = expected.get(key, (0.0, 0))
+        act_total, act_count = actual.get(key, (0.0, 0))
+        if exp_count != act_count or abs(exp_total - act_total) > DRIFT_TOLERANCE:
+            drift.append({
+                "user_id": key[0], "year": key[1], "month": key[2], "category_id": key[3],
+                "expected_total": exp_total, "rollup_total": act_total,
+                "expected_count": exp_count, "rollup_count": act_count,
+            })
+    return drift
+
+
+def rebuild_rollup(db: Session, user_id=None) -> int:
+    #recompute the rollup from the expenses table, in one transaction
+    expected = _totals_from_expenses(db, user_id)
+    query = db.query(ExpenseMonthlyTotal)
+    if user_id is not None:
+        query = query.filter(ExpenseMonthlyTotal.user_id == user_id)
+    query.delete(synchronize_session=False)
+    db.bulk_insert_mappings(ExpenseMonthlyTotal, [
+        {
+            "user_id": key[0], "year": key[1], "month": key[2], "category_id": key[3],
+            "total": total, "expense_count": count,
+        }
+        for key, (total, count) in expected.items()
+    ])
+    db.commit()
+    return len(expected)
+
+
+if __name__ == "__main__":
+    from DataBase.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Verify or rebuild the monthly expense rollup")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "verify":
+            drift = verify_rollup(db, args.user_id)
+            for bucket in drift:
+                print(bucket)
+            print(f"{len(drift)} drifted buckets")
+            raise SystemExit(1 if drift else 0)
+        rows = rebuild_rollup(db, args.user_id)
+        print(f"Rollup rebuilt: {rows} buckets")
+    finally:
+        db.close()
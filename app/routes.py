@@ -1,23 +1,41 @@
-from typing import Optional
+from typing import Optional, List
 
 #from click import password_option
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from DataBase.database import SessionLocal
 from pydantic import BaseModel
 from datetime import date, timedelta, datetime
 from DataBase.DBmodels import Expense, MonthlyBudget, User
-from sqlalchemy import func , and_ , cast , String , or_
-import calendar
-from sqlalchemy.sql import extract
+from sqlalchemy import func , and_ , cast , String , or_, insert
+import os
 from dateutil.relativedelta import relativedelta
-from utiles import validate_password_strength
+from utiles import validate_password_strength, encode_cursor, decode_cursor
 #from app.models import Budget
-from security import hash_password, verify_password
+from security import hash_password, verify_password, verify_password_and_update
+from rollup import add_to_rollup, add_many_to_rollup, remove_from_rollup, monthly_breakdown, category_totals_since
 from fastapi import Body
+from fastapi.responses import StreamingResponse
+from async_db import db_route
+from user_cache import resolve_user_id, user_id_cache
+from response_cache import response_cache
+from timeseries import expense_timeseries
+from export import STREAMERS, MEDIA_TYPES
+from dto import ExpenseRow, UserRow, BudgetRow, FastJSONResponse
+from categories import category_cache, normalize_category
+from budgets import MONTHS, upsert_budgets, yearly_status
+from search import search_expenses
+from autocomplete import autocomplete_index, MAX_SUGGESTIONS
+from analytics import column_cache
+from sketches import add_to_sketches, add_many_to_sketches, rebuild_sketches, load_sketches, describe, check_amount
 
 app_routes = APIRouter()
 
+DEFAULT_PAGE_SIZE = int(os.getenv("EXPENSES_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = 500
+# rows per INSERT batch and per transaction in /expenses/bulk
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
 
 # create session
 def get_db():
@@ -37,6 +55,10 @@ class ExpenseCreate(BaseModel):
     user_id: Optional[int] = None
 
 
+class BulkExpenseCreate(BaseModel):
+    expenses: List[ExpenseCreate]
+
+
 class BudgetCreate(BaseModel):
     year: int
     month: int
@@ -44,6 +66,12 @@ class BudgetCreate(BaseModel):
     user_id: Optional[int] = None
 
 
+class BudgetYearSet(BaseModel):
+    # January first - exactly twelve amounts
+    budgets: List[float]
+    user_id: Optional[int] = None
+
+
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -64,8 +92,94 @@ class DeleteUserSchema(BaseModel):
     email: str
     password: str
 
+
+# response models - what the client gets back (never the password hash)
+class ExpenseOut(BaseModel):
+    id: int
+    date: date
+    category: str
+    description: Optional[str] = None
+    amount: float
+    user_id: int
+
+
+class ExpenseSaved(BaseModel):
+    message: str
+    expense: ExpenseOut
+
+
+class ExpenseUpdated(BaseModel):
+    message: str
+    updated_expense: ExpenseOut
+
+
+class ExpenseDeleted(BaseModel):
+    message: str
+    deleted_expense: ExpenseOut
+
+
+class ExpensePage(BaseModel):
+    expenses: List[ExpenseOut]
+    next_cursor: Optional[str] = None
+
+
+class ExpenseList(BaseModel):
+    expenses: List[ExpenseOut]
+
+
+class ExpenseHit(ExpenseOut):
+    score: float
+
+
+class ExpenseSearchPage(BaseModel):
+    query: str
+    results: List[ExpenseHit]
+    next_offset: Optional[int] = None
+
+
+class Suggestion(BaseModel):
+    text: str
+    count: int
+
+
+class Suggestions(BaseModel):
+    descriptions: List[Suggestion]
+    categories: List[Suggestion]
+
+
+class UserOut(BaseModel):
+    id: int
+    username: str
+    fullname: str
+    email: str
+
+
+class UserSaved(BaseModel):
+    message: str
+    user: UserOut
+
+
+class BudgetOut(BaseModel):
+    id: int
+    year: int
+    month: int
+    budget: float
+    user_id: int
+
+
+class BudgetSaved(BaseModel):
+    message: str
+    budget: BudgetOut
+
+
+class BudgetYearSaved(BaseModel):
+    message: str
+    year: int
+    budgets: List[BudgetOut]
+
 # POST: create new expense
-@app_routes.post("/expenses/")
+@app_routes.post("/expenses/", response_model=ExpenseSaved)
+@db_route
 def add_expense(expense: ExpenseCreate, db: Session = Depends(get_db)):
     if not expense.user_id:
         raise HTTPException(status_code=400, detail="User ID is required")
@@ -73,63 +187,358 @@ def add_expense(expense: ExpenseCreate, db: Session = Depends(get_db)):
     if expense.amount <0:
         raise HTTPException (status_code=400, detail="Amount must be positive")
 
+    # an unknown name becomes one of the user's own categories
+    category_id = category_cache.resolve(db, expense.user_id, expense.category, create=True)
     new_expense = Expense(
         date=expense.date,
-        category=expense.category,
+        category_id=category_id,
         description=expense.description,
         amount=expense.amount,
         user_id=expense.user_id
     )
     db.add(new_expense)
+    add_to_rollup(db, new_expense.user_id, new_expense.date, category_id, new_expense.amount)
+    add_to_sketches(db, new_expense.user_id, {category_id: [new_expense.amount]})
     db.commit()
+    versions = response_cache.bump(new_expense.user_id)
     db.refresh(new_expense)
-    return {"message": "Expense added successfully", "expense": new_expense}
+    column_cache.append(new_expense.user_id, versions[new_expense.user_id], [
+        (new_expense.date, category_id, new_expense.amount, new_expense.id)
+    ])
+    category = category_cache.name(db, category_id)
+    autocomplete_index.record(new_expense.user_id, [(new_expense.description, category)])
+    return {"message": "Expense added successfully", "expense": ExpenseRow.from_entity(new_expense, category).to_dict()}
+
+
+#user id -> [(description, category name)] of inserted expense rows
+def _autocomplete_entries(db: Session, rows: list) -> dict:
+    names = category_cache.names(db, (row["category_id"] for row in rows))
+    entries = {}
+    for row in rows:
+        entries.setdefault(row["user_id"], []).append((row["description"], names[row["category_id"]]))
+    return entries
+
+
+# POST: create many expenses at once (imports)
+@app_routes.post("/expenses/bulk")
+def add_expenses_bulk(payload: BulkExpenseCreate, db: Session = Depends(get_db)):
+    expenses = payload.expenses
+
+    # validate every row before the first write
+    user_ids = list({expense.user_id for expense in expenses if expense.user_id})
+    existing_ids = set()
+    for start in range(0, len(user_ids), BULK_CHUNK_SIZE):
+        existing_ids.update(
+            row.id for row in db.query(User.id).filter(User.id.in_(user_ids[start:start + BULK_CHUNK_SIZE]))
+        )
+
+    errors = []
+    for index, expense in enumerate(expenses):
+        if not expense.user_id:
+            errors.append({"index": index, "detail": "User ID is required"})
+        elif expense.user_id not in existing_ids:
+            errors.append({"index": index, "detail": "User not found"})
+        elif expense.amount < 0:
+            errors.append({"index": index, "detail": "Amount must be positive"})
+        else:
+            try:
+                normalize_category(expense.category)
+            except HTTPException as e:
+                errors.append({"index": index, "detail": e.detail})
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "No expenses were added", "errors": errors})
+
+    # every (user, name) pair once, before the first insert
+    category_ids = {
+        key: category_cache.resolve(db, key[0], key[1], create=True)
+        for key in {(expense.user_id, expense.category) for expense in expenses}
+    }
+
+    # one executemany and one commit per chunk - the INSERT is compiled once, pymysql
+    # sends each chunk as multi-row INSERT ... VALUES batches, sqlite reuses one prepared statement
+    inserted = 0
+    for start in range(0, len(expenses), BULK_CHUNK_SIZE):
+        rows = [
+            {
+                "date": expense.date,
+                "category_id": category_ids[(expense.user_id, expense.category)],
+                "description": expense.description,
+                "amount": expense.amount,
+                "user_id": expense.user_id,
+            }
+            for expense in expenses[start:start + BULK_CHUNK_SIZE]
+        ]
+        # the new ids are only needed to keep cached analytics columns current, and
+        # only a driver that returns them from an executemany (not MySQL) gives them cheaply
+        user_ids = {row["user_id"] for row in rows}
+        if column_cache.holds(user_ids) and db.get_bind().dialect.insert_executemany_returning:
+            table = Expense.__table__
+            ids = db.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+        else:
+            db.execute(insert(Expense.__table__), rows)
+            ids = None
+        add_many_to_rollup(db, rows)
+        add_many_to_sketches(db, rows)
+        db.commit()
+        versions = response_cache.bump(*user_ids)
+        if ids is not None:
+            new_rows = {}
+            for row, expense_id in zip(rows, ids):
+                new_rows.setdefault(row["user_id"], []).append((row["date"], row["category_id"], row["amount"], expense_id))
+            for user_id, user_rows in new_rows.items():
+                column_cache.append(user_id, versions[user_id], user_rows)
+        for user_id, entries in _autocomplete_entries(db, rows).items():
+            autocomplete_index.record(user_id, entries)
+        inserted += len(rows)
+
+    return {"message": "Expenses added successfully", "inserted": inserted}
+
+
+# GET: user expenses, filtered and paginated by (date, id) cursor
+@app_routes.get("/expenses/", response_model=ExpensePage, response_class=FastJSONResponse)
+@db_route
+def get_all_expenses(
+    username: str = Query(...),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    category: Optional[List[str]] = Query(None),
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db)
+):
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    query = db.query(*ExpenseRow.COLUMNS).filter(Expense.user_id == user_id)
+    if start_date:
+        query = query.filter(Expense.date >= start_date)
+    if end_date:
+        query = query.filter(Expense.date <= end_date)
+    if category:
+        query = query.filter(Expense.category_id.in_(category_cache.resolve_many(db, user_id, category)))
+    if min_amount is not None:
+        query = query.filter(Expense.amount >= min_amount)
+    if max_amount is not None:
+        query = query.filter(Expense.amount <= max_amount)
+
+    # keyset: continue right after the last (date, id) of the previous page
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(
+                Expense.date < cursor_date,
+                and_(Expense.date == cursor_date, Expense.id < cursor_id)
+            )
+        )
+
+    # one extra row tells us if there is another page
+    rows = (
+        query.order_by(Expense.date.desc(), Expense.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+
+    # returned as a Response, so FastAPI skips jsonable_encoder
+    names = category_cache.names(db, (row.category_id for row in rows))
+    return FastJSONResponse({"expenses": ExpenseRow.from_rows(rows, names), "next_cursor": next_cursor})
+
+
+# GET: a user's expenses whose description matches q, best match first
+@app_routes.get("/expenses/search", response_model=ExpenseSearchPage, response_class=FastJSONResponse)
+@db_route
+def search_user_expenses(
+    username: str = Query(...),
+    q: str = Query(..., max_length=200),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    rows, more = search_expenses(db, user_id, q, limit, offset)
+    names = category_cache.names(db, (row.category_id for row in rows))
+    results = [
+        dict(expense.to_dict(), score=round(float(row.score), 6))
+        for expense, row in zip(ExpenseRow.from_rows(rows, names), rows)
+    ]
+    return FastJSONResponse({"query": q, "results": results, "next_offset": offset + limit if more else None})
+
+
+# GET: description and category completions of what the user has typed so far
+@app_routes.get("/expenses/autocomplete", response_model=Suggestions)
+@db_route
+def autocomplete_expenses(
+    username: str = Query(...),
+    prefix: str = Query("", max_length=100),
+    limit: int = Query(5, ge=1, le=MAX_SUGGESTIONS),
+    db: Session = Depends(get_db)
+):
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return autocomplete_index.suggest(db, user_id, prefix, limit)
+
+
+# GET: the median, p90 and p99 amount of each of a user's categories; with category and
+# amount also whether such an expense would be unusual for that category
+@app_routes.get("/expenses/insights")
+@db_route
+def get_expense_insights(
+    request: Request,
+    username: str = Query(...),
+    category: Optional[str] = Query(None),
+    amount: Optional[float] = Query(None, ge=0),
+    db: Session = Depends(get_db)
+):
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if (category is None) != (amount is None):
+        raise HTTPException(status_code=400, detail="category and amount must be given together")
+    name = normalize_category(category) if category is not None else None
+
+    def insights():
+        sketches = load_sketches(db, user_id)
+        names = category_cache.names(db, sketches)
+        categories = [dict(category=names[category_id], **describe(sketch)) for category_id, sketch in sketches.items()]
+        result = {"categories": sorted(categories, key=lambda c: (-c["count"], c["category"])), "check": None}
+        if name is not None:
+            category_id = category_cache.resolve(db, user_id, name)
+            result["check"] = dict(category=name, amount=amount, **check_amount(sketches.get(category_id), amount))
+        return result
+
+    return response_cache.respond(request, user_id, "expense_insights", (name, amount), insights)
+
+
+# GET: export all of a user's expenses (streamed)
+@app_routes.get("/expenses/export")
+def export_expenses(
+    username: str = Query(...),
+    export_format: str = Query("csv", alias="format"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    if export_format not in STREAMERS:
+        raise HTTPException(status_code=400, detail="Format must be 'csv' or 'ndjson'")
+
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
+    return StreamingResponse(
+        STREAMERS[export_format](user_id, start_date, end_date),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="expenses_{username}.{export_format}"'},
+    )
+
+
+# GET: spending per day/week/month/quarter/year, every bucket in the window present (0 when empty)
+@app_routes.get("/expenses/timeseries")
+@db_route
+def get_expenses_timeseries(
+    request: Request,
+    username: str = Query(...),
+    granularity: str = Query("month"),
+    periods: Optional[int] = Query(None, ge=1),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    by_category: bool = Query(False),
+    budget: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-# GET: all expenses
-@app_routes.get("/expenses/")
-def get_all_expenses(db: Session = Depends(get_db)):
-    expenses = db.query(Expense).all()
-    return {"expenses": expenses}
+    end_date = end_date or date.today()
+    if start_date is None and periods is None:
+        periods = 12
+
+    def timeseries():
+        series = expense_timeseries(
+            db, user_id, granularity, end_date,
+            periods=periods, start_date=start_date, by_category=by_category, with_budget=budget,
+        )
+        return {"granularity": granularity, "series": series}
+
+    params = (granularity, periods, start_date, end_date, by_category, budget)
+    return response_cache.respond(request, user_id, "timeseries", params, timeseries)
 
 
 # PUT: update expense by ID
-@app_routes.put("/expenses/{expense_id}")
+@app_routes.put("/expenses/{expense_id}", response_model=ExpenseUpdated)
+@db_route
 def update_expense(expense_id: int, updated_expense: ExpenseCreate, db: Session = Depends(get_db)):
     expense = db.query(Expense).filter_by(id=expense_id).first()
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
+    category_id = category_cache.resolve(db, expense.user_id, updated_expense.category, create=True)
+    previous = (expense.description, category_cache.name(db, expense.category_id))
+    # a sketch cannot take an amount back - rebuilt below when the amount or category changes
+    resketch = set()
+    if (expense.category_id, expense.amount) != (category_id, updated_expense.amount):
+        resketch = {expense.category_id, category_id}
+    # move the old amount out of its bucket and the new one in (month/category may change)
+    remove_from_rollup(db, expense.user_id, expense.date, expense.category_id, expense.amount)
     expense.date = updated_expense.date
-    expense.category = updated_expense.category
+    expense.category_id = category_id
     expense.description = updated_expense.description
     expense.amount = updated_expense.amount
+    add_to_rollup(db, expense.user_id, expense.date, expense.category_id, expense.amount)
+    if resketch:
+        rebuild_sketches(db, expense.user_id, resketch)
 
     db.commit()
+    response_cache.bump(expense.user_id)
     db.refresh(expense)
-    return {"message": "Expense updated successfully", "updated_expense": expense}
+    category = category_cache.name(db, category_id)
+    autocomplete_index.record(expense.user_id, [previous], delta=-1)
+    autocomplete_index.record(expense.user_id, [(expense.description, category)])
+    return {"message": "Expense updated successfully", "updated_expense": ExpenseRow.from_entity(expense, category).to_dict()}
 
 
 # DELETE: delete expense by ID
-@app_routes.delete("/expenses/{expense_id}")
+@app_routes.delete("/expenses/{expense_id}", response_model=ExpenseDeleted)
+@db_route
 def delete_expense(expense_id: int, db: Session = Depends(get_db)):
     expense = db.query(Expense).filter_by(id=expense_id).first()
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
+    # copied before the commit expires the deleted instance
+    deleted = ExpenseRow.from_entity(expense, category_cache.name(db, expense.category_id))
+    remove_from_rollup(db, expense.user_id, expense.date, expense.category_id, expense.amount)
     db.delete(expense)
+    rebuild_sketches(db, deleted.user_id, [expense.category_id])
     db.commit()
-    return {"message": "Expense deleted successfully", "deleted_expense": expense}
+    response_cache.bump(deleted.user_id)
+    autocomplete_index.record(deleted.user_id, [(deleted.description, deleted.category)], delta=-1)
+    return {"message": "Expense deleted successfully", "deleted_expense": deleted.to_dict()}
 
 
 # GET: total expenses
 @app_routes.get("/expenses/total_by_category/")
+@db_route
 def get_total_by_category(category: str, db: Session = Depends(get_db), user_id: int = 1):
-    total_amount = (
-        db.query(func.sum(Expense.amount))  # שימוש ב-func.sum כדי לחשב את הסכום
-        .filter_by(category=category, user_id=user_id)
-        .scalar()  # מחזיר את הערך הסקלרי (התוצאה)
-    )
+    category_id = category_cache.resolve(db, user_id, category)
+    total_amount = None
+    if category_id is not None:
+        total_amount = (
+            db.query(func.sum(Expense.amount))  # שימוש ב-func.sum כדי לחשב את הסכום
+            .filter_by(category_id=category_id, user_id=user_id)
+            .scalar()  # מחזיר את הערך הסקלרי (התוצאה)
+        )
     if total_amount is None:
         total_amount = 0.0
     return {"category": category, "total_amount": total_amount}
@@ -137,60 +546,44 @@ def get_total_by_category(category: str, db: Session = Depends(get_db), user_id:
 
 # GET: 5 recent expenses
 @app_routes.get("/expenses/recent/{username}")
-def get_recent_expenses(username: str, db: Session = Depends(get_db)):
+@db_route
+def get_recent_expenses(username: str, request: Request, db: Session = Depends(get_db)):
     # בדוק אם המשתמש קיים
-    user = db.query(User).filter_by(username=username).first()
-    if not user:
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
         raise HTTPException(status_code=404, detail="User not found")
 
+    return response_cache.respond(request, user_id, "recent", (), lambda: _recent_expenses(db, user_id))
+
+
+def _recent_expenses(db: Session, user_id: int):
     # שלוף את 5 ההוצאות האחרונות לפי ID בסדר יורד
     expenses = (
-        db.query(Expense)
-        .filter(Expense.user_id == user.id)
+        db.query(Expense.date, Expense.category_id, Expense.description, Expense.amount)
+        .filter(Expense.user_id == user_id)
         .order_by(Expense.id.desc())  # סדר לפי ID מהגדול לקטן
         .limit(5)
         .all()
     )
 
+    names = category_cache.names(db, (expense.category_id for expense in expenses))
     return [
         {
             "date": expense.date,
-            "category": expense.category,
+            "category": names[expense.category_id],
             "description": expense.description,
             "amount": expense.amount,
         }
         for expense in expenses
     ]
 
-#get income and expenses
-@app_routes.get("/expenses/period/{period}")
-def get_expenses_by_period(period: str, username: str = Query(...), db: Session = Depends(get_db)):
-    # תומך רק ב-last6Months
-    if period != "last6Months":
-        raise HTTPException(status_code=400, detail="Only 'last6Months' is supported.")
 
-    today = date.today()
-
-    start_date = today.replace(day=1) - relativedelta(months=5)
-    months_range = 6
-
-
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    expenses = (
-        db.query(
-            func.date_format(Expense.date, "%Y-%m").label("month"),
-            func.sum(Expense.amount).label("spent")
-        )
-        .filter(Expense.user_id == user.id, Expense.date >= start_date)
-        .group_by(func.date_format(Expense.date, "%Y-%m"))
-        .all()
-    )
+#"YYYY-MM" -> budget, from January of last year up to this month
+def _budgets_by_month(db: Session, user_id: int, today: date):
     budgets = (
         db.query(MonthlyBudget.year, MonthlyBudget.month, MonthlyBudget.budget)
         .filter(
-            MonthlyBudget.user_id == user.id,
+            MonthlyBudget.user_id == user_id,
             or_(
                 and_(
                     MonthlyBudget.year == today.year,
@@ -201,26 +594,50 @@ def get_expenses_by_period(period: str, username: str = Query(...), db: Session
         )
         .all()
     )
-    print("Budgets fetched from database:")
-    for budget in budgets:
-        print(f"Year: {budget.year}, Month: {budget.month}, Budget: {budget.budget}")
-    budgets_dict = {
+    return {
         f"{b.year}-{b.month:02d}": b.budget for b in budgets
     }
+
+
+#spent vs budget for the current month and the months before it, newest first
+def _spent_vs_budget(spent_by_month: dict, budgets_dict: dict, today: date, months_range: int = 6):
     result = []
     for i in range(months_range):
         target_date = today.replace(day=1) - relativedelta(months=i)
         target_month = target_date.strftime("%Y-%m")
-        spent = next((e.spent for e in expenses if e.month == target_month), 0)
+        spent = spent_by_month.get(target_month, 0)
         budget = budgets_dict.get(target_month, 0)
         result.append({"month": target_month, "spent": spent, "budget": budget})
-
     return result
 
+#get income and expenses
+@app_routes.get("/expenses/period/{period}")
+@db_route
+def get_expenses_by_period(period: str, request: Request, username: str = Query(...), db: Session = Depends(get_db)):
+    # תומך רק ב-last6Months
+    if period != "last6Months":
+        raise HTTPException(status_code=400, detail="Only 'last6Months' is supported.")
+
+    today = date.today()
+
+
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    def last_months():
+        series = expense_timeseries(db, user_id, "month", today, periods=6, with_budget=True)
+        # newest month first
+        return [{"month": point["period"], "spent": point["spent"], "budget": point["budget"]} for point in reversed(series)]
+
+    # the window moves with the date, so today is part of the key
+    return response_cache.respond(request, user_id, "period", (period, today.isoformat()), last_months)
+
 
 
 #get expenses by period detailed
-@app_routes.get("/expenses/period_detailed2/{period}")
+@app_routes.get("/expenses/period_detailed2/{period}", response_model=ExpenseList, response_class=FastJSONResponse)
+@db_route
 def get_expenses_period_detailed2(period: str, username: str = Query(...), db: Session = Depends(get_db)):
     from datetime import date, timedelta
     from dateutil.relativedelta import relativedelta
@@ -236,26 +653,26 @@ def get_expenses_period_detailed2(period: str, username: str = Query(...), db: S
         start_date = today.replace(day=1)
         end_date = None
     elif period == "last6Months":
-        start_date = today.replace(day=1) - timedelta(days=30 * 5)
+        start_date = today.replace(day=1) - relativedelta(months=5)
         end_date = None
     elif period == "lastYear":
-        start_date = today.replace(day=1) - timedelta(days=30 * 11)
+        start_date = today.replace(day=1) - relativedelta(months=11)
         end_date = None
     else:
         raise HTTPException(status_code=400, detail="Invalid period")
 
 
-    user = db.query(User).filter_by(username=username).first()
-    if not user:
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
         raise HTTPException(status_code=404, detail="User not found")
 
 
     if period == "currentDay":
 
         expenses = (
-            db.query(Expense)
+            db.query(*ExpenseRow.COLUMNS)
             .filter(
-                Expense.user_id == user.id,
+                Expense.user_id == user_id,
                 Expense.date == start_date
             )
             .order_by(Expense.date.desc())
@@ -264,9 +681,9 @@ def get_expenses_period_detailed2(period: str, username: str = Query(...), db: S
     else:
 
         expenses = (
-            db.query(Expense)
+            db.query(*ExpenseRow.COLUMNS)
             .filter(
-                Expense.user_id == user.id,
+                Expense.user_id == user_id,
                 Expense.date >= start_date
             )
             .order_by(Expense.date.desc())
@@ -274,27 +691,18 @@ def get_expenses_period_detailed2(period: str, username: str = Query(...), db: S
         )
 
 
-    result = []
-    for e in expenses:
-        result.append({
-            "id": e.id,
-            "date": e.date.isoformat(),
-            "category": e.category,
-            "description": e.description,
-            "amount": e.amount,
-            "user_id": e.user_id,
-        })
-
-    return {"expenses": result}
+    names = category_cache.names(db, (row.category_id for row in expenses))
+    return FastJSONResponse({"expenses": ExpenseRow.from_rows(expenses, names)})
 
 
 
 #monthly expenses breakdown
 @app_routes.get("/expenses/monthly/{username}")
-def get_monthly_expenses(username: str, db: Session = Depends(get_db)):
+@db_route
+def get_monthly_expenses(username: str, request: Request, db: Session = Depends(get_db)):
 
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
         raise HTTPException(status_code=404, detail="User not found")
 
 
@@ -302,85 +710,159 @@ def get_monthly_expenses(username: str, db: Session = Depends(get_db)):
     current_year = datetime.now().year
 
 
-    expenses = (
-        db.query(Expense)
-        .filter(
-            Expense.user_id == user.id,
-            extract("month", Expense.date) == current_month,
-            extract("year", Expense.date) == current_year,
-        )
-        .all()
-    )
+    def breakdown_with_total():
+        breakdown = monthly_breakdown(db, user_id, current_year, current_month)
+        total = sum(breakdown.values())
+        return {"total": total, "breakdown": breakdown}
 
+    return response_cache.respond(request, user_id, "monthly", (current_year, current_month), breakdown_with_total)
 
-    total = sum(expense.amount for expense in expenses)
-    breakdown = {}
-    for expense in expenses:
-        breakdown[expense.category] = breakdown.get(expense.category, 0) + expense.amount
 
-    return {"total": total, "breakdown": breakdown}
 
 
 
+DASHBOARD_FIELDS = ("recent", "monthly", "last_6_months", "budget_status")
 
 
-# POST: create new budget
-@app_routes.post("/budgets/")
-def add_budget(budget: BudgetCreate, db: Session = Depends(get_db)):
+# GET: every home page widget in one request - ?fields=recent,monthly picks a subset
+@app_routes.get("/dashboard/{username}")
+@db_route
+def get_dashboard(username: str, request: Request, fields: Optional[str] = Query(None), db: Session = Depends(get_db)):
+    if fields:
+        selected = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    else:
+        selected = list(DASHBOARD_FIELDS)
+    unknown = [field for field in selected if field not in DASHBOARD_FIELDS]
+    if unknown or not selected:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(DASHBOARD_FIELDS)}")
 
-    user_id = budget.user_id if budget.user_id else 1
+    user_id = resolve_user_id(db, username)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    default_user = db.query(User).filter(User.id == user_id).first()
-    if not default_user:
-        default_user = User(
+    today = date.today()
+    current_month = today.strftime("%Y-%m")
+
+    # at most three statements: recent rows, six months of rollup buckets, budgets
+    def dashboard():
+        result = {}
+        if "recent" in selected:
+            result["recent"] = _recent_expenses(db, user_id)
+
+        if "monthly" in selected or "last_6_months" in selected or "budget_status" in selected:
+            start_date = today.replace(day=1) - relativedelta(months=5)
+            totals = category_totals_since(db, user_id, start_date.year, start_date.month)
+            breakdown = totals.get(current_month, {})
+        if "last_6_months" in selected or "budget_status" in selected:
+            budgets_dict = _budgets_by_month(db, user_id, today)
+
+        if "monthly" in selected:
+            result["monthly"] = {"total": sum(breakdown.values()), "breakdown": breakdown}
+        if "last_6_months" in selected:
+            spent_by_month = {month: sum(categories.values()) for month, categories in totals.items()}
+            result["last_6_months"] = _spent_vs_budget(spent_by_month, budgets_dict, today)
+        if "budget_status" in selected:
+            budget = budgets_dict.get(current_month)
+            total_expenses = sum(breakdown.values())
+            # no budget set for this month yet
+            result["budget_status"] = None if budget is None else {
+                "year": today.year,
+                "month": today.month,
+                "monthly_budget": budget,
+                "total_expenses": total_expenses,
+                "remaining_budget": budget - total_expenses,
+            }
+        return result
+
+    return response_cache.respond(request, user_id, "dashboard", (tuple(selected), today.isoformat()), dashboard)
+
+
+#the budget routes fall back to user 1 and create it when missing - flushed, so it
+# is committed together with the budgets
+def _budget_user_id(db: Session, user_id: Optional[int]) -> int:
+    user_id = user_id if user_id else 1
+    if db.query(User.id).filter(User.id == user_id).first() is None:
+        db.add(User(
             id=user_id,
             username="default_user",
             fullname="Default user",
             email="default@domain.com",
             password="default_password"
-        )
-        db.add(default_user)
-        db.commit()
-        db.refresh(default_user)
+        ))
+        db.flush()
+    return user_id
+
 
-    new_budget = MonthlyBudget(
-        year=budget.year,
-        month=budget.month,
-        budget=budget.budget,
-        user_id=user_id
+def _saved_budgets(db: Session, user_id: int, year: int, months) -> list:
+    rows = (
+        db.query(*BudgetRow.COLUMNS)
+        .filter(MonthlyBudget.user_id == user_id, MonthlyBudget.year == year, MonthlyBudget.month.in_(months))
+        .order_by(MonthlyBudget.month)
+        .all()
     )
-    db.add(new_budget)
+    return [BudgetRow(*row).to_dict() for row in rows]
+
+
+# POST: create or replace the budget of one month
+@app_routes.post("/budgets/", response_model=BudgetSaved)
+@db_route
+def add_budget(budget: BudgetCreate, db: Session = Depends(get_db)):
+    if budget.month not in MONTHS:
+        raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+    user_id = _budget_user_id(db, budget.user_id)
+    upsert_budgets(db, user_id, budget.year, {budget.month: budget.budget})
+    saved = _saved_budgets(db, user_id, budget.year, [budget.month])[0]
+    db.commit()
+    response_cache.bump(user_id)
+
+    return {"message": "Budget added successfully", "budget": saved}
+
+
+# PUT: set all twelve budgets of a year in one transaction
+@app_routes.put("/budgets/{year}", response_model=BudgetYearSaved)
+@db_route
+def set_year_budgets(year: int, plan: BudgetYearSet, db: Session = Depends(get_db)):
+    if len(plan.budgets) != len(MONTHS):
+        raise HTTPException(status_code=400, detail="Budgets must list 12 months, January first")
+    if any(amount < 0 for amount in plan.budgets):
+        raise HTTPException(status_code=400, detail="Budgets cannot be negative")
+    user_id = _budget_user_id(db, plan.user_id)
+    upsert_budgets(db, user_id, year, dict(zip(MONTHS, plan.budgets)))
+    saved = _saved_budgets(db, user_id, year, list(MONTHS))
     db.commit()
-    db.refresh(new_budget)
+    response_cache.bump(user_id)
 
-    return {"message": "Budget added successfully", "budget": new_budget}
+    return {"message": "Budgets saved successfully", "year": year, "budgets": saved}
 
 
+# GET: budget vs spent for every month of a year
+@app_routes.get("/budgets/{year}/status")
+@db_route
+def get_year_budget_status(year: int, request: Request, db: Session = Depends(get_db), user_id: int = 1):
+    return response_cache.respond(
+        request, user_id, "budget_year_status", (year,),
+        lambda: {"year": year, "months": yearly_status(db, user_id, year)},
+    )
 
-@app_routes.get("/budget/status/")
-def get_budget_status(year: int, month: int, db: Session = Depends(get_db), user_id: int = 1):
 
-    _, last_day = calendar.monthrange(year, month)
 
+@app_routes.get("/budget/status/")
+@db_route
+def get_budget_status(year: int, month: int, db: Session = Depends(get_db), user_id: int = 1):
 
-    budget = db.query(MonthlyBudget).filter_by(year=year, month=month, user_id=user_id).first()
-    if not budget:
+    row = db.query(MonthlyBudget.budget).filter_by(year=year, month=month, user_id=user_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Budget not found for the specified month and year")
+    budget = row.budget
 
 
-    expenses = (
-        db.query(Expense)
-        .filter(Expense.user_id == user_id)
-        .filter(Expense.date.between(f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last_day}"))
-        .all()
-    )
-    total_expenses = sum(expense.amount for expense in expenses)
-    remaining_budget = budget.budget - total_expenses
+    total_expenses = sum(monthly_breakdown(db, user_id, year, month).values())
+    remaining_budget = budget - total_expenses
 
     return {
         "year": year,
         "month": month,
-        "monthly_budget": budget.budget,
+        "monthly_budget": budget,
         "total_expenses": total_expenses,
         "remaining_budget": remaining_budget
     }
@@ -390,7 +872,7 @@ def get_budget_status(year: int, month: int, db: Session = Depends(get_db), user
 
 #front side
 # POST: create new user
-@app_routes.post("/users/")
+@app_routes.post("/users/", response_model=UserSaved)
 def create_user(user: UserCreate, db: Session = Depends(get_db)):
 
     if not validate_password_strength(user.password):
@@ -411,7 +893,7 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
-    return {"message": "User created", "user": new_user}
+    return {"message": "User created", "user": UserRow.from_entity(new_user).to_dict()}
 
 
 # DELETE: delete user
@@ -431,6 +913,10 @@ def delete_user(data: DeleteUserSchema, db: Session = Depends(get_db)):
 
     db.delete(user)
     db.commit()
+    user_id_cache.invalidate(data.username)
+    category_cache.forget_user(user.id)
+    response_cache.bump(user.id)
+    autocomplete_index.forget(user.id)
 
     return {"message": "User deleted successfully", "user": {"username": data.username, "email": data.email}}
 
@@ -442,9 +928,15 @@ def login(user: LoginSchema, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
 
-    if not verify_password(user.password, db_user.password):
+    valid, new_hash = verify_password_and_update(user.password, db_user.password)
+    if not valid:
         raise HTTPException(status_code=400, detail="Invalid credentials")
 
+    #stored hash used an outdated bcrypt cost
+    if new_hash:
+        db_user.password = new_hash
+        db.commit()
+
     return {
         "id": db_user.id,
         "username": db_user.username,
@@ -453,14 +945,15 @@ def login(user: LoginSchema, db: Session = Depends(get_db)):
     }
 
 @app_routes.post("/logout/")
-def logout():
+async def logout():
 
     #use local storage for front side
     #only to check that the user is log out
     return {"message": "Logged out successfully"}
 
 
-@app_routes.put("/users/update-profile/{user_id}")
+@app_routes.put("/users/update-profile/{user_id}", response_model=UserSaved)
+@db_route
 def update_user_profile(user_id: int, fullname: str, username: str, email: str, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -477,12 +970,15 @@ def update_user_profile(user_id: int, fullname: str, username: str, email: str,
         raise HTTPException(status_code=400, detail="Email is already in use by another user")
 
 
+    old_username = user.username
     user.fullname = fullname
     user.username = username
     user.email = email
     db.commit()
+    # after the commit, so a concurrent lookup cannot cache the old name again
+    user_id_cache.invalidate(old_username)
     db.refresh(user)
-    return {"message": "Profile updated successfully", "user": user}
+    return {"message": "Profile updated successfully", "user": UserRow.from_entity(user).to_dict()}
 
 
 
@@ -0,0 +1,97 @@
+# search.py
+# Full-text search over expense descriptions. SQLite keeps an FTS5 index
+# (expenses_fts, external content over expenses) up to date through triggers, so
+# every write path - single, bulk, update, delete - is covered without the routes
+# doing anything. MySQL uses a FULLTEXT index, which InnoDB maintains itself.
+# Both are created by migration step 5 (DataBase/migrations.py). Results are ranked
+# (bm25 on SQLite, MATCH relevance on MySQL) and paged by offset.
+import re
+
+from fastapi import HTTPException
+from sqlalchemy import column, func, inspect, literal_column, table, text
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from DataBase.DBmodels import Expense
+from dto import ExpenseRow
+
+FULLTEXT_INDEX = "ft_expenses_description"
+# words used from one query; the rest is ignored
+MAX_TERMS = 10
+
+_fts = table("expenses_fts", column("rowid"))
+
+SQLITE_FTS_SETUP = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5("
+    "description, content='expenses', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses BEGIN"
+    " INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN"
+    " INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS expenses_fts_update AFTER UPDATE OF description ON expenses BEGIN"
+    " INSERT INTO expenses_fts(expenses_fts, rowid, description) VALUES ('delete', old.id, old.description);"
+    " INSERT INTO expenses_fts(rowid, description) VALUES (new.id, new.description); END",
+    # index whatever the table already holds
+    "INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')",
+)
+
+
+def create_search_index(bind):
+    #idempotent - also repairs the FTS table after the expenses table was recreated
+    if bind.dialect.name == "mysql":
+        existing = {index["name"] for index in inspect(bind).get_indexes(Expense.__tablename__)}
+        if FULLTEXT_INDEX not in existing:
+            with bind.begin() as conn:
+                conn.execute(text(f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON expenses (description)"))
+        return
+    with bind.begin() as conn:
+        for statement in SQLITE_FTS_SETUP:
+            conn.execute(text(statement))
+
+
+def search_terms(q: str) -> list:
+    return re.findall(r"\w+", (q or "").lower())[:MAX_TERMS]
+
+
+def _sqlite_query(terms: list) -> str:
+    #every word must appear; the last one may be unfinished ("coff" finds coffee)
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _mysql_query(terms: list) -> str:
+    return " ".join(f"+{term}" for term in terms) + "*"
+
+
+def search_expenses(db: Session, user_id: int, q: str, limit: int, offset: int) -> tuple:
+    #(rows with a score, best first; whether more follow)
+    terms = search_terms(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+
+    if db.get_bind().dialect.name == "mysql":
+        relevance = match(Expense.description, against=_mysql_query(terms)).in_boolean_mode()
+        query = (
+            db.query(*ExpenseRow.COLUMNS, relevance.label("score"))
+            .filter(Expense.user_id == user_id, relevance > 0)
+            .order_by(relevance.desc(), Expense.id.desc())
+        )
+    else:
+        # bm25 is lower for better matches - negated, so a higher score is better on both databases
+        rank = func.bm25(literal_column("expenses_fts"))
+        query = (
+            db.query(*ExpenseRow.COLUMNS, (-rank).label("score"))
+            .join(_fts, _fts.c.rowid == Expense.id)
+            .filter(literal_column("expenses_fts").op("MATCH")(_sqlite_query(terms)), Expense.user_id == user_id)
+            .order_by(rank, Expense.id.desc())
+        )
+    try:
+        rows = query.limit(limit + 1).offset(offset).all()
+    except OperationalError as e:
+        # no such table: expenses_fts / Can't find FULLTEXT index
+        if "expenses_fts" in str(e) or "FULLTEXT" in str(e):
+            raise HTTPException(status_code=503, detail="Search index is missing - run DataBase/migrations.py")
+        raise
+    return rows[:limit], len(rows) > limit
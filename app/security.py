@@ -1,13 +1,94 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
 from passlib.context import CryptContext
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor - hashes made with another cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# processes doing bcrypt, and how many more requests may wait for one before we answer 503
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_SIZE = int(os.getenv("PASSWORD_QUEUE_SIZE", str(4 * PASSWORD_WORKERS)))
+PASSWORD_RETRY_AFTER = os.getenv("PASSWORD_RETRY_AFTER", "1")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor = None
+_executor_lock = threading.Lock()
+# admission control: one slot per running or waiting bcrypt job
+_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE_SIZE)
+
+
+def _hash_in_worker(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_in_worker(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    #the new hash is only set when the old one used an outdated cost
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn - forking a process that already runs server threads is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def _busy(detail: str) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail, headers={"Retry-After": PASSWORD_RETRY_AFTER})
+
+
+def _run(func, *args):
+    #the request thread only waits here - bcrypt itself runs in a worker process
+    if not _slots.acquire(blocking=False):
+        raise _busy("Too many password requests, try again shortly")
+    try:
+        try:
+            future = _get_executor().submit(func, *args)
+        except BaseException:
+            _slots.release()
+            raise
+        future.add_done_callback(lambda _: _slots.release())
+        return future.result()
+    except BrokenProcessPool:
+        # a worker died - start a fresh pool for the next request
+        _reset_executor()
+        raise _busy("Password service restarting, try again shortly")
+
+
+def shutdown_password_pool():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
 
 def hash_password(password: str) -> str:
     #security function to hash the password
 
-    return pwd_context.hash(password)
+    return _run(_hash_in_worker, password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     #check if the password is correct
-    return pwd_context.verify(plain_password, hashed_password)
+    return verify_password_and_update(plain_password, hashed_password)[0]
+
+def verify_password_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    #check the password and get a rehashed value when the stored hash has an outdated cost
+    return _run(_verify_in_worker, plain_password, hashed_password)
@@ -0,0 +1,302 @@
+# sketches.py
+# "Typical spend" per category: a KLL quantile sketch of the expense amounts of each
+# (user, category), stored serialized in expense_category_sketches. A sketch keeps a
+# few hundred weighted amounts however many expenses it has seen, so the median, p90
+# and p99 of every category of a user come from one small read. New expenses are
+# added to the stored sketch (a bulk insert merges a sketch of the batch into it);
+# full levels are compacted as they fill up. A sketch cannot forget an amount, so an
+# edit or delete rebuilds the sketches of the categories it touched from the expenses.
+import argparse
+import math
+import os
+import random
+import struct
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from DataBase.DBmodels import Expense, ExpenseCategorySketch
+
+# items kept on the top level; at 200 the quantiles are within about 1% in rank
+SKETCH_K = int(os.getenv("SKETCH_K", "200"))
+# each level holds 2/3 of the items of the one above, down to this many
+LEVEL_DECAY = 2 / 3
+MIN_LEVEL_CAPACITY = 8
+INSIGHT_QUANTILES = (0.5, 0.9, 0.99)
+# no amount is called unusual in a category with fewer expenses than this
+UNUSUAL_MIN_COUNT = 5
+# users whose expenses are read by one query in a full rebuild
+REBUILD_USERS = 500
+
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BHQB")  # format version, k, amounts seen, levels
+
+
+class KLLSketch:
+    #an item on level h stands for 2**h amounts
+    __slots__ = ("k", "count", "levels")
+
+    def __init__(self, k: int = SKETCH_K, count: int = 0, levels: Optional[list] = None):
+        self.k = k
+        self.count = count
+        self.levels = levels or [[]]
+
+    @classmethod
+    def from_values(cls, values: Iterable[float], k: int = SKETCH_K) -> "KLLSketch":
+        sketch = cls(k)
+        sketch.levels[0] = list(values)
+        sketch.count = len(sketch.levels[0])
+        sketch._compact()
+        return sketch
+
+    def add(self, value: float):
+        self.levels[0].append(value)
+        self.count += 1
+        self._compact()
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in zip(self.levels, other.levels):
+            level.extend(items)
+        self.count += other.count
+        self._compact()
+        return self
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(MIN_LEVEL_CAPACITY, int(math.ceil(self.k * LEVEL_DECAY ** depth)))
+
+    def _compact(self):
+        #halve the lowest full level into the one above until every level fits
+        while sum(map(len, self.levels)) > sum(map(self._capacity, range(len(self.levels)))):
+            level = next(h for h, items in enumerate(self.levels) if len(items) >= self._capacity(h))
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            items = self.levels[level]
+            # an odd item out stays, so the weights still add up to count
+            kept = [items.pop()] if len(items) % 2 else []
+            items.sort()
+            self.levels[level + 1].extend(items[random.getrandbits(1)::2])
+            self.levels[level] = kept
+
+    def _cumulative(self):
+        #sorted amounts and the weight at or below each
+        items = sorted((value, 1 << level) for level, values in enumerate(self.levels) for value in values)
+        values, weights, total = [], [], 0
+        for value, weight in items:
+            total += weight
+            values.append(value)
+            weights.append(total)
+        return values, weights
+
+    def quantiles(self, fractions: Iterable[float]) -> list:
+        #nearest rank: the smallest amount with at least that fraction of all amounts at or below it
+        values, weights = self._cumulative()
+        if not values:
+            return [None for _ in fractions]
+        return [values[min(bisect_left(weights, q * self.count), len(values) - 1)] for q in fractions]
+
+    def rank(self, value: float) -> float:
+        #fraction of the amounts at or below value
+        if not self.count:
+            return 0.0
+        return sum(1 << level for level, values in enumerate(self.levels) for v in values if v <= value) / self.count
+
+    def to_bytes(self) -> bytes:
+        items = [value for values in self.levels for value in values]
+        return (
+            _HEADER.pack(FORMAT_VERSION, self.k, self.count, len(self.levels))
+            + struct.pack(f"<{len(self.levels)}H", *map(len, self.levels))
+            + struct.pack(f"<{len(items)}d", *items)
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KLLSketch":
+        version, k, count, depth = _HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unknown sketch format {version}")
+        sizes = struct.unpack_from(f"<{depth}H", data, _HEADER.size)
+        items = struct.unpack_from(f"<{sum(sizes)}d", data, _HEADER.size + 2 * depth)
+        levels, start = [], 0
+        for size in sizes:
+            levels.append(list(items[start:start + size]))
+            start += size
+        return cls(k, count, levels)
+
+
+def _upsert(db: Session, user_id: int, category_id: int, sketch: KLLSketch):
+    table = ExpenseCategorySketch.__table__
+    values = dict(
+        user_id=user_id, category_id=category_id, expense_count=sketch.count,
+        sketch=sketch.to_bytes(), updated_at=datetime.utcnow(),
+    )
+    if db.get_bind().dialect.name == "mysql":
+        stmt = mysql_insert(table).values(**values)
+        stmt = stmt.on_duplicate_key_update(
+            expense_count=stmt.inserted.expense_count, sketch=stmt.inserted.sketch, updated_at=stmt.inserted.updated_at
+        )
+    else:
+        stmt = sqlite_insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "category_id"],
+            set_={
+                "expense_count": stmt.excluded.expense_count,
+                "sketch": stmt.excluded.sketch,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+    db.execute(stmt)
+
+
+def add_to_sketches(db: Session, user_id: int, amounts: Dict[int, list]):
+    #amounts: category id -> amounts of new expenses. The stored sketches are locked
+    # (MySQL) until the commit, so concurrent adds to a category queue up
+    rows = (
+        db.query(ExpenseCategorySketch.category_id, ExpenseCategorySketch.sketch)
+        .filter(ExpenseCategorySketch.user_id == user_id, ExpenseCategorySketch.category_id.in_(list(amounts)))
+        .with_for_update()
+        .all()
+    )
+    stored = {row.category_id: row.sketch for row in rows}
+    for category_id, values in amounts.items():
+        if category_id not in stored:
+            sketch = KLLSketch.from_values(values)
+        elif len(values) == 1:
+            sketch = KLLSketch.from_bytes(stored[category_id])
+            sketch.add(values[0])
+        else:
+            sketch = KLLSketch.from_bytes(stored[category_id])
+            sketch.merge(KLLSketch.from_values(values, sketch.k))
+        _upsert(db, user_id, category_id, sketch)
+
+
+def add_many_to_sketches(db: Session, rows: list):
+    #rows are expense dicts (user_id, category_id, amount) - one read and one write per touched sketch
+    amounts = {}
+    for row in rows:
+        amounts.setdefault(row["user_id"], {}).setdefault(row["category_id"], []).append(row["amount"])
+    for user_id, by_category in amounts.items():
+        add_to_sketches(db, user_id, by_category)
+
+
+def _rebuild(db: Session, user_ids: list, category_ids: Optional[Iterable[int]]) -> int:
+    query = db.query(Expense.user_id, Expense.category_id, Expense.amount).filter(Expense.user_id.in_(user_ids))
+    stale = db.query(ExpenseCategorySketch).filter(ExpenseCategorySketch.user_id.in_(user_ids))
+    if category_ids is not None:
+        category_ids = list(category_ids)
+        query = query.filter(Expense.category_id.in_(category_ids))
+        stale = stale.filter(ExpenseCategorySketch.category_id.in_(category_ids))
+    amounts = {}
+    for row in query:
+        amounts.setdefault((row.user_id, row.category_id), []).append(row.amount)
+    stale.delete(synchronize_session=False)
+    now = datetime.utcnow()
+    rows = []
+    for (owner_id, category_id), values in amounts.items():
+        sketch = KLLSketch.from_values(values)
+        rows.append({
+            "user_id": owner_id, "category_id": category_id, "expense_count": sketch.count,
+            "sketch": sketch.to_bytes(), "updated_at": now,
+        })
+    if rows:
+        db.execute(insert(ExpenseCategorySketch.__table__), rows)
+    return len(rows)
+
+
+def rebuild_sketches(db: Session, user_id: Optional[int] = None, category_ids: Optional[Iterable[int]] = None) -> int:
+    #recompute from the expenses, in the caller's transaction; a category left without
+    # expenses loses its sketch. Without user_id every sketch is rebuilt
+    db.flush()  # the sessions do not autoflush - the pending edit or delete must be read
+    if user_id is not None:
+        return _rebuild(db, [user_id], category_ids)
+    db.query(ExpenseCategorySketch).delete(synchronize_session=False)
+    user_ids = [row.user_id for row in db.query(Expense.user_id).distinct()]
+    return sum(
+        _rebuild(db, user_ids[start:start + REBUILD_USERS], None)
+        for start in range(0, len(user_ids), REBUILD_USERS)
+    )
+
+
+def verify_sketches(db: Session, user_id: Optional[int] = None) -> list:
+    #the (user, category) pairs whose sketch does not count the same expenses as the table
+    expected_query = db.query(Expense.user_id, Expense.category_id, func.count(Expense.id).label("expense_count"))
+    actual_query = db.query(ExpenseCategorySketch.user_id, ExpenseCategorySketch.category_id, ExpenseCategorySketch.expense_count)
+    if user_id is not None:
+        expected_query = expected_query.filter(Expense.user_id == user_id)
+        actual_query = actual_query.filter(ExpenseCategorySketch.user_id == user_id)
+    expected = {
+        (row.user_id, row.category_id): row.expense_count
+        for row in expected_query.group_by(Expense.user_id, Expense.category_id)
+    }
+    actual = {(row.user_id, row.category_id): row.expense_count for row in actual_query}
+    return [
+        {"user_id": key[0], "category_id": key[1], "expected_count": expected.get(key, 0), "sketch_count": actual.get(key, 0)}
+        for key in sorted(set(expected) | set(actual))
+        if expected.get(key, 0) != actual.get(key, 0)
+    ]
+
+
+def build_sketches(bind):
+    #migration step: the table for databases created before it, filled from the expenses
+    ExpenseCategorySketch.__table__.create(bind=bind, checkfirst=True)
+    db = Session(bind=bind)
+    try:
+        rebuild_sketches(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+def load_sketches(db: Session, user_id: int) -> Dict[int, KLLSketch]:
+    #category id -> sketch, for all of a user's categories in one query
+    rows = (
+        db.query(ExpenseCategorySketch.category_id, ExpenseCategorySketch.sketch)
+        .filter(ExpenseCategorySketch.user_id == user_id)
+        .all()
+    )
+    return {row.category_id: KLLSketch.from_bytes(row.sketch) for row in rows}
+
+
+def describe(sketch: KLLSketch) -> dict:
+    median, p90, p99 = sketch.quantiles(INSIGHT_QUANTILES)
+    return {"count": sketch.count, "median": median, "p90": p90, "p99": p99}
+
+
+def check_amount(sketch: Optional[KLLSketch], amount: float) -> dict:
+    #where an amount falls among the category's expenses - unusual above the category's p99
+    if sketch is None or not sketch.count:
+        return {"percentile": None, "unusual": False}
+    p99 = sketch.quantiles([0.99])[0]
+    return {
+        "percentile": round(100 * sketch.rank(amount), 1),
+        "unusual": sketch.count >= UNUSUAL_MIN_COUNT and amount > p99,
+    }
+
+
+if __name__ == "__main__":
+    from DataBase.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Verify or rebuild the per-category expense sketches")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--user-id", type=int, default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "verify":
+            drift = verify_sketches(db, args.user_id)
+            for entry in drift:
+                print(entry)
+            print(f"{len(drift)} drifted sketches")
+            raise SystemExit(1 if drift else 0)
+        sketches = rebuild_sketches(db, args.user_id)
+        db.commit()
+        print(f"Sketches rebuilt: {sketches}")
+    finally:
+        db.close()
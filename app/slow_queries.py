@@ -0,0 +1,230 @@
+# slow_queries.py
+# Opt-in slow-query log (SLOW_QUERY_LOG=true). Engine cursor events time every
+# statement; one slower than SLOW_QUERY_MS is recorded with its SQL, redacted
+# parameters, the route that sent it and the duration, in a ring buffer read by
+# GET /internal/slow-queries. The EXPLAIN (SQLite EXPLAIN QUERY PLAN / MySQL EXPLAIN)
+# and the optional rotating file (SLOW_QUERY_FILE) are done by a background thread
+# on its own connection, so the request that ran the slow query does not wait.
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from logging.handlers import RotatingFileHandler
+
+from sqlalchemy import event
+
+from DataBase.database import env_flag
+from metrics import current_route
+from utiles import utcnow
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_LOG = env_flag("SLOW_QUERY_LOG", False)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", "200"))
+SLOW_QUERY_EXPLAIN = env_flag("SLOW_QUERY_EXPLAIN", True)
+SLOW_QUERY_FILE = os.getenv("SLOW_QUERY_FILE", "")
+SLOW_QUERY_FILE_BYTES = int(os.getenv("SLOW_QUERY_FILE_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_FILE_BACKUPS = int(os.getenv("SLOW_QUERY_FILE_BACKUPS", "5"))
+# slow queries waiting for their EXPLAIN; beyond this they are kept without a plan
+SLOW_QUERY_QUEUE_SIZE = int(os.getenv("SLOW_QUERY_QUEUE_SIZE", "1000"))
+
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+# set while the background thread runs an EXPLAIN, so the EXPLAIN is not timed itself
+_worker_state = threading.local()
+
+
+def redact_value(value):
+    #numbers, dates and NULLs help reading the plan; text may be a password or an email
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (str, bytes)):
+        return f"<redacted {type(value).__name__}({len(value)})>"
+    return f"<redacted {type(value).__name__}>"
+
+
+def redact_parameters(parameters, executemany=False):
+    if executemany:
+        # bulk inserts: the first row shows the shape, the count the size
+        rows = list(parameters or [])
+        return {"rows": len(rows), "first": redact_parameters(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: redact_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value) for value in parameters]
+    return redact_value(parameters)
+
+
+def explain(bind, statement: str, parameters):
+    with bind.connect() as conn:
+        if bind.dialect.name == "sqlite":
+            rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            # (id, parent, notused, detail) - the detail is the readable part
+            return [row[-1] for row in rows]
+        result = conn.exec_driver_sql("EXPLAIN " + statement, parameters)
+        return [dict(row._mapping) for row in result]
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=None, buffer_size: int = SLOW_QUERY_BUFFER, explain_plans: bool = SLOW_QUERY_EXPLAIN,
+                 path: str = SLOW_QUERY_FILE, max_bytes: int = SLOW_QUERY_FILE_BYTES,
+                 backups: int = SLOW_QUERY_FILE_BACKUPS, queue_size: int = SLOW_QUERY_QUEUE_SIZE):
+        # None turns the log off; the cursor hooks check it before timing anything
+        self.threshold_ms = threshold_ms
+        self.explain_plans = explain_plans
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._entries = deque(maxlen=buffer_size)
+        self._pending = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms is not None
+
+    def configure(self, threshold_ms=None, explain_plans=None, path=None):
+        self.threshold_ms = threshold_ms
+        if explain_plans is not None:
+            self.explain_plans = explain_plans
+        if path is not None and path != self.path:
+            self.close_file()
+            self.path = path
+
+    def record(self, statement: str, parameters, duration_ms: float, route, bind, executemany=False):
+        entry = {
+            "at": utcnow().isoformat(timespec="milliseconds") + "Z",
+            "duration_ms": round(duration_ms, 2),
+            "route": route or "background",
+            "sql": statement,
+            "params": redact_parameters(parameters, executemany),
+            "plan": None,
+        }
+        self._entries.append(entry)
+        self.recorded += 1
+        explainable = (self.explain_plans and not executemany
+                       and statement.lstrip().split(None, 1)[0].upper() in EXPLAINABLE)
+        if not explainable and not self.path:
+            return entry
+        try:
+            # the raw parameters ride along for the EXPLAIN only, they are never stored
+            self._pending.put_nowait((entry, bind, statement, parameters if explainable else None, explainable))
+        except queue.Full:
+            self.dropped += 1
+        return entry
+
+    def process_pending(self, timeout=None) -> int:
+        #EXPLAIN and write out queued entries; returns how many were handled
+        handled = 0
+        while True:
+            try:
+                item = self._pending.get(timeout=timeout) if timeout and not handled else self._pending.get_nowait()
+            except queue.Empty:
+                return handled
+            self._complete(*item)
+            handled += 1
+
+    def _complete(self, entry, bind, statement, parameters, explainable):
+        if explainable:
+            _worker_state.explaining = True
+            try:
+                entry["plan"] = explain(bind, statement, parameters)
+            except Exception as e:
+                entry["plan"] = {"error": str(e)}
+            finally:
+                _worker_state.explaining = False
+        if self.path:
+            self._write(entry)
+
+    def _write(self, entry):
+        if self._file is None:
+            self._file = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups,
+                                             encoding="utf-8")
+        self._file.emit(logging.makeLogRecord({"msg": json.dumps(entry, default=str)}))
+
+    def close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def entries(self, limit: int = 50) -> list:
+        #newest first
+        return list(reversed(self._entries))[:limit]
+
+    def clear(self):
+        self._entries.clear()
+        self.recorded = 0
+        self.dropped = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "recorded": self.recorded,
+            "buffered": len(self._entries),
+            "pending": self._pending.qsize(),
+            "dropped": self.dropped,
+            "file": self.path or None,
+        }
+
+
+slow_query_log = SlowQueryLog(threshold_ms=SLOW_QUERY_MS if SLOW_QUERY_LOG else None)
+
+
+def instrument_slow_queries(bind, explain_bind=None):
+    #explain_bind: a sync engine on the same database, for the async engine's sync_engine
+    explain_bind = explain_bind or bind
+
+    @event.listens_for(bind, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        if slow_query_log.enabled and context is not None and not getattr(_worker_state, "explaining", False):
+            context._slow_query_started = time.perf_counter()
+
+    @event.listens_for(bind, "after_cursor_execute")
+    def check_duration(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_slow_query_started", None)
+        if started is None or not slow_query_log.enabled:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms >= slow_query_log.threshold_ms:
+            slow_query_log.record(statement, parameters, duration_ms, current_route(), explain_bind, executemany)
+
+
+_writer_thread = None
+_writer_stop = threading.Event()
+
+
+def _write_loop():
+    while not _writer_stop.is_set():
+        try:
+            slow_query_log.process_pending(timeout=1)
+        except Exception:
+            logger.exception("Slow query log failed")
+    slow_query_log.process_pending()
+    slow_query_log.close_file()
+
+
+def start_slow_query_log():
+    global _writer_thread
+    if not slow_query_log.enabled or (_writer_thread is not None and _writer_thread.is_alive()):
+        return
+    _writer_stop.clear()
+    _writer_thread = threading.Thread(target=_write_loop, name="slow-query-log", daemon=True)
+    _writer_thread.start()
+
+
+def stop_slow_query_log():
+    global _writer_thread
+    _writer_stop.set()
+    if _writer_thread is not None:
+        _writer_thread.join(timeout=10)
+        _writer_thread = None
@@ -0,0 +1,184 @@
+# timeseries.py
+# Spending per day / week / month / quarter / year over any window, zero-filled.
+# Month and coarser buckets are summed from the monthly rollup (a few rows per month
+# even for multi-year windows); day and week buckets group the raw expenses by date.
+# Both are plain GROUP BY queries, no dialect specific date functions, so the same
+# code runs on SQLite and MySQL. Rows are folded into buckets in one pass and the
+# empty buckets are filled in a second linear pass over the window.
+from datetime import date, timedelta
+from typing import Optional
+
+from dateutil.relativedelta import relativedelta
+from fastapi import HTTPException
+from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import Session
+
+from DataBase.DBmodels import Expense, ExpenseMonthlyTotal, MonthlyBudget
+from categories import category_cache
+
+GRANULARITIES = ("day", "week", "month", "quarter", "year")
+# budgets are set per month, so they can only be shown on month or coarser buckets
+BUDGET_GRANULARITIES = ("month", "quarter", "year")
+# longest series one request may ask for (ten years of days)
+MAX_POINTS = 3660
+
+_STEPS = {
+    "day": relativedelta(days=1),
+    "week": relativedelta(weeks=1),
+    "month": relativedelta(months=1),
+    "quarter": relativedelta(months=3),
+    "year": relativedelta(years=1),
+}
+
+
+def bucket_start(day: date, granularity: str) -> date:
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        # ISO weeks start on Monday
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    if granularity == "quarter":
+        return date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+    return date(day.year, 1, 1)
+
+
+def bucket_label(start: date, granularity: str) -> str:
+    if granularity == "day":
+        return start.isoformat()
+    if granularity == "week":
+        year, week, _ = start.isocalendar()
+        return f"{year}-W{week:02d}"
+    if granularity == "month":
+        return start.strftime("%Y-%m")
+    if granularity == "quarter":
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    return str(start.year)
+
+
+def window(granularity: str, end_date: date, periods: Optional[int] = None, start_date: Optional[date] = None):
+    #(first bucket start, last bucket start) - either from start_date or `periods` buckets back from end_date
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    last = bucket_start(end_date, granularity)
+    if start_date is not None:
+        if start_date > end_date:
+            raise HTTPException(status_code=400, detail="start_date must be before end_date")
+        first = bucket_start(start_date, granularity)
+    else:
+        if periods is None or periods < 1:
+            raise HTTPException(status_code=400, detail="periods must be at least 1")
+        if periods > MAX_POINTS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_POINTS} points per request")
+        first = last - _STEPS[granularity] * (periods - 1)
+    return first, last
+
+
+def _month_filter(year_column, month_column, first: date, last: date):
+    #(year, month) between the first and last month, inclusive
+    return and_(
+        or_(year_column > first.year, and_(year_column == first.year, month_column >= first.month)),
+        or_(year_column < last.year, and_(year_column == last.year, month_column <= last.month)),
+    )
+
+
+def _spent_rows(db: Session, user_id: int, granularity: str, first: date, end: date, by_category: bool):
+    #(bucket start, category name or None, spent) per group
+    if granularity in BUDGET_GRANULARITIES:
+        columns = [ExpenseMonthlyTotal.year, ExpenseMonthlyTotal.month]
+        if by_category:
+            columns.append(ExpenseMonthlyTotal.category_id)
+        rows = (
+            db.query(*columns, func.sum(ExpenseMonthlyTotal.total).label("spent"))
+            .filter(
+                ExpenseMonthlyTotal.user_id == user_id,
+                _month_filter(ExpenseMonthlyTotal.year, ExpenseMonthlyTotal.month, first, end),
+            )
+            .group_by(*columns)
+            .all()
+        )
+        names = category_cache.names(db, (row.category_id for row in rows)) if by_category else {}
+        return [
+            (bucket_start(date(row.year, row.month, 1), granularity), names.get(row.category_id) if by_category else None, row.spent)
+            for row in rows
+        ]
+
+    columns = [Expense.date]
+    if by_category:
+        columns.append(Expense.category_id)
+    rows = (
+        db.query(*columns, func.sum(Expense.amount).label("spent"))
+        .filter(Expense.user_id == user_id, Expense.date >= first, Expense.date <= end)
+        .group_by(*columns)
+        .all()
+    )
+    names = category_cache.names(db, (row.category_id for row in rows)) if by_category else {}
+    return [
+        (bucket_start(row.date, granularity), names.get(row.category_id) if by_category else None, row.spent)
+        for row in rows
+    ]
+
+
+def _budget_by_bucket(db: Session, user_id: int, granularity: str, first: date, end: date) -> dict:
+    budgets = (
+        db.query(MonthlyBudget.year, MonthlyBudget.month, MonthlyBudget.budget)
+        .filter(
+            MonthlyBudget.user_id == user_id,
+            _month_filter(MonthlyBudget.year, MonthlyBudget.month, first, end),
+        )
+        .all()
+    )
+    # one budget per month - the last row wins, like the monthly views
+    per_month = {(b.year, b.month): b.budget for b in budgets}
+    totals = {}
+    for (year, month), budget in per_month.items():
+        start = bucket_start(date(year, month, 1), granularity)
+        totals[start] = totals.get(start, 0) + budget
+    return totals
+
+
+def expense_timeseries(
+    db: Session,
+    user_id: int,
+    granularity: str,
+    end_date: date,
+    periods: Optional[int] = None,
+    start_date: Optional[date] = None,
+    by_category: bool = False,
+    with_budget: bool = False,
+) -> list:
+    first, last = window(granularity, end_date, periods, start_date)
+    if with_budget and granularity not in BUDGET_GRANULARITIES:
+        raise HTTPException(
+            status_code=400, detail=f"Budget overlay needs one of: {', '.join(BUDGET_GRANULARITIES)}"
+        )
+    # the window always covers whole buckets
+    end = last + _STEPS[granularity] - timedelta(days=1)
+
+    starts = []
+    start = first
+    while start <= last:
+        starts.append(start)
+        if len(starts) > MAX_POINTS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_POINTS} points per request")
+        start = start + _STEPS[granularity]
+
+    spent = {}
+    categories = {}
+    for bucket, category, amount in _spent_rows(db, user_id, granularity, first, end, by_category):
+        spent[bucket] = spent.get(bucket, 0) + amount
+        if by_category:
+            bucket_categories = categories.setdefault(bucket, {})
+            bucket_categories[category] = bucket_categories.get(category, 0) + amount
+    budgets = _budget_by_bucket(db, user_id, granularity, first, end) if with_budget else {}
+
+    series = []
+    for start in starts:
+        point = {"period": bucket_label(start, granularity), "start": start, "spent": spent.get(start, 0)}
+        if by_category:
+            point["categories"] = categories.get(start, {})
+        if with_budget:
+            point["budget"] = budgets.get(start, 0)
+        series.append(point)
+    return series
@@ -0,0 +1,144 @@
+# user_cache.py
+# username -> user id, so the read routes skip the users lookup on every call.
+# In-process LRU + TTL by default; set USER_CACHE_URL=redis://... to share one cache
+# between uvicorn workers (then an invalidation is seen by every worker at once).
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from DataBase.DBmodels import User
+from logs import bind_log_context
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_URL = os.getenv("USER_CACHE_URL")
+
+
+class LocalUserIdCache:
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # username -> (user_id, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return entry[0]
+
+    def set(self, username: str, user_id: int):
+        with self._lock:
+            self._entries[username] = (user_id, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisUserIdCache:
+    #shared between workers; redis is an optional dependency, only needed for this backend
+    def __init__(self, url: str, ttl: float = USER_CACHE_TTL, prefix: str = "user_id:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, username: str) -> Optional[int]:
+        value = self.client.get(self.prefix + username)
+        return int(value) if value is not None else None
+
+    def set(self, username: str, user_id: int):
+        self.client.set(self.prefix + username, user_id, ex=max(int(self.ttl), 1))
+
+    def delete(self, username: str):
+        self.client.delete(self.prefix + username)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class UserIdResolver:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def resolve(self, db: Session, username: str) -> Optional[int]:
+        user_id = self.backend.get(username)
+        if user_id is not None:
+            self._count(hit=True)
+            return user_id
+        self._count(hit=False)
+        row = db.query(User.id).filter(User.username == username).first()
+        if row is None:
+            # unknown usernames are not cached - the user may register a moment later
+            return None
+        self.backend.set(username, row.id)
+        return row.id
+
+    def invalidate(self, username: str):
+        self.backend.delete(username)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "size": self.backend.size(),
+        }
+
+
+def set_user_cache_backend(backend):
+    #plug in any object with get/set/delete/clear/size
+    user_id_cache.backend = backend
+
+
+user_id_cache = UserIdResolver(RedisUserIdCache(USER_CACHE_URL) if USER_CACHE_URL else LocalUserIdCache())
+
+
+def resolve_user_id(db: Session, username: str) -> Optional[int]:
+    user_id = user_id_cache.resolve(db, username)
+    if user_id is not None:
+        # log records of this request carry the user from here on
+        bind_log_context(user_id=user_id)
+    return user_id
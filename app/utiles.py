@@ -1,11 +1,13 @@
 from fastapi import HTTPException
-from typing import Optional, List
+from typing import Optional, List, Tuple
+from datetime import date, datetime, timezone
 
 from models import Expense
+from categories import DEFAULT_CATEGORIES
 
 expenses: List[Expense] = []
 monthly_budget: Optional[float] = None
-VALID_CATEGORIES = {"food", "transport", "entertainment", "health"}
+VALID_CATEGORIES = set(DEFAULT_CATEGORIES.values())
 
 
 def calculate_total():
@@ -26,4 +28,22 @@ def validate_password_strength(password: str) -> bool:
     if not any(ch.isupper() for ch in password):
         return False
 
-    return True
\ No newline at end of file
+    return True
+
+
+def encode_cursor(last_date: date, last_id: int) -> str:
+    #cursor for keyset pagination - the (date, id) of the last row sent
+    return f"{last_date.isoformat()}_{last_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        raw_date, raw_id = cursor.split("_", 1)
+        return date.fromisoformat(raw_date), int(raw_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def utcnow() -> datetime:
+    # naive UTC - DateTime columns are stored without a time zone on both databases
+    return datetime.now(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1 @@
+# benchmarks - run the modules with python -m benchmarks.<name> from the repository root
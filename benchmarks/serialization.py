@@ -0,0 +1,71 @@
+# serialization.py
+# CPU cost of turning one page of expenses into a response body: the old path
+# (full entities -> dicts -> jsonable_encoder -> json.dumps) against the lean one
+# (projected tuples -> ExpenseRow -> FastJSONResponse). No server, no network.
+#
+#   python -m benchmarks.serialization --rows 1000 --repeat 200
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.datagen import seed
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "min_ms": round(min(samples), 3)}
+
+
+def run(rows, repeat):
+    database = os.path.join(tempfile.mkdtemp(), "serialization.db")
+    seed("sqlite:///" + database, users=1, expenses_per_user=rows)
+    from fastapi.encoders import jsonable_encoder
+    from DataBase.database import SessionLocal
+    from DataBase.DBmodels import Expense
+    from dto import ExpenseRow, FastJSONResponse
+    from categories import DEFAULT_CATEGORIES
+
+    db = SessionLocal()
+    try:
+        def entities():
+            expenses = db.query(Expense).filter(Expense.user_id == 1).all()
+            db.expunge_all()  # a fresh identity map per response, like a new request
+            payload = {"expenses": expenses}
+            return json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode()
+
+        def projected():
+            expenses = db.query(*ExpenseRow.COLUMNS).filter(Expense.user_id == 1).all()
+            return FastJSONResponse({"expenses": ExpenseRow.from_rows(expenses, DEFAULT_CATEGORIES)}).body
+
+        # query and serialization apart: the rows are fetched once
+        loaded = db.query(*ExpenseRow.COLUMNS).filter(Expense.user_id == 1).all()
+        as_dicts = [dict(row._mapping) for row in loaded]
+        result = {
+            "rows": rows,
+            "entities_end_to_end": timed(entities, repeat),
+            "projected_end_to_end": timed(projected, repeat),
+            "jsonable_encoder_only": timed(lambda: json.dumps(jsonable_encoder({"expenses": as_dicts})), repeat),
+            "fast_json_only": timed(lambda: FastJSONResponse({"expenses": ExpenseRow.from_rows(loaded, DEFAULT_CATEGORIES)}), repeat),
+        }
+    finally:
+        db.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response serialization paths")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# server.py
+# Runs the API under uvicorn in a subprocess for the benchmarks.
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.datagen import ROOT, APP_DIR, DB_DIR
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url, port, env=None, workers=1):
+    server_env = dict(os.environ)
+    server_env.update({
+        "DATABASE_URL": database_url,
+        "PYTHONPATH": os.pathsep.join([ROOT, APP_DIR, DB_DIR]),
+        # keep the outbox sender away from the real mail server
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": "1",
+    })
+    server_env.update(env or {})
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=APP_DIR, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
@@ -0,0 +1,301 @@
+# suite.py
+# Latency / throughput of every route in app/routes.py and app/recovery.py.
+# Seeds a database (benchmarks/datagen.py), starts uvicorn, sends `--requests`
+# requests per endpoint from `--clients` concurrent clients and prints JSON with
+# requests/sec and p50/p95/p99 per endpoint. The routes that run bcrypt get
+# `--password-requests` requests instead, they are two orders of magnitude slower.
+#
+#   python -m benchmarks.suite --users 1000 --expenses-per-user 200 --out results.json
+#   python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.suite --baseline benchmarks/baseline.json   # exit code 1 on regressions
+#
+# Endpoints run one after another: reads first, then writes, then deletes, so
+# every endpoint is measured against the seeded data. Deletes use users and
+# expenses set aside for them; the reads use the remaining users.
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+import httpx
+
+from benchmarks.datagen import seed, username, email, BENCH_PASSWORD, CATEGORIES
+from benchmarks.server import free_port, start_server, stop_server
+
+# a latency change smaller than this is noise, whatever the percentage
+MIN_DELTA_MS = 2.0
+
+
+class Plan:
+    #which users / expense ids each kind of request may touch
+    def __init__(self, users, expenses_per_user, requests, password_requests):
+        self.expenses_per_user = expenses_per_user
+        delete_expense_users = math.ceil(requests / max(expenses_per_user, 1))
+        self.active_users = users - password_requests - delete_expense_users
+        if self.active_users < 2:
+            raise SystemExit(
+                f"--users must be above {password_requests + delete_expense_users + 1} for these request counts"
+            )
+        first_reserved = self.active_users * expenses_per_user
+        self.expenses_to_delete = itertools.count(first_reserved + 1)
+        self.users_to_delete = itertools.count(users - password_requests + 1)
+        self.new_users = itertools.count(1)
+        self.today = date.today()
+
+    def user(self):
+        return random.randint(1, self.active_users)
+
+    def expense_id(self):
+        return random.randint(1, self.active_users * self.expenses_per_user)
+
+    def expense(self, user_id):
+        return {"date": str(self.today), "category": random.choice(CATEGORIES),
+                "description": "bench", "amount": round(random.uniform(1, 300), 2), "user_id": user_id}
+
+
+# name -> (request builder, expected status codes, uses bcrypt)
+def endpoints(plan):
+    def user_path(template):
+        return lambda: ("GET", template.format(username=username(plan.user())), {})
+
+    def with_user(method, path, **kwargs):
+        return lambda: (method, path, {key: value(plan.user()) for key, value in kwargs.items()})
+
+    def delete_user():
+        user_id = next(plan.users_to_delete)
+        return "DELETE", "/users/", {"json": {"username": username(user_id), "email": email(user_id), "password": BENCH_PASSWORD}}
+
+    def create_user():
+        number = next(plan.new_users)
+        return "POST", "/users/", {"json": {"username": f"new{number}", "fullname": "New User",
+                                            "email": f"new{number}@test.com", "password": BENCH_PASSWORD}}
+
+    def update_profile():
+        user_id = plan.user()
+        return "PUT", f"/users/update-profile/{user_id}", {
+            "params": {"fullname": "Bench User", "username": username(user_id), "email": email(user_id)}
+        }
+
+    return {
+        # reads
+        "GET /expenses/": with_user("GET", "/expenses/", params=lambda u: {"username": username(u), "limit": 50}),
+        "GET /expenses/ (filtered)": with_user("GET", "/expenses/", params=lambda u: {
+            "username": username(u), "category": "food", "min_amount": 50, "start_date": "2000-01-01"
+        }),
+        "GET /expenses/search": with_user("GET", "/expenses/search", params=lambda u: {"username": username(u), "q": "coff"}),
+        "GET /expenses/autocomplete": with_user("GET", "/expenses/autocomplete", params=lambda u: {
+            "username": username(u), "prefix": "c"
+        }),
+        "GET /expenses/insights": with_user("GET", "/expenses/insights", params=lambda u: {"username": username(u)}),
+        "GET /expenses/insights (check)": with_user("GET", "/expenses/insights", params=lambda u: {
+            "username": username(u), "category": random.choice(CATEGORIES), "amount": round(random.uniform(1, 400), 2)
+        }),
+        "GET /expenses/export": with_user("GET", "/expenses/export", params=lambda u: {"username": username(u), "format": "csv"}),
+        "GET /expenses/timeseries": with_user("GET", "/expenses/timeseries", params=lambda u: {
+            "username": username(u), "granularity": "month", "periods": 12, "budget": True
+        }),
+        "GET /expenses/timeseries (week)": with_user("GET", "/expenses/timeseries", params=lambda u: {
+            "username": username(u), "granularity": "week", "periods": 26, "by_category": True
+        }),
+        "GET /expenses/total_by_category/": with_user("GET", "/expenses/total_by_category/", params=lambda u: {
+            "category": "food", "user_id": u
+        }),
+        "GET /expenses/recent/{username}": user_path("/expenses/recent/{username}"),
+        "GET /expenses/period/{period}": with_user("GET", "/expenses/period/last6Months", params=lambda u: {"username": username(u)}),
+        "GET /expenses/period_detailed2/{period}": with_user("GET", "/expenses/period_detailed2/currentMonth", params=lambda u: {
+            "username": username(u)
+        }),
+        "GET /expenses/monthly/{username}": user_path("/expenses/monthly/{username}"),
+        "GET /dashboard/{username}": user_path("/dashboard/{username}"),
+        "GET /budgets/{year}/status": with_user("GET", f"/budgets/{plan.today.year}/status", params=lambda u: {"user_id": u}),
+        "GET /budget/status/": with_user("GET", "/budget/status/", params=lambda u: {
+            "year": plan.today.year, "month": plan.today.month, "user_id": u
+        }),
+        "POST /logout/": (lambda: ("POST", "/logout/", {}), {200}, False),
+        # writes
+        "POST /expenses/": with_user("POST", "/expenses/", json=plan.expense),
+        "POST /expenses/bulk": with_user("POST", "/expenses/bulk", json=lambda u: {"expenses": [plan.expense(u) for _ in range(100)]}),
+        "PUT /expenses/{expense_id}": lambda: ("PUT", f"/expenses/{plan.expense_id()}", {"json": plan.expense(1)}),
+        "POST /budgets/": with_user("POST", "/budgets/", json=lambda u: {
+            "year": plan.today.year, "month": plan.today.month, "budget": 2000.0, "user_id": u
+        }),
+        "PUT /budgets/{year}": with_user("PUT", f"/budgets/{plan.today.year}", json=lambda u: {
+            "budgets": [float(random.randint(1000, 5000)) for _ in range(12)], "user_id": u
+        }),
+        "PUT /users/update-profile/{user_id}": update_profile,
+        "POST /users/forgot-password": with_user("POST", "/users/forgot-password", json=email),
+        # a wrong code - measures the lookup and attempt counting
+        "POST /users/reset-password": (with_user("POST", "/users/reset-password", json=lambda u: {
+            "email": email(u), "recovery_code": "000000", "new_password": "Newpass123", "confirm_password": "Newpass123"
+        }), {400}, False),
+        "POST /login/": (with_user("POST", "/login/", json=lambda u: {"username": username(u), "password": BENCH_PASSWORD}), {200}, True),
+        "PUT /users/update-password/{user_id}": (lambda: (
+            "PUT", f"/users/update-password/{plan.user()}",
+            {"json": {"old_password": BENCH_PASSWORD, "new_password": BENCH_PASSWORD, "confirm_password": BENCH_PASSWORD}}
+        ), {200}, True),
+        "POST /users/": (create_user, {200}, True),
+        # deletes
+        "DELETE /expenses/{expense_id}": lambda: ("DELETE", f"/expenses/{next(plan.expenses_to_delete)}", {}),
+        "DELETE /users/": (delete_user, {200}, True),
+    }
+
+
+def normalize(spec):
+    #a bare builder expects 200 and does not use bcrypt
+    if isinstance(spec, tuple):
+        return spec
+    return spec, {200}, False
+
+
+def percentile(sorted_values, q):
+    #nearest rank
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "requests_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+async def run_endpoint(client, build, expected, requests, clients):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, path, kwargs = build()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                await response.aread()
+                if response.status_code not in expected:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run_suite(base_url, plan, requests, password_requests, clients, only=None):
+    results = {}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        for name, spec in endpoints(plan).items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            build, expected, uses_bcrypt = normalize(spec)
+            count = password_requests if uses_bcrypt else requests
+            results[name] = await run_endpoint(client, build, expected, count, min(clients, count))
+            print(f"{name}: {results[name]['requests_per_sec']} req/s, p95 {results[name]['p95_ms']} ms",
+                  file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    #an endpoint regressed when p95 grew or throughput dropped by more than `tolerance`
+    report = {}
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            report[name] = {"status": "new"}
+            continue
+        reasons = []
+        if current["p95_ms"] - base["p95_ms"] > max(base["p95_ms"] * tolerance, MIN_DELTA_MS):
+            reasons.append(f"p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+        if current["requests_per_sec"] < base["requests_per_sec"] * (1 - tolerance):
+            reasons.append(f"throughput {base['requests_per_sec']} -> {current['requests_per_sec']} req/s")
+        if current["errors"] > base["errors"]:
+            reasons.append(f"errors {base['errors']} -> {current['errors']}")
+        report[name] = {
+            "status": "regression" if reasons else "ok",
+            "reasons": reasons,
+            "p95_change_pct": round((current["p95_ms"] / base["p95_ms"] - 1) * 100, 1) if base["p95_ms"] else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-endpoint load and latency benchmark")
+    parser.add_argument("--database-url", default=None, help="default: a temporary SQLite file")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--expenses-per-user", type=int, default=200)
+    parser.add_argument("--budget-months", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--password-requests", type=int, default=40, help="requests per bcrypt endpoint")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--db-mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--only", nargs="*", help="only endpoints whose name contains one of these")
+    parser.add_argument("--out", help="write the JSON report to this file")
+    parser.add_argument("--save-baseline", help="store the per-endpoint results as a baseline")
+    parser.add_argument("--baseline", help="compare against a stored baseline, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 / throughput change (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    random.seed(1)
+    plan = Plan(args.users, args.expenses_per_user, args.requests, args.password_requests)
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    dataset = seed(database_url, args.users, args.expenses_per_user, args.budget_months)
+    print(f"seeded {dataset}", file=sys.stderr)
+
+    port = free_port()
+    server = start_server(database_url, port, env={"DB_MODE": args.db_mode}, workers=args.workers)
+    try:
+        results = asyncio.run(run_suite(
+            f"http://127.0.0.1:{port}", plan, args.requests, args.password_requests, args.clients, args.only
+        ))
+    finally:
+        stop_server(server)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "save_baseline", "baseline")},
+        "dataset": dataset,
+        "endpoints": results,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["endpoints"]
+        report["comparison"] = compare(results, baseline, args.tolerance)
+        regressions = [name for name, entry in report["comparison"].items() if entry["status"] == "regression"]
+        report["regressions"] = regressions
+        exit_code = 1 if regressions else 0
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": report["config"], "endpoints": results}, f, indent=2)
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    print(output)
+    raise SystemExit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
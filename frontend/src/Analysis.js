@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useContext } from "react";
 import {
     getAllExpenses,
+    getExportExpensesUrl,
     updateExpense,
     deleteExpense,
 } from "./Connectors/api";
@@ -42,24 +43,44 @@ const Analysis = () => {
     // Select period
     const [selectedPeriod, setSelectedPeriod] = useState(null);
 
-    // Fetch all expenses (on mount or user change)
+    // Server side paging
+    const [nextCursor, setNextCursor] = useState(null);
+    const [knownCategories, setKnownCategories] = useState([]);
+
+    const serverFilters = React.useMemo(() => ({
+        start_date: filterStartDate,
+        end_date: filterEndDate,
+        category: filterCategories,
+        min_amount: filterMinAmount,
+        max_amount: filterMaxAmount,
+    }), [filterStartDate, filterEndDate, filterCategories, filterMinAmount, filterMaxAmount]);
+
+    // Fetch the first page (newest first) - the server filters by user and the chosen filters
+    const fetchFirstPage = React.useCallback(async () => {
+        if (!user || !user.username) return;
+        try {
+            const response = await getAllExpenses(user.username, serverFilters);
+            setAllExpenses(response.expenses);
+            setNextCursor(response.next_cursor);
+        } catch (err) {
+            console.error("Failed to fetch all expenses:", err);
+        }
+    }, [user, serverFilters]);
+
     useEffect(() => {
-        const fetchAll = async () => {
-            if (!user || !user.username) return;
-            try {
-                const response = await getAllExpenses();
-                let expenses = response.expenses;
-                // filter
-                expenses = expenses.filter((exp) => exp.user_id === user.id);
-                // sort
-                expenses.sort((a, b) => new Date(b.date) - new Date(a.date));
-                setAllExpenses(expenses);
-            } catch (err) {
-                console.error("Failed to fetch all expenses:", err);
-            }
-        };
-        fetchAll();
-    }, [user]);
+        fetchFirstPage();
+    }, [fetchFirstPage]);
+
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        try {
+            const response = await getAllExpenses(user.username, serverFilters, nextCursor);
+            setAllExpenses((prev) => [...prev, ...response.expenses]);
+            setNextCursor(response.next_cursor);
+        } catch (err) {
+            console.error("Failed to fetch more expenses:", err);
+        }
+    };
 
     // sort
     const handleSort = (key) => {
@@ -92,35 +113,15 @@ const Analysis = () => {
         return sortableItems;
     }, [allExpenses, sortConfig]);
 
-    const uniqueCategories = React.useMemo(() => {
-        return [...new Set(allExpenses.map((exp) => exp.category))];
+    // keep categories seen so far, so a category filter does not hide the other checkboxes
+    useEffect(() => {
+        setKnownCategories((prev) => [...new Set([...prev, ...allExpenses.map((exp) => exp.category)])]);
     }, [allExpenses]);
 
-    // סינון
-    const filteredExpenses = React.useMemo(() => {
-        return sortedExpenses.filter((exp) => {
-            const expDate = new Date(exp.date);
+    const uniqueCategories = knownCategories;
 
-            if (filterStartDate && expDate < new Date(filterStartDate)) return false;
-            if (filterEndDate && expDate > new Date(filterEndDate)) return false;
-
-            if (filterCategories.length > 0 && !filterCategories.includes(exp.category)) {
-                return false;
-            }
-
-            if (filterMinAmount !== "" && exp.amount < parseFloat(filterMinAmount)) return false;
-            if (filterMaxAmount !== "" && exp.amount > parseFloat(filterMaxAmount)) return false;
-
-            return true;
-        });
-    }, [
-        sortedExpenses,
-        filterStartDate,
-        filterEndDate,
-        filterCategories,
-        filterMinAmount,
-        filterMaxAmount,
-    ]);
+    // the filters are applied by the server
+    const filteredExpenses = sortedExpenses;
 
     const applyFilter = () => {
         setFilterStartDate(tempStartDate);
@@ -183,10 +184,7 @@ const Analysis = () => {
             };
             await updateExpense(selectedExpense.id, updatedData);
 
-            const response = await getAllExpenses();
-            let expenses = response.expenses.filter((exp) => exp.user_id === user.id);
-            expenses.sort((a, b) => new Date(b.date) - new Date(a.date));
-            setAllExpenses(expenses);
+            await fetchFirstPage();
 
             setSelectedExpense(null);
         } catch (err) {
@@ -204,10 +202,7 @@ const Analysis = () => {
         try {
             await deleteExpense(selectedExpense.id);
 
-            const response = await getAllExpenses();
-            let expenses = response.expenses.filter((exp) => exp.user_id === user.id);
-            expenses.sort((a, b) => new Date(b.date) - new Date(a.date));
-            setAllExpenses(expenses);
+            await fetchFirstPage();
 
             setSelectedExpense(null);
         } catch (err) {
@@ -270,7 +265,17 @@ const Analysis = () => {
                     <div className="w-2/3 bg-white p-6 rounded shadow mr-4"
                          style={{ maxHeight: "1000px" }}
                     >
-                        <h2 className="text-lg font-bold mb-4">All Expenses</h2>
+                        <div className="flex justify-between items-center mb-4">
+                            <h2 className="text-lg font-bold">All Expenses</h2>
+                            {user && user.username && (
+                                <a
+                                    href={getExportExpensesUrl(user.username)}
+                                    className="text-blue-500 hover:underline"
+                                >
+                                    Export CSV
+                                </a>
+                            )}
+                        </div>
                         <div className="overflow-y-auto" style={{ maxHeight: "500px" }}>
                             <table className="min-w-full divide-y divide-gray-200">
                                 <thead className="sticky top-0 bg-white z-10">
@@ -337,6 +342,14 @@ const Analysis = () => {
                                 </tbody>
                             </table>
                         </div>
+                        {nextCursor && (
+                            <button
+                                onClick={loadMore}
+                                className="mt-4 bg-blue-500 text-white px-4 py-2 rounded hover:bg-blue-600"
+                            >
+                                Load more
+                            </button>
+                        )}
                     </div>
 
                     {/* Filter Panel */}
@@ -138,6 +138,26 @@ export async function getExpensesByPeriod(period, username) {
 }
 
 
+/**
+ * Recent expenses, this month's breakdown, the 6-month chart and the budget status in one request
+ * @param {string} username
+ * @param {string[]} [fields] subset of "recent", "monthly", "last_6_months", "budget_status"
+ * @returns {Object} { recent, monthly, last_6_months, budget_status }
+ */
+export const getDashboard = async (username, fields = []) => {
+    const params = new URLSearchParams();
+    if (fields.length) {
+        params.append("fields", fields.join(","));
+    }
+    const response = await fetch(`${API_BASE_URL}/dashboard/${username}?${params.toString()}`);
+    if (!response.ok) {
+        throw new Error("Failed to fetch dashboard");
+    }
+    return await response.json();
+};
+
+
+
 export const getMonthlyExpenses = async (username) => {
     const response = await fetch(`http://localhost:8000/expenses/monthly/${username}`, {
         method: "GET",
@@ -153,8 +173,27 @@ export const getMonthlyExpenses = async (username) => {
 
 
 
-export const getAllExpenses = async () => {
-    const response = await fetch(`${API_BASE_URL}/expenses/`);
+/**
+ * One page of the user's expenses, newest first
+ * @param {string} username
+ * @param {Object} [filters] { start_date, end_date, category: [], min_amount, max_amount, limit }
+ * @param {string} [cursor] next_cursor from the previous page
+ * @returns {Object} { expenses, next_cursor }
+ */
+export const getAllExpenses = async (username, filters = {}, cursor = null) => {
+    const params = new URLSearchParams({ username });
+    Object.entries(filters).forEach(([key, value]) => {
+        if (value === "" || value === null || value === undefined) return;
+        if (Array.isArray(value)) {
+            value.forEach((v) => params.append(key, v));
+        } else {
+            params.append(key, value);
+        }
+    });
+    if (cursor) {
+        params.append("cursor", cursor);
+    }
+    const response = await fetch(`${API_BASE_URL}/expenses/?${params.toString()}`);
     if (!response.ok) {
         throw new Error("Failed to fetch expenses");
     }
@@ -164,6 +203,19 @@ export const getAllExpenses = async () => {
 
 
 
+/**
+ * Download link for the user's full history (streamed by the server)
+ * @param {string} username
+ * @param {string} format - "csv" or "ndjson"
+ * @returns {string} url
+ */
+export const getExportExpensesUrl = (username, format = "csv") => {
+    const params = new URLSearchParams({ username, format });
+    return `${API_BASE_URL}/expenses/export?${params.toString()}`;
+};
+
+
+
 export async function updateExpense(expenseId, updatedData) {
     const response = await fetch(`${API_BASE_URL}/expenses/${expenseId}`, {
         method: "PUT",
@@ -1,7 +1,7 @@
 import React, { useState, useEffect, useContext } from "react";
 import { useNavigate } from "react-router-dom";
 import { UserContext } from "./UserContext";
-import { getRecentExpenses, addExpense, getMonthlyExpenses, getExpensesByPeriod } from "./Connectors/api";
+import { addExpense, getDashboard } from "./Connectors/api";
 import "chart.js/auto";
 import { Pie, Bar } from "react-chartjs-2";
 import ExternalAPI from "./Connectors/ExternalAPI";
@@ -61,73 +61,52 @@ function Home() {
         setIsUserLoaded(true);
     }, [navigate, setUser]);
 
+    // recent expenses, pie chart and bar chart all come from one /dashboard request
+    const applyDashboard = (dashboard) => {
+        setRecentExpenses(dashboard.recent);
+        setMonthlyExpenses(dashboard.monthly.total);
+        setExpenseBreakdown(dashboard.monthly.breakdown);
+
+        const expensesByPeriod = dashboard.last_6_months;
+        const months = expensesByPeriod.map((item) => item.month || "Unknown");
+        const spentData = expensesByPeriod.map((item) => item.spent || 0);
+        const budgetData = expensesByPeriod.map((item) => item.budget || 0);
+        setBarChartData({
+            labels: months,
+            datasets: [
+                {
+                    label: "Spent",
+                    data: spentData,
+                    backgroundColor: "#FF6384",
+                },
+                {
+                    label: "Budget",
+                    data: budgetData,
+                    backgroundColor: "#36A2EB",
+                },
+            ],
+        });
+    };
+
     useEffect(() => {
-        const fetchExpenses = async () => {
+        const fetchDashboard = async () => {
             if (!user || !user.username) {
                 setError("User is not logged in.");
                 return;
             }
             try {
-                const expenses = await getRecentExpenses(user.username);
-                setRecentExpenses(expenses);
+                const dashboard = await getDashboard(user.username, ["recent", "monthly", "last_6_months"]);
+                applyDashboard(dashboard);
             } catch (err) {
                 setError(err.message || "Failed to fetch expenses.");
             }
         };
 
         if (isUserLoaded) {
-            fetchExpenses();
+            fetchDashboard();
         }
     }, [user, isUserLoaded]);
 
-    useEffect(() => {
-        const fetchMonthlyData = async () => {
-            if (!user || !user.username) return;
-            try {
-                const expenses = await getMonthlyExpenses(user.username);
-                setMonthlyExpenses(expenses.total);
-                setExpenseBreakdown(expenses.breakdown);
-            } catch (error) {
-                console.error("Failed to fetch monthly expenses", error);
-            }
-        };
-
-        fetchMonthlyData();
-    }, [user]);
-
-    useEffect(() => {
-        const fetchBarChartData = async () => {
-            if (!user || !user.username) return;
-            try {
-                const period = "last6Months";
-                const expensesByPeriod = await getExpensesByPeriod(period, user.username);
-                const months = expensesByPeriod.map((item) => item.month || "Unknown");
-                const spentData = expensesByPeriod.map((item) => item.spent || 0);
-                const budgetData = expensesByPeriod.map((item) => item.budget || 0);
-
-                setBarChartData({
-                    labels: months,
-                    datasets: [
-                        {
-                            label: "Spent",
-                            data: spentData,
-                            backgroundColor: "#FF6384",
-                        },
-                        {
-                            label: "Budget",
-                            data: budgetData,
-                            backgroundColor: "#36A2EB",
-                        },
-                    ],
-                });
-            } catch (error) {
-                console.error("Error fetching bar chart data:", error);
-            }
-        };
-
-        fetchBarChartData();
-    }, [user]);
-
   <input
         type="number"
         min="0" // מאפשר רק ערכים 0 ומעלה
@@ -177,36 +156,9 @@ function Home() {
                 amount: "",
             });
 
-            // Update recent expenses
-            const recent = await getRecentExpenses(user.username);
-            setRecentExpenses(recent);
-
-            // Updating monthly budget data (to display Pie Chart)
-            const monthlyData = await getMonthlyExpenses(user.username);
-            setMonthlyExpenses(monthlyData.total);
-            setExpenseBreakdown(monthlyData.breakdown);
-
-            // Updating graph data (e.g., expenses in the last 6 months)
-            const period = "last6Months";
-            const expensesPeriod = await getExpensesByPeriod(period, user.username);
-            const months = expensesPeriod.map((item) => item.month || "Unknown");
-            const spentData = expensesPeriod.map((item) => item.spent || 0);
-            const budgetData = expensesPeriod.map((item) => item.budget || 0);
-            setBarChartData({
-                labels: months,
-                datasets: [
-                    {
-                        label: "Spent",
-                        data: spentData,
-                        backgroundColor: "#FF6384",
-                    },
-                    {
-                        label: "Budget",
-                        data: budgetData,
-                        backgroundColor: "#36A2EB",
-                    },
-                ],
-            });
+            // Update recent expenses, the pie chart and the last 6 months graph
+            const dashboard = await getDashboard(user.username, ["recent", "monthly", "last_6_months"]);
+            applyDashboard(dashboard);
         } catch (error) {
             setError(error.message || "Failed to add expense.");
         }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, LargeBinary, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 
@@ -8,7 +8,7 @@ Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = {"extend_existing": True, "sqlite_autoincrement": True}
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False)
     fullname = Column(String(100), nullable=False)
@@ -17,24 +17,92 @@ class User(Base):
 
     expenses = relationship("Expense", back_populates="user", cascade="all, delete, delete-orphan")
     budgets = relationship("MonthlyBudget", back_populates="user", cascade="all, delete, delete-orphan")
+    monthly_totals = relationship("ExpenseMonthlyTotal", back_populates="user", cascade="all, delete, delete-orphan")
+    category_sketches = relationship("ExpenseCategorySketch", back_populates="user", cascade="all, delete, delete-orphan")
+    categories = relationship("Category", back_populates="user", cascade="all, delete, delete-orphan")
+
+class Category(Base):
+    __tablename__ = "categories"
+    __table_args__ = (
+        UniqueConstraint("user_id", "name", name="uq_categories_user_name"),
+        {"extend_existing": True, "sqlite_autoincrement": True},
+    )
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    user = relationship("User", back_populates="categories")
 
 class Expense(Base):
     __tablename__ = "expenses"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("ix_expenses_user_date_amount", "user_id", "date", "category_id", "amount"),
+        Index("ix_expenses_user_category_date", "user_id", "category_id", "date"),
+        {"extend_existing": True},
+    )
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, nullable=False)
-    category = Column(String(50), nullable=False)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=False)
     description = Column(String(255))
     amount = Column(Float, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", back_populates="expenses")
+    category = relationship("Category")
 
 class MonthlyBudget(Base):
     __tablename__ = "monthly_budgets"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        Index("uq_monthly_budgets_user_month", "user_id", "year", "month", unique=True),
+        {"extend_existing": True},
+    )
     id = Column(Integer, primary_key=True, index=True)
     year = Column(Integer, nullable=False)
     month = Column(Integer, nullable=False)
     budget = Column(Float, nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", back_populates="budgets")
+
+class ExpenseMonthlyTotal(Base):
+    __tablename__ = "expense_monthly_totals"
+    __table_args__ = {"extend_existing": True}
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    category_id = Column(Integer, primary_key=True)
+    total = Column(Float, nullable=False, default=0)
+    expense_count = Column(Integer, nullable=False, default=0)
+    user = relationship("User", back_populates="monthly_totals")
+
+class ExpenseCategorySketch(Base):
+    __tablename__ = "expense_category_sketches"
+    __table_args__ = {"extend_existing": True}
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    category_id = Column(Integer, primary_key=True)
+    expense_count = Column(Integer, nullable=False, default=0)
+    sketch = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    user = relationship("User", back_populates="category_sketches")
+
+class RecoveryCode(Base):
+    __tablename__ = "recovery_codes"
+    __table_args__ = {"extend_existing": True}
+    email = Column(String(255), primary_key=True)
+    code_hash = Column(String(64), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index("ix_email_outbox_status_next", "status", "next_attempt_at"),
+        {"extend_existing": True},
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+    last_error = Column(String(500))
@@ -9,6 +9,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Set the DATABASE_URL environment variable so that the app uses the test database
 os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+os.environ["RECOVERY_CODE_SECRET"] = "test-recovery-secret"
 
 # Import the test database settings (engine, TestingSessionLocal, Base)
 from DB_TEST import engine, TestingSessionLocal, Base
@@ -27,6 +28,11 @@ def override_get_db():
 
 # Import the FastAPI application and apply the dependency override
 from app.main import app
+from user_cache import user_id_cache
+from response_cache import response_cache
+from categories import category_cache
+from autocomplete import autocomplete_index
+from analytics import column_cache
 app.dependency_overrides[get_db] = override_get_db
 
 # Initialize the TestClient
@@ -37,6 +43,11 @@ client = TestClient(app)
 def reset_db():
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    user_id_cache.clear()
+    response_cache.clear()
+    category_cache.clear()
+    autocomplete_index.clear()
+    column_cache.clear()
     yield
 
 # Fixture to create a default user with valid values (to prevent NOT NULL/UNIQUE issues)
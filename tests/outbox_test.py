@@ -0,0 +1,204 @@
+import os
+import socketserver
+import sys
+import threading
+from datetime import timedelta
+import pytest
+
+# Add the project root directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Set the DATABASE_URL environment variable so that the app uses the test database
+os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+
+from DB_TEST import engine, TestingSessionLocal
+from tests.DBMODELS_TEST import Base, EmailOutbox
+from mailer import OutboxSender, SmtpSession, enqueue_email, SENT, PENDING, FAILED
+from utiles import utcnow
+
+
+# a local stand-in for the mail server - speaks just enough SMTP for smtplib
+class StandInSmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 stand-in ESMTP")
+        in_data, lines, recipients = False, [], []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if in_data:
+                if line.rstrip(b"\r\n") == b".":
+                    server.messages.append((recipients, b"".join(lines).decode()))
+                    in_data, lines, recipients = False, [], []
+                    self.reply("250 queued")
+                else:
+                    lines.append(line)
+                continue
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 stand-in")
+            elif verb == "MAIL":
+                if server.fail_next:
+                    server.fail_next -= 1
+                    self.reply("451 try again later")
+                else:
+                    self.reply("250 ok")
+            elif verb == "RCPT":
+                if "rejected" in command:
+                    self.reply("550 no such user")
+                else:
+                    recipients.append(command.split(":", 1)[1].strip(" <>"))
+                    self.reply("250 ok")
+            elif verb == "DATA":
+                in_data = True
+                self.reply("354 end with .")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 ok")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class StandInSmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInSmtpHandler)
+        self.connections = 0
+        self.messages = []
+        self.fail_next = 0
+
+
+@pytest.fixture
+def smtp_server():
+    server = StandInSmtpServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sender(smtp_server):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    smtp = SmtpSession(host="127.0.0.1", port=smtp_server.server_address[1], username="",
+                       starttls=False, from_email="noreply@test.com", timeout=5)
+    sender = OutboxSender(session_factory=TestingSessionLocal, smtp=smtp, batch_size=10, retry_base=30)
+    yield sender
+    smtp.close()
+
+
+def enqueue(*recipients):
+    db = TestingSessionLocal()
+    for recipient in recipients:
+        enqueue_email(db, recipient, "Subject", f"Hello {recipient}")
+    db.commit()
+    db.close()
+
+
+def outbox_rows():
+    db = TestingSessionLocal()
+    try:
+        return {row.recipient: row for row in db.query(EmailOutbox).all()}
+    finally:
+        db.close()
+
+
+def test_batch_is_sent_over_one_reused_session(sender, smtp_server):
+    enqueue("a@test.com", "b@test.com", "c@test.com")
+    assert sender.drain_once() == 3
+    enqueue("d@test.com")
+    assert sender.drain_once() == 1
+    assert sender.drain_once() == 0
+
+    assert smtp_server.connections == 1
+    assert [recipients for recipients, _ in smtp_server.messages] == [
+        ["a@test.com"], ["b@test.com"], ["c@test.com"], ["d@test.com"]
+    ]
+    assert "Hello a@test.com" in smtp_server.messages[0][1]
+    assert {row.status for row in outbox_rows().values()} == {SENT}
+
+
+def test_temporary_failure_is_retried_with_backoff(sender, smtp_server):
+    smtp_server.fail_next = 1
+    enqueue("a@test.com")
+    started = utcnow()
+    sender.drain_once()
+    row = outbox_rows()["a@test.com"]
+    assert row.status == PENDING and row.attempts == 1
+    assert row.next_attempt_at >= started + timedelta(seconds=29)
+    assert "451" in row.last_error
+
+    # not due yet
+    assert sender.drain_once() == 0
+    db = TestingSessionLocal()
+    db.query(EmailOutbox).update({"next_attempt_at": utcnow() - timedelta(seconds=1)})
+    db.commit()
+    db.close()
+    assert sender.drain_once() == 1
+    assert outbox_rows()["a@test.com"].status == SENT
+    assert sender.backoff(2) == 60 and sender.backoff(20) == sender.retry_max
+
+
+def test_rejected_recipient_fails_without_retry(sender, smtp_server):
+    enqueue("rejected@test.com", "ok@test.com")
+    sender.drain_once()
+    rows = outbox_rows()
+    assert rows["rejected@test.com"].status == FAILED
+    assert rows["ok@test.com"].status == SENT
+    assert smtp_server.connections == 1
+
+
+def test_unreachable_server_keeps_mail_pending(sender, smtp_server):
+    enqueue("a@test.com")
+    smtp_server.shutdown()
+    smtp_server.server_close()
+    sender.drain_once()
+    row = outbox_rows()["a@test.com"]
+    assert row.status == PENDING and row.attempts == 1
+    assert row.last_error
+
+
+def test_delivered_mail_does_not_keep_the_code(sender, smtp_server):
+    db = TestingSessionLocal()
+    for recipient in ("ok@test.com", "rejected@test.com"):
+        enqueue_email(db, recipient, "Password Recovery Code", "Your password recovery code is: 654321.")
+    db.commit()
+    db.close()
+    sender.drain_once()
+    rows = outbox_rows()
+    assert rows["ok@test.com"].status == SENT and rows["rejected@test.com"].status == FAILED
+    assert "654321" in smtp_server.messages[0][1]
+    assert all("654321" not in row.body for row in rows.values())
+
+    assert sender.purge_sent() == 0
+    db = TestingSessionLocal()
+    old = utcnow() - timedelta(days=8)
+    db.query(EmailOutbox).update({"created_at": old, "sent_at": old})
+    db.query(EmailOutbox).filter(EmailOutbox.status == FAILED).update({"sent_at": None})
+    db.commit()
+    db.close()
+    assert sender.purge_sent() == 2
+    assert outbox_rows() == {}
+
+
+def test_expired_claim_is_taken_over(sender, smtp_server):
+    enqueue("a@test.com")
+    db = TestingSessionLocal()
+    # a worker claimed it and died before sending
+    db.query(EmailOutbox).update({"status": "sending", "next_attempt_at": utcnow() - timedelta(seconds=1)})
+    db.commit()
+    db.close()
+    assert sender.drain_once() == 1
+    assert outbox_rows()["a@test.com"].status == SENT
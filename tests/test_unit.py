@@ -2,7 +2,7 @@ import os
 import sys
 import pytest
 from fastapi.testclient import TestClient
-from datetime import date
+from datetime import date, timedelta
 from unittest.mock import patch
 
 # Add the project root directory to sys.path
@@ -10,6 +10,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Set the DATABASE_URL environment variable so that the original code uses the test database
 os.environ["DATABASE_URL"] = "sqlite:///./test.db"
+os.environ["RECOVERY_CODE_SECRET"] = "test-recovery-secret"
 
 # Import definitions from DB_TEST.py (which contains engine, TestingSessionLocal, and Base)
 from DB_TEST import engine, TestingSessionLocal, Base
@@ -29,6 +30,11 @@ def override_get_db():
 
 # Import the FastAPI app and set dependency overrides
 from app.main import app
+from user_cache import user_id_cache
+from response_cache import response_cache
+from categories import category_cache
+from autocomplete import autocomplete_index
+from analytics import column_cache
 app.dependency_overrides[get_db] = override_get_db
 
 client = TestClient(app)
@@ -38,11 +44,16 @@ client = TestClient(app)
 def reset_db():
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    user_id_cache.clear()
+    response_cache.clear()
+    category_cache.clear()
+    autocomplete_index.clear()
+    column_cache.clear()
     yield
 
 # Fixture to create a default user with valid values (to avoid NOT NULL/UNIQUE issues)
 @pytest.fixture(autouse=True)
-def create_default_user():
+def create_default_user(reset_db):
     from tests.DBMODELS_TEST import User  # Import User model from DBMODELS_TEST.py
     db = TestingSessionLocal()
     try:
@@ -120,12 +131,61 @@ def test_get_all_expenses():
     }
     client.post("/expenses/", json=expense1)
     client.post("/expenses/", json=expense2)
-    response = client.get("/expenses/")
+    response = client.get("/expenses/", params={"username": "default_user"})
     assert response.status_code == 200
     data = response.json()
     assert "expenses" in data
     assert len(data["expenses"]) >= 2
 
+def test_get_all_expenses_user_not_found():
+    response = client.get("/expenses/", params={"username": "noexist"})
+    assert response.status_code == 404
+
+def test_get_all_expenses_keyset_pagination():
+    for day in range(1, 6):
+        client.post("/expenses/", json={
+            "date": f"2025-01-0{day}",
+            "category": "food",
+            "description": f"day {day}",
+            "amount": float(day),
+            "user_id": 1
+        })
+    seen = []
+    cursor = None
+    while True:
+        params = {"username": "default_user", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        data = client.get("/expenses/", params=params).json()
+        seen.extend(e["date"] for e in data["expenses"])
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+    assert seen == [f"2025-01-0{day}" for day in range(5, 0, -1)]
+
+def test_get_all_expenses_server_filters():
+    client.post("/expenses/", json={
+        "date": "2025-01-10", "category": "food", "description": "a", "amount": 10.0, "user_id": 1
+    })
+    client.post("/expenses/", json={
+        "date": "2025-01-20", "category": "transport", "description": "b", "amount": 50.0, "user_id": 1
+    })
+    response = client.get("/expenses/", params={
+        "username": "default_user",
+        "start_date": "2025-01-01",
+        "end_date": "2025-01-31",
+        "category": ["transport"],
+        "min_amount": 20
+    })
+    assert response.status_code == 200
+    data = response.json()
+    assert [e["description"] for e in data["expenses"]] == ["b"]
+    assert data["next_cursor"] is None
+
+def test_get_all_expenses_invalid_cursor():
+    response = client.get("/expenses/", params={"username": "default_user", "cursor": "garbage"})
+    assert response.status_code == 400
+
 def test_update_expense_not_found():
     payload = {
         "date": str(date.today()),
@@ -200,6 +260,477 @@ def test_get_total_by_category():
     assert data["category"] == "food"
     assert data["total_amount"] == 123.45
 
+def test_search_expenses_ranked_paged_and_in_sync():
+    from search import create_search_index
+    from DataBase.database import engine as app_engine
+    create_search_index(app_engine)
+    base = {"date": str(date.today()), "category": "food", "amount": 5.0, "user_id": 1}
+    ids = {}
+    for description in ["coffee", "coffee beans for the coffee machine", "lunch", "Iced coffee"]:
+        ids[description] = client.post("/expenses/", json={**base, "description": description}).json()["expense"]["id"]
+
+    data = client.get("/expenses/search", params={"username": "default_user", "q": "coff", "limit": 2}).json()
+    assert len(data["results"]) == 2 and data["next_offset"] == 2
+    # bm25: the short description that is only "coffee" is the best match
+    assert data["results"][0]["id"] == ids["coffee"]
+    assert data["results"][0]["score"] >= data["results"][1]["score"]
+    rest = client.get("/expenses/search", params={"username": "default_user", "q": "coff", "limit": 2, "offset": 2}).json()
+    assert len(rest["results"]) == 1 and rest["next_offset"] is None
+    assert rest["results"][0]["category"] == "food"
+
+    # updates and deletes reach the index
+    client.put(f"/expenses/{ids['lunch']}", json={**base, "description": "coffee and cake"})
+    client.delete(f"/expenses/{ids['coffee']}")
+    found = client.get("/expenses/search", params={"username": "default_user", "q": "coffee"}).json()["results"]
+    assert sorted(result["id"] for result in found) == sorted(
+        [ids["lunch"], ids["coffee beans for the coffee machine"], ids["Iced coffee"]])
+    assert client.get("/expenses/search", params={"username": "default_user", "q": "cake coffee"}).json()["results"][0]["id"] == ids["lunch"]
+    assert client.get("/expenses/search", params={"username": "default_user", "q": " ?! "}).status_code == 400
+
+def test_autocomplete_ranks_by_use_and_follows_writes():
+    base = {"date": str(date.today()), "amount": 5.0, "user_id": 1}
+    for description, category in [("Coffee", "food"), ("coffee", "food"), ("cinema", "entertainment"), ("cake", "Cats")]:
+        client.post("/expenses/", json={**base, "description": description, "category": category})
+
+    data = client.get("/expenses/autocomplete", params={"username": "default_user", "prefix": "C"}).json()
+    assert data["descriptions"][0] == {"text": "coffee", "count": 2}
+    assert [s["text"] for s in data["descriptions"]] == ["coffee", "cake", "cinema"]
+    assert data["categories"] == [{"text": "cats", "count": 1}]
+
+    # the loaded tries follow new and deleted expenses without a rebuild
+    added = client.post("/expenses/", json={**base, "description": "cinema", "category": "entertainment"}).json()
+    client.post("/expenses/bulk", json={"expenses": [{**base, "description": "cinema", "category": "entertainment"}]})
+    suggestions = client.get("/expenses/autocomplete", params={"username": "default_user", "prefix": "ci"}).json()
+    assert suggestions["descriptions"] == [{"text": "cinema", "count": 3}]
+    client.delete(f"/expenses/{added['expense']['id']}")
+    suggestions = client.get("/expenses/autocomplete", params={"username": "default_user", "prefix": "ci", "limit": 1}).json()
+    assert suggestions["descriptions"] == [{"text": "cinema", "count": 2}]
+    assert client.get("/expenses/autocomplete", params={"username": "nobody", "prefix": "c"}).status_code == 404
+
+def test_analytics_rolling_forecast_and_outliers():
+    def add(day, category, amount):
+        expense = {"date": day, "category": category, "description": "x", "amount": amount, "user_id": 1}
+        return client.post("/expenses/", json=expense).json()["expense"]["id"]
+    add("2026-02-28", "food", 100)
+    add("2026-03-01", "food", 10)
+    add("2026-03-05", "transport", 5)
+    last = add("2026-03-10", "food", 20)
+
+    rolling = client.get("/analytics/rolling", params={"username": "default_user", "days": 3, "end_date": "2026-03-10"}).json()
+    assert [day["date"] for day in rolling["series"]] == ["2026-03-08", "2026-03-09", "2026-03-10"]
+    assert rolling["series"][-1] == {"date": "2026-03-10", "spent": 20.0, "spent_7d": 25.0, "spent_30d": 135.0}
+
+    forecast = client.get("/analytics/forecast", params={"username": "default_user", "today": "2026-03-10"}).json()
+    assert (forecast["days_elapsed"], forecast["days_in_month"], forecast["spent"], forecast["forecast"]) == (10, 31, 35.0, 108.5)
+    assert forecast["categories"][0] == {"category": "food", "spent": 30.0, "daily_pace": 3.0, "forecast": 93.0}
+
+    # new expenses go into the cached columns - no second read
+    with patch("analytics.read_columns", side_effect=AssertionError("columns read again")):
+        add("2026-03-09", "food", 1)
+        client.post("/expenses/bulk", json={"expenses": [
+            {"date": "2026-03-08", "category": "health", "description": "x", "amount": 2, "user_id": 1}
+        ]})
+        rolling = client.get("/analytics/rolling", params={"username": "default_user", "days": 3, "end_date": "2026-03-10"}).json()
+    assert [day["spent"] for day in rolling["series"]] == [2.0, 1.0, 20.0]
+    # an edit makes the next request read them again
+    client.put(f"/expenses/{last}", json={"date": "2026-03-10", "category": "food", "description": "x", "amount": 30, "user_id": 1})
+    rolling = client.get("/analytics/rolling", params={"username": "default_user", "days": 3, "end_date": "2026-03-10"}).json()
+    assert rolling["series"][-1]["spent_7d"] == 38.0
+
+    for amount in [10, 11, 12, 10, 11, 500]:
+        add("2026-01-15", "entertainment", amount)
+    iqr = client.get("/analytics/outliers", params={"username": "default_user", "method": "iqr"}).json()["outliers"]
+    assert [(o["category"], o["amount"]) for o in iqr] == [("entertainment", 500.0)]
+    # six expenses can be at most 2.04 standard deviations from their mean
+    assert client.get("/analytics/outliers", params={"username": "default_user"}).json()["outliers"] == []
+    zscore = client.get("/analytics/outliers", params={"username": "default_user", "threshold": 2}).json()["outliers"]
+    assert [o["amount"] for o in zscore] == [500.0] and zscore[0]["date"] == "2026-01-15"
+    assert client.get("/analytics/outliers", params={"username": "default_user", "method": "mad"}).status_code == 400
+    assert client.get("/analytics/forecast", params={"username": "nobody"}).status_code == 404
+
+def test_expense_insights_follow_writes():
+    from sketches import verify_sketches
+    base = {"date": str(date.today()), "description": "x", "user_id": 1}
+    ids = [client.post("/expenses/", json={**base, "category": "food", "amount": amount}).json()["expense"]["id"]
+           for amount in range(1, 21)]
+    client.post("/expenses/bulk", json={"expenses": [{**base, "category": "health", "amount": 40}, {**base, "category": "health", "amount": 60}]})
+
+    data = client.get("/expenses/insights", params={"username": "default_user"}).json()
+    assert data["categories"] == [
+        {"category": "food", "count": 20, "median": 10.0, "p90": 18.0, "p99": 20.0},
+        {"category": "health", "count": 2, "median": 40.0, "p90": 60.0, "p99": 60.0},
+    ]
+    check = client.get("/expenses/insights", params={"username": "default_user", "category": "Food", "amount": 25}).json()["check"]
+    assert check == {"category": "food", "amount": 25.0, "percentile": 100.0, "unusual": True}
+    typical = client.get("/expenses/insights", params={"username": "default_user", "category": "food", "amount": 10}).json()["check"]
+    assert (typical["percentile"], typical["unusual"]) == (50.0, False)
+    # too few health expenses to call anything unusual
+    assert not client.get("/expenses/insights", params={"username": "default_user", "category": "health", "amount": 900}).json()["check"]["unusual"]
+
+    # edits and deletes rebuild the sketch of the categories they touch
+    client.put(f"/expenses/{ids[-1]}", json={**base, "category": "health", "amount": 50})
+    client.delete(f"/expenses/{ids[0]}")
+    categories = client.get("/expenses/insights", params={"username": "default_user"}).json()["categories"]
+    assert categories[0] == {"category": "food", "count": 18, "median": 10.0, "p90": 18.0, "p99": 19.0}
+    assert categories[1]["count"] == 3 and categories[1]["median"] == 50.0
+    db = TestingSessionLocal()
+    try:
+        assert verify_sketches(db) == []
+    finally:
+        db.close()
+    assert client.get("/expenses/insights", params={"username": "default_user", "category": "food"}).status_code == 400
+    assert client.get("/expenses/insights", params={"username": "nobody"}).status_code == 404
+
+def test_categories_are_normalized_and_per_user():
+    from tests.DBMODELS_TEST import Category
+    base = {"date": str(date.today()), "description": "cat", "user_id": 1}
+    first = client.post("/expenses/", json={**base, "category": "Food ", "amount": 10})
+    assert first.json()["expense"]["category"] == "food"
+    client.post("/expenses/", json={**base, "category": "  PETS", "amount": 4})
+    client.post("/expenses/", json={**base, "category": "pets", "amount": 6})
+    response = client.get("/expenses/total_by_category/", params={"category": "Pets"})
+    assert response.json()["total_amount"] == 10
+    assert client.get("/expenses/total_by_category/", params={"category": "unknown"}).json()["total_amount"] == 0
+    db = TestingSessionLocal()
+    try:
+        # one global food, one pets of user 1 - the name is stored once, not per expense
+        pets = db.query(Category).filter(Category.name == "pets").all()
+        assert [(category.user_id, category.id > 4) for category in pets] == [(1, True)]
+    finally:
+        db.close()
+    listed = client.get("/expenses/", params={"username": "default_user"}).json()["expenses"]
+    assert sorted(expense["category"] for expense in listed) == ["food", "pets", "pets"]
+
+def test_add_expenses_bulk_success():
+    from rollup import verify_rollup
+    payload = {"expenses": [
+        {"date": f"2025-01-{day:02d}", "category": "food", "description": f"row {day}",
+         "amount": float(day), "user_id": 1}
+        for day in range(1, 29)
+    ]}
+    with patch("routes.BULK_CHUNK_SIZE", 10):
+        response = client.post("/expenses/bulk", json=payload)
+    assert response.status_code == 200, response.text
+    assert response.json()["inserted"] == 28
+    data = client.get("/expenses/", params={"username": "default_user", "limit": 100}).json()
+    assert len(data["expenses"]) == 28
+    db = TestingSessionLocal()
+    try:
+        assert verify_rollup(db) == []
+    finally:
+        db.close()
+
+def test_add_expenses_bulk_reports_row_errors():
+    payload = {"expenses": [
+        {"date": "2025-01-01", "category": "food", "description": "ok", "amount": 1.0, "user_id": 1},
+        {"date": "2025-01-02", "category": "food", "description": "negative", "amount": -1.0, "user_id": 1},
+        {"date": "2025-01-03", "category": "food", "description": "no user", "amount": 1.0},
+        {"date": "2025-01-04", "category": "food", "description": "unknown user", "amount": 1.0, "user_id": 999},
+    ]}
+    response = client.post("/expenses/bulk", json=payload)
+    assert response.status_code == 400
+    errors = response.json()["detail"]["errors"]
+    assert [e["index"] for e in errors] == [1, 2, 3]
+    data = client.get("/expenses/", params={"username": "default_user"}).json()
+    assert data["expenses"] == []
+
+def test_export_expenses_csv():
+    for day in (3, 1, 2):
+        client.post("/expenses/", json={
+            "date": f"2025-01-0{day}", "category": "food", "description": f"day {day}",
+            "amount": float(day), "user_id": 1
+        })
+    with patch("export.EXPORT_BATCH_SIZE", 2):
+        response = client.get("/expenses/export", params={"username": "default_user", "format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "id,date,category,description,amount"
+    assert [line.split(",")[1] for line in lines[1:]] == ["2025-01-01", "2025-01-02", "2025-01-03"]
+
+def test_export_expenses_ndjson_date_range():
+    import json
+    for day in (1, 2, 3):
+        client.post("/expenses/", json={
+            "date": f"2025-01-0{day}", "category": "food", "description": f"day {day}",
+            "amount": float(day), "user_id": 1
+        })
+    response = client.get("/expenses/export", params={
+        "username": "default_user", "format": "ndjson", "start_date": "2025-01-02"
+    })
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["description"] for row in rows] == ["day 2", "day 3"]
+
+def test_export_expenses_invalid_format():
+    response = client.get("/expenses/export", params={"username": "default_user", "format": "xml"})
+    assert response.status_code == 400
+
+def test_monthly_rollup_follows_add_update_delete():
+    from rollup import verify_rollup
+    today = date.today()
+    first = client.post("/expenses/", json={
+        "date": str(today), "category": "food", "description": "a", "amount": 10.0, "user_id": 1
+    }).json()["expense"]
+    second = client.post("/expenses/", json={
+        "date": str(today), "category": "food", "description": "b", "amount": 20.0, "user_id": 1
+    }).json()["expense"]
+    data = client.get("/expenses/monthly/default_user").json()
+    assert data == {"total": 30.0, "breakdown": {"food": 30.0}}
+
+    # move the second expense to another month and category
+    last_month = today.replace(day=1) - timedelta(days=1)
+    client.put(f"/expenses/{second['id']}", json={
+        "date": str(last_month), "category": "transport", "description": "b", "amount": 25.0, "user_id": 1
+    })
+    data = client.get("/expenses/monthly/default_user").json()
+    assert data == {"total": 10.0, "breakdown": {"food": 10.0}}
+
+    client.delete(f"/expenses/{first['id']}")
+    data = client.get("/expenses/monthly/default_user").json()
+    assert data == {"total": 0, "breakdown": {}}
+
+    db = TestingSessionLocal()
+    try:
+        assert verify_rollup(db) == []
+    finally:
+        db.close()
+
+def test_rollup_rebuild_fixes_drift():
+    from rollup import verify_rollup, rebuild_rollup
+    from tests.DBMODELS_TEST import ExpenseMonthlyTotal
+    client.post("/expenses/", json={
+        "date": "2025-01-10", "category": "food", "description": "a", "amount": 10.0, "user_id": 1
+    })
+    db = TestingSessionLocal()
+    try:
+        db.query(ExpenseMonthlyTotal).update({"total": 999.0})
+        db.commit()
+        assert len(verify_rollup(db)) == 1
+        assert rebuild_rollup(db) == 1
+        assert verify_rollup(db) == []
+    finally:
+        db.close()
+
+def test_async_route_adapter():
+    import inspect
+    from fastapi import FastAPI
+    from sqlalchemy.pool import NullPool
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from async_db import make_async_route
+    import routes
+
+    async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+    AsyncTestingSession = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def get_test_async_db():
+        async with AsyncTestingSession() as db:
+            yield db
+
+    add_route = make_async_route(routes.add_expense, get_test_async_db)
+    monthly_route = make_async_route(routes.get_monthly_expenses, get_test_async_db)
+    assert inspect.iscoroutinefunction(add_route)
+
+    async_app = FastAPI()
+    async_app.add_api_route("/expenses/", add_route, methods=["POST"])
+    async_app.add_api_route("/expenses/monthly/{username}", monthly_route, methods=["GET"])
+    async_client = TestClient(async_app)
+
+    response = async_client.post("/expenses/", json={
+        "date": str(date.today()), "category": "food", "description": "async", "amount": 12.5, "user_id": 1
+    })
+    assert response.status_code == 200, response.text
+    assert response.json()["expense"]["description"] == "async"
+    assert async_client.get("/expenses/monthly/default_user").json() == {"total": 12.5, "breakdown": {"food": 12.5}}
+    assert async_client.get("/expenses/monthly/noexist").status_code == 404
+
+def test_health_and_readiness_probes():
+    import health
+    from sqlalchemy import text
+    from DataBase.database import engine as app_engine
+    from DataBase.migrations import LATEST_VERSION, migrate
+    assert client.get("/healthz").json() == {"status": "ok"}
+
+    health._schema_ready = False
+    with app_engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["schema_version"] == 0
+
+    # the tables exist already, so every step finds nothing to do but is recorded
+    migrate(app_engine)
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json() == {"database": "ok", "schema_version": LATEST_VERSION, "status": "ready"}
+    assert migrate(app_engine) == []
+
+def test_migrate_baseline_database_with_blank_category(tmp_path):
+    from sqlalchemy import create_engine, text
+    from DataBase.migrations import LATEST_VERSION, current_version, migrate
+    bind = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    # the schema before the migrations, with rows its unvalidated form could store
+    with bind.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, "
+            "fullname VARCHAR(100) NOT NULL, password VARCHAR(255) NOT NULL, email VARCHAR(255) NOT NULL UNIQUE)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE expenses (id INTEGER PRIMARY KEY, date DATE NOT NULL, category VARCHAR(50) NOT NULL, "
+            "description VARCHAR(255), amount FLOAT NOT NULL, user_id INTEGER NOT NULL REFERENCES users (id))"
+        ))
+        conn.execute(text("INSERT INTO users VALUES (1, 'legacy', 'Legacy User', 'x', 'legacy@test.com')"))
+        conn.execute(text(
+            "INSERT INTO expenses (date, category, description, amount, user_id) VALUES "
+            "('2024-01-05', '', 'blank', 10, 1), ('2024-01-06', '   ', 'spaces', 5, 1), "
+            "('2024-01-07', 'Food ', 'lunch', 7, 1)"
+        ))
+    migrate(bind)
+    assert current_version(bind) == LATEST_VERSION
+    with bind.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT e.description, c.name FROM expenses e JOIN categories c ON c.id = e.category_id ORDER BY e.id"
+        )).all()
+        totals = conn.execute(text(
+            "SELECT c.name, t.total FROM expense_monthly_totals t JOIN categories c ON c.id = t.category_id"
+        )).all()
+    assert rows == [("blank", "uncategorized"), ("spaces", "uncategorized"), ("lunch", "food")]
+    assert sorted(totals) == [("food", 7.0), ("uncategorized", 15.0)]
+    bind.dispose()
+
+def test_wait_for_database_backs_off():
+    from sqlalchemy.exc import OperationalError
+    from DataBase import database
+    failure = OperationalError("SELECT 1", {}, Exception("connection refused"))
+    with patch.object(database, "ping", side_effect=[failure, failure, None]), \
+            patch.object(database.time, "sleep") as sleep:
+        database.wait_for_database(timeout=5, first_delay=0.1)
+    assert [call.args[0] for call in sleep.call_args_list] == [0.1, 0.2]
+    with patch.object(database, "ping", side_effect=failure), pytest.raises(OperationalError):
+        database.wait_for_database(timeout=0.05, first_delay=0.01)
+
+def test_internal_pool_status():
+    client.get("/expenses/", params={"username": "default_user"})
+    response = client.get("/internal/pool")
+    assert response.status_code == 200
+    data = response.json()["sync"]
+    assert data["pool_class"] == "InstrumentedQueuePool"
+    assert data["checkouts"] >= 1
+    assert data["checked_out"] == 0
+    assert data["connection_errors"] == 0
+
+def test_engine_options_from_env(monkeypatch):
+    from DataBase.database import engine_options
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_ECHO", "true")
+    options = engine_options("mysql+pymysql://root:password@db/expenses_db")
+    assert options["pool_size"] == 20
+    assert options["max_overflow"] == 0
+    assert options["echo"] is True
+    assert options["pool_pre_ping"] is True
+    monkeypatch.delenv("DB_ECHO")
+    assert engine_options("sqlite:///:memory:") == {"echo": False, "pool_pre_ping": True, "pool_recycle": 1800}
+
+def metric_value(text, series):
+    for line in text.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+def test_metrics_per_route_and_queries_per_request():
+    route = 'route="/expenses/monthly/{username}"'
+    before = client.get("/metrics").text
+    client.get("/expenses/monthly/default_user")
+    client.get("/expenses/monthly/noexist")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+
+    # labelled by the route template, not the username
+    ok = f'http_requests_total{{method="GET",{route},status="200"}}'
+    missing = f'http_requests_total{{method="GET",{route},status="404"}}'
+    assert metric_value(text, ok) - metric_value(before, ok) == 1
+    assert metric_value(text, missing) - metric_value(before, missing) == 1
+    assert "noexist" not in text
+
+    count = f'db_queries_per_request_count{{method="GET",{route}}}'
+    assert metric_value(text, count) - metric_value(before, count) == 2
+    queries = f'db_queries_total{{{route}}}'
+    assert metric_value(text, queries) > metric_value(before, queries)
+    assert f'http_request_duration_seconds_bucket{{method="GET",{route},le="+Inf"}}' in text
+    # the scrape itself is the only request in flight
+    assert metric_value(text, "http_requests_in_flight") == 1
+    client.get("/nope")
+    assert 'route="unmatched",status="404"' in client.get("/metrics").text
+
+def test_log_records_carry_request_context():
+    import json
+    import logging
+    import queue
+    from logs import StructuredQueueHandler, JsonFormatter
+    records = queue.Queue()
+    handler = StructuredQueueHandler(records, sample_rates={})
+    request_logger = logging.getLogger("request")
+    request_logger.addHandler(handler)
+    request_logger.setLevel(logging.DEBUG)
+    try:
+        response = client.get("/expenses/recent/default_user", headers={"X-Request-ID": "req-42"})
+    finally:
+        request_logger.removeHandler(handler)
+        request_logger.setLevel(logging.NOTSET)
+    assert response.headers["x-request-id"] == "req-42"
+    assert client.get("/expenses/recent/default_user").headers["x-request-id"] != "req-42"
+
+    entry = json.loads(JsonFormatter().format(records.get_nowait()))
+    assert entry["msg"] == "request" and entry["level"] == "DEBUG"
+    assert entry["request_id"] == "req-42"
+    assert entry["route"] == "/expenses/recent/{username}"
+    assert entry["user_id"] == 1
+    assert entry["status"] == 200 and entry["duration_ms"] >= 0
+
+def test_log_queue_is_bounded_and_sampled():
+    import logging
+    import queue
+    from logs import StructuredQueueHandler, parse_sample_rates
+    assert parse_sample_rates("DEBUG=0.25, info=2") == {logging.DEBUG: 0.25, logging.INFO: 1.0}
+    handler = StructuredQueueHandler(queue.Queue(maxsize=2), sample_rates={logging.DEBUG: 0.0}, block_timeout=0.01)
+    logger = logging.Logger("bounded")
+    logger.addHandler(handler)
+    logger.debug("sampled away")
+    for i in range(3):
+        logger.info("line %d", i)
+    logger.error("full queue")
+    assert handler.stats() == {"queued": 2, "max_size": 2, "dropped": 2, "sampled_out": 1}
+    assert handler.queue.get_nowait().msg == "line 0"
+
+def test_slow_query_log_explain_and_file(tmp_path):
+    import json
+    from slow_queries import slow_query_log
+    log_file = tmp_path / "slow.log"
+    slow_query_log.configure(threshold_ms=0, path=str(log_file))
+    try:
+        client.get("/expenses/", params={"username": "default_user", "category": "food"})
+        assert slow_query_log.process_pending() >= 1
+        data = client.get("/internal/slow-queries").json()
+    finally:
+        slow_query_log.configure(threshold_ms=None, path="")
+        slow_query_log.clear()
+    assert data["stats"]["enabled"] is True
+    query = next(q for q in data["queries"] if "FROM expenses" in q["sql"])
+    assert query["route"] == "/expenses/"
+    # the username is text - only its type and length are kept
+    lookup = next(q for q in data["queries"] if "FROM users" in q["sql"])
+    assert "<redacted str(12)>" in lookup["params"]
+    assert "default_user" not in json.dumps([q["params"] for q in data["queries"]])
+    assert any("expenses" in step for step in query["plan"])
+    written = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert any(entry["sql"] == query["sql"] and entry["plan"] == query["plan"] for entry in written)
+    # off again: nothing is recorded
+    client.get("/expenses/recent/default_user")
+    assert slow_query_log.entries() == []
+
 # ----------------------------------------------------------------------------
 # Examples for testing the Budgets endpoints
 # ----------------------------------------------------------------------------
@@ -248,6 +779,41 @@ def test_get_budget_status_success():
     assert data["total_expenses"] == 700.0
     assert data["remaining_budget"] == 1300.0
 
+def test_add_budget_twice_updates_the_month():
+    from tests.DBMODELS_TEST import MonthlyBudget
+    first = client.post("/budgets/", json={"year": 2025, "month": 3, "budget": 100.0, "user_id": 1}).json()
+    second = client.post("/budgets/", json={"year": 2025, "month": 3, "budget": 250.0, "user_id": 1}).json()
+    assert second["budget"]["id"] == first["budget"]["id"]
+    assert second["budget"]["budget"] == 250.0
+    db = TestingSessionLocal()
+    try:
+        assert db.query(MonthlyBudget).count() == 1
+    finally:
+        db.close()
+    assert client.post("/budgets/", json={"year": 2025, "month": 13, "budget": 1.0}).status_code == 400
+
+def test_year_budgets_and_status():
+    plan = [1000.0 + month for month in range(12)]
+    response = client.put("/budgets/2024", json={"budgets": plan, "user_id": 1})
+    assert response.status_code == 200
+    saved = response.json()["budgets"]
+    assert [row["month"] for row in saved] == list(range(1, 13))
+    assert saved[1]["budget"] == 1001.0
+    client.post("/expenses/", json={"date": "2024-02-10", "category": "food", "description": "x", "amount": 40.0, "user_id": 1})
+
+    status = client.get("/budgets/2024/status", params={"user_id": 1}).json()
+    assert status["year"] == 2024
+    assert len(status["months"]) == 12
+    assert status["months"][1] == {"year": 2024, "month": 2, "monthly_budget": 1001.0,
+                                   "total_expenses": 40.0, "remaining_budget": 961.0}
+    assert status["months"][0]["total_expenses"] == 0
+
+    # saving the year again replaces it; a year without budgets lists them as None
+    client.put("/budgets/2024", json={"budgets": [5.0] * 12, "user_id": 1})
+    assert client.get("/budgets/2024/status", params={"user_id": 1}).json()["months"][1]["monthly_budget"] == 5.0
+    assert client.get("/budgets/2023/status", params={"user_id": 1}).json()["months"][0]["monthly_budget"] is None
+    assert client.put("/budgets/2024", json={"budgets": [5.0] * 11}).status_code == 400
+
 # ----------------------------------------------------------------------------
 # Examples for testing the Users endpoints
 # ----------------------------------------------------------------------------
@@ -275,6 +841,23 @@ def test_create_user_success():
     assert data["message"] == "User created"
     assert data["user"].get("id") is not None
 
+def test_user_responses_leave_out_password_hash():
+    created = client.post("/users/", json={
+        "username": "hashless", "fullname": "No Hash", "email": "hashless@test.com", "password": "Abcd1234"
+    }).json()["user"]
+    assert set(created) == {"id", "username", "fullname", "email"}
+    updated = client.put(f"/users/update-profile/{created['id']}", params={
+        "fullname": "Renamed", "username": "hashless2", "email": "hashless@test.com"
+    }).json()["user"]
+    assert updated == {"id": created["id"], "username": "hashless2", "fullname": "Renamed", "email": "hashless@test.com"}
+
+def test_fast_json_matches_fastapi_rendering():
+    from fastapi.responses import JSONResponse
+    from dto import ExpenseRow, FastJSONResponse
+    rows = [ExpenseRow(1, date(2025, 3, 1), "food", "pizza \u05d0", 12.5, 1), ExpenseRow(2, date(2025, 3, 2), "health", None, 3.0, 1)]
+    expected = JSONResponse({"expenses": [row.to_dict() for row in rows], "next_cursor": None}).body
+    assert FastJSONResponse({"expenses": rows, "next_cursor": None}).body == expected
+
 def test_delete_user_not_found():
     payload = {
         "username": "noexist",
@@ -299,6 +882,36 @@ def test_delete_user_success():
     data = response.json()
     assert data["message"] == "User deleted successfully"
 
+def test_deleted_user_categories_are_not_reused():
+    from tests.DBMODELS_TEST import Category, User
+    bob = {"username": "bob", "fullname": "Bob", "email": "bob@test.com", "password": "Abcd1234"}
+    bob_id = client.post("/users/", json=bob).json()["user"]["id"]
+    expense = {"date": str(date.today()), "description": "x", "amount": 5.0}
+    client.post("/expenses/", json={**expense, "category": "pets", "user_id": bob_id})
+    assert client.request("DELETE", "/users/", json=bob).status_code == 200
+    client.post("/expenses/", json={**expense, "category": "travel", "user_id": 1})
+
+    # a new user that gets the deleted user's id back (ids are not reused by the app
+    # itself, so it is inserted with an explicit id)
+    db = TestingSessionLocal()
+    try:
+        db.add(User(id=bob_id, username="carol", fullname="Carol", password="x", email="carol@test.com"))
+        db.commit()
+    finally:
+        db.close()
+    saved = client.post("/expenses/", json={**expense, "category": "pets", "user_id": bob_id}).json()["expense"]
+    assert saved["category"] == "pets"
+    db = TestingSessionLocal()
+    try:
+        ids = {(row.user_id, row.name): row.id for row in db.query(Category).filter(Category.user_id.isnot(None))}
+    finally:
+        db.close()
+    assert ids == {(1, "travel"): ids[(1, "travel")], (bob_id, "pets"): ids[(bob_id, "pets")]}
+    # bob's category id (5, the first after the defaults) was not handed out again
+    assert 5 not in ids.values()
+    listed = client.get("/expenses/", params={"username": "default_user"}).json()["expenses"]
+    assert [row["category"] for row in listed] == ["travel"]
+
 def test_login_bad_credentials():
     payload = {"username": "nouser", "password": "WrongPass"}
     response = client.post("/login/", json=payload)
@@ -323,6 +936,40 @@ def test_login_success():
         data = response.json()
         assert data["username"] == "tester"
 
+def test_login_rehashes_outdated_bcrypt_cost():
+    from passlib.context import CryptContext
+    from tests.DBMODELS_TEST import User
+    import security
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("Abcd1234")
+    db = TestingSessionLocal()
+    try:
+        db.add(User(username="old_cost", fullname="Old Cost", email="old_cost@test.com", password=old_hash))
+        db.commit()
+    finally:
+        db.close()
+    response = client.post("/login/", json={"username": "old_cost", "password": "Abcd1234"})
+    assert response.status_code == 200
+    db = TestingSessionLocal()
+    try:
+        new_hash = db.query(User).filter(User.username == "old_cost").first().password
+    finally:
+        db.close()
+    assert new_hash != old_hash
+    assert new_hash.startswith(f"$2b${security.BCRYPT_ROUNDS:02d}$")
+    response = client.post("/login/", json={"username": "old_cost", "password": "Abcd1234"})
+    assert response.status_code == 200
+
+def test_password_pool_full_returns_503():
+    import threading
+    full = threading.BoundedSemaphore(1)
+    full.acquire()
+    with patch("security._slots", full):
+        response = client.post("/users/", json={
+            "username": "busy", "fullname": "Busy", "email": "busy@test.com", "password": "Abcd1234"
+        })
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
 def test_logout():
     response = client.post("/logout/")
     assert response.status_code == 200
@@ -356,6 +1003,234 @@ def test_update_user_profile_success():
     data = response.json()
     assert data["message"] == "Profile updated successfully"
 
+def test_user_id_cache_hit_and_rename_invalidation():
+    assert client.get("/expenses/monthly/default_user").status_code == 200
+    before = client.get("/internal/user-cache").json()
+    assert client.get("/expenses/recent/default_user").status_code == 200
+    after = client.get("/internal/user-cache").json()
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+    response = client.put("/users/update-profile/1", params={
+        "fullname": "Renamed", "username": "renamed_user", "email": "renamed@test.com"
+    })
+    assert response.status_code == 200
+    assert client.get("/expenses/monthly/default_user").status_code == 404
+    assert client.get("/expenses/monthly/renamed_user").status_code == 200
+
+def test_user_id_cache_delete_invalidation():
+    user_payload = {
+        "username": "cached_user",
+        "fullname": "Cached User",
+        "email": "cached@test.com",
+        "password": "Abcd1234"
+    }
+    client.post("/users/", json=user_payload)
+    assert client.get("/expenses/monthly/cached_user").status_code == 200
+    client.request("DELETE", "/users/", json=user_payload)
+    assert client.get("/expenses/monthly/cached_user").status_code == 404
+
+def test_local_user_id_cache_lru_and_ttl():
+    from user_cache import LocalUserIdCache
+    cache = LocalUserIdCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)  # evicts b, the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    expired = LocalUserIdCache(max_size=2, ttl=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is None
+
+def test_dashboard_etag_and_cached_reads():
+    from sqlalchemy import event
+    from DataBase.database import engine as app_engine
+    first = client.get("/expenses/recent/default_user")
+    etag = first.headers["etag"]
+    assert first.status_code == 200
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(app_engine, "before_cursor_execute", count)
+    try:
+        not_modified = client.get("/expenses/recent/default_user", headers={"If-None-Match": etag})
+        cached = client.get("/expenses/recent/default_user")
+    finally:
+        event.remove(app_engine, "before_cursor_execute", count)
+    assert not_modified.status_code == 304
+    assert cached.status_code == 200 and cached.json() == first.json()
+    assert statements == []
+
+    # a write bumps the version: new ETag, fresh data
+    client.post("/expenses/", json={
+        "date": str(date.today()), "category": "food", "description": "new", "amount": 5.0, "user_id": 1
+    })
+    response = client.get("/expenses/recent/default_user", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()[0]["description"] == "new"
+    assert client.get("/internal/response-cache").json()["not_modified"] == 1
+
+def test_dashboard_composes_widgets_in_few_queries():
+    from sqlalchemy import event
+    from DataBase.database import engine as app_engine
+    today = date.today()
+    client.post("/expenses/", json={
+        "date": str(today), "category": "food", "description": "lunch", "amount": 40.0, "user_id": 1
+    })
+    client.post("/budgets/", json={"year": today.year, "month": today.month, "budget": 100.0, "user_id": 1})
+    client.get("/expenses/recent/default_user")  # warms the username cache
+
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(app_engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/dashboard/default_user")
+    finally:
+        event.remove(app_engine, "before_cursor_execute", count)
+    assert response.status_code == 200
+    assert len(statements) <= 3
+    data = response.json()
+    assert data["recent"][0]["description"] == "lunch"
+    assert data["monthly"] == {"total": 40.0, "breakdown": {"food": 40.0}}
+    assert data["last_6_months"][0] == {"month": today.strftime("%Y-%m"), "spent": 40.0, "budget": 100.0}
+    assert len(data["last_6_months"]) == 6
+    assert data["budget_status"]["remaining_budget"] == 60.0
+
+def test_dashboard_field_selection():
+    data = client.get("/dashboard/default_user", params={"fields": "monthly,budget_status"}).json()
+    assert set(data) == {"monthly", "budget_status"}
+    assert data["budget_status"] is None
+    assert client.get("/dashboard/default_user", params={"fields": "monthly,nope"}).status_code == 400
+    assert client.get("/dashboard/noexist").status_code == 404
+
+def test_timeseries_zero_filled_with_categories_and_budget():
+    for day, category, amount in [("2024-01-15", "food", 10.0), ("2024-01-20", "transport", 5.0), ("2024-03-02", "food", 7.0)]:
+        client.post("/expenses/", json={"date": day, "category": category, "description": "x", "amount": amount, "user_id": 1})
+    client.post("/budgets/", json={"year": 2024, "month": 2, "budget": 100.0, "user_id": 1})
+
+    response = client.get("/expenses/timeseries", params={
+        "username": "default_user", "granularity": "month", "start_date": "2023-12-10",
+        "end_date": "2024-03-31", "by_category": True, "budget": True
+    })
+    assert response.status_code == 200
+    series = response.json()["series"]
+    assert [point["period"] for point in series] == ["2023-12", "2024-01", "2024-02", "2024-03"]
+    assert [point["spent"] for point in series] == [0, 15.0, 0, 7.0]
+    assert series[1]["categories"] == {"food": 10.0, "transport": 5.0}
+    assert [point["budget"] for point in series] == [0, 0, 100.0, 0]
+
+    quarters = client.get("/expenses/timeseries", params={
+        "username": "default_user", "granularity": "quarter", "periods": 2, "end_date": "2024-03-31", "budget": True
+    }).json()["series"]
+    assert [(point["period"], point["spent"], point["budget"]) for point in quarters] == [
+        ("2023-Q4", 0, 0), ("2024-Q1", 22.0, 100.0)
+    ]
+
+def test_timeseries_day_and_week_buckets():
+    for day, amount in [("2024-01-01", 1.0), ("2024-01-07", 2.0), ("2024-01-08", 4.0)]:
+        client.post("/expenses/", json={"date": day, "category": "food", "description": "x", "amount": amount, "user_id": 1})
+    weeks = client.get("/expenses/timeseries", params={
+        "username": "default_user", "granularity": "week", "periods": 3, "end_date": "2024-01-10"
+    }).json()["series"]
+    assert [(point["period"], point["start"], point["spent"]) for point in weeks] == [
+        ("2023-W52", "2023-12-25", 0), ("2024-W01", "2024-01-01", 3.0), ("2024-W02", "2024-01-08", 4.0)
+    ]
+    days = client.get("/expenses/timeseries", params={
+        "username": "default_user", "granularity": "day", "start_date": "2024-01-06", "end_date": "2024-01-08"
+    }).json()["series"]
+    assert [point["spent"] for point in days] == [0, 2.0, 4.0]
+
+def test_timeseries_invalid_requests():
+    params = {"username": "default_user"}
+    assert client.get("/expenses/timeseries", params={**params, "granularity": "hour"}).status_code == 400
+    assert client.get("/expenses/timeseries", params={**params, "granularity": "day", "budget": True}).status_code == 400
+    assert client.get("/expenses/timeseries", params={**params, "start_date": "2024-02-01", "end_date": "2024-01-01"}).status_code == 400
+    assert client.get("/expenses/timeseries", params={**params, "granularity": "day", "periods": 100000}).status_code == 400
+    assert client.get("/expenses/timeseries", params={"username": "noexist"}).status_code == 404
+
+def request_recovery_code(email, code_offset):
+    # code is 100000 + secrets.randbelow(...)
+    with patch("recovery.secrets.randbelow", return_value=code_offset):
+        response = client.post("/users/forgot-password", json=email)
+    assert response.status_code == 200
+    return str(100000 + code_offset)
+
+def test_recovery_code_flow_and_single_use():
+    client.post("/users/", json={"username": "recover_me", "fullname": "Recover Me",
+                                 "email": "recover@test.com", "password": "Abcd1234"})
+    code = request_recovery_code("recover@test.com", 4242)
+    reset = {"email": "recover@test.com", "new_password": "Newpass123", "confirm_password": "Newpass123"}
+    # the request only queued the mail
+    db = TestingSessionLocal()
+    queued = db.query(DBMODELS_TEST.EmailOutbox).filter_by(recipient="recover@test.com").one()
+    assert queued.status == "pending" and code in queued.body
+    db.close()
+
+    response = client.post("/users/reset-password", json={**reset, "recovery_code": "000000"})
+    assert response.json()["detail"] == "Invalid recovery code"
+    response = client.post("/users/reset-password", json={**reset, "recovery_code": code})
+    assert response.status_code == 200
+    response = client.post("/users/reset-password", json={**reset, "recovery_code": code})
+    assert response.json()["detail"] == "Recovery code not requested or expired"
+    assert client.post("/login/", json={"username": "recover_me", "password": "Newpass123"}).status_code == 200
+
+def test_recovery_code_attempt_limit():
+    from recovery_store import RECOVERY_MAX_ATTEMPTS
+    client.post("/users/", json={"username": "recover_me", "fullname": "Recover Me",
+                                 "email": "recover@test.com", "password": "Abcd1234"})
+    code = request_recovery_code("recover@test.com", 1)
+    reset = {"email": "recover@test.com", "new_password": "Newpass123", "confirm_password": "Newpass123"}
+    for _ in range(RECOVERY_MAX_ATTEMPTS):
+        client.post("/users/reset-password", json={**reset, "recovery_code": "999999"})
+    response = client.post("/users/reset-password", json={**reset, "recovery_code": code})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Too many attempts, request a new recovery code"
+
+@pytest.mark.parametrize("kind", ["memory", "database"])
+def test_recovery_store_expiry_and_sweep(kind):
+    from recovery_store import make_recovery_store, EXPIRED, MISSING, OK
+    store = make_recovery_store(kind)
+    store.ttl = -1
+    store.issue("a@test.com", "123456")
+    store.issue("b@test.com", "123456")
+    assert store.redeem("a@test.com", "123456") == EXPIRED
+    assert store.sweep() == 1
+    assert store.redeem("b@test.com", "123456") == MISSING
+    store.ttl = 60
+    store.issue("a@test.com", "123456")
+    assert store.sweep() == 0
+    assert store.redeem("a@test.com", "123456") == OK
+
+def test_recovery_store_keeps_keyed_hashes():
+    import hashlib
+    from recovery_store import MemoryRecoveryCodeStore, OK
+    store = MemoryRecoveryCodeStore(secret="")
+    store.issue("a@test.com", "123456")
+    assert store._codes["a@test.com"][0] != hashlib.sha256(b"123456").hexdigest()
+    # without a secret every process makes up its own key
+    other = MemoryRecoveryCodeStore(secret="")
+    other.issue("a@test.com", "123456")
+    assert other._codes["a@test.com"][0] != store._codes["a@test.com"][0]
+    assert store.redeem("a@test.com", "123456") == OK
+
+def test_recovery_needs_a_secret_with_the_database_store():
+    from recovery_store import DatabaseRecoveryCodeStore, RecoveryNotConfigured, recovery_codes
+    store = DatabaseRecoveryCodeStore(session_factory=TestingSessionLocal, secret="")
+    with pytest.raises(RecoveryNotConfigured):
+        store.issue("a@test.com", "123456")
+    client.post("/users/", json={"username": "recover_me", "fullname": "Recover Me",
+                                 "email": "recover@test.com", "password": "Abcd1234"})
+    with patch.object(recovery_codes, "backend", store):
+        response = client.post("/users/forgot-password", json="recover@test.com")
+    assert response.status_code == 503
+    db = TestingSessionLocal()
+    assert db.query(DBMODELS_TEST.EmailOutbox).filter_by(recipient="recover@test.com").count() == 0
+    db.close()
+
 def test_update_password_incorrect_old():
     user_payload = {
         "username": "user_pass",